@@ -0,0 +1,322 @@
+
+"""     Fast Start Example #10 - Watch-Folder Ingestion Daemon
+
+    This example keeps a library continuously up to date with one or more folders, instead of having an
+    operator re-run `add_files` by hand:
+
+    1.  Watch the folders for created / modified / deleted / moved files (watchdog).
+    2.  Debounce the file events - a file is only picked up once it has been quiet for a few seconds, so
+        half-copied files are not parsed.
+    3.  Ingest the changed files in micro-batches - parse + text index with `add_files`, then embed only the
+        new blocks with the embedding model that is loaded once for the life of the daemon.
+    4.  Track the lag - time from the first file event to the document being queryable through `Query`.
+
+    Note: to run this example, you will need watchdog and the dependencies for the embedding model:
+
+        `pip3 install watchdog`
+        `pip3 install torch`
+        `pip3 install transformers`
+
+"""
+
+import os
+import sys
+import time
+import shutil
+import threading
+
+from llmware.library import Library
+from llmware.models import ModelCatalog
+from llmware.embeddings import EmbeddingHandler
+from llmware.configs import LLMWareConfig
+from importlib import util
+
+if not util.find_spec("watchdog"):
+    print("\nto run this example, please install watchdog: `pip3 install watchdog`")
+    sys.exit(1)
+
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+
+from ingest_ext import source_name, remove_document_from_library, stage_files
+
+
+class _FolderEventHandler(FileSystemEventHandler):
+
+    """ Records the time of the first and the latest event per file path - the daemon does the rest. """
+
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.daemon.register_event(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.daemon.register_event(event.src_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.daemon.register_event(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.daemon.register_event(event.src_path)
+            self.daemon.register_event(event.dest_path)
+
+
+class FolderIngestionDaemon:
+
+    """ Long-running ingestion loop on top of a Library - watches folders, debounces the file events and
+    ingests + embeds the changed files in micro-batches. """
+
+    def __init__(self, library_name, watch_folders, embedding_model_name=None, vector_db=None,
+                 debounce_secs=2.0, batch_size=20, poll_interval=0.5, max_retries=3,
+                 chunk_size=400, max_chunk_size=600, smart_chunking=1):
+
+        self.library = Library().create_new_library(library_name)
+        self.watch_folders = watch_folders
+        self.ingest_root = os.path.commonpath([os.path.abspath(folder) for folder in watch_folders])
+
+        self.debounce_secs = debounce_secs
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.add_files_options = {"chunk_size": chunk_size, "max_chunk_size": max_chunk_size,
+                                  "smart_chunking": smart_chunking}
+
+        # the embedding model is loaded once, and re-used for every micro-batch
+        self.vector_db = vector_db or LLMWareConfig().get_vector_db()
+        self.embedding_model = None
+        if embedding_model_name:
+            self.embedding_model = ModelCatalog().load_model(selected_model=embedding_model_name)
+
+        # file path -> {"first_event": time, "last_event": time}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+        # file path -> number of failed attempts, for files that are waiting to be retried
+        self.failures = {}
+
+        self.stats = {"batches": 0, "files_ingested": 0, "files_removed": 0, "blocks_added": 0,
+                      "batches_failed": 0, "files_failed": 0,
+                      "last_lag": 0.0, "max_lag": 0.0, "total_lag": 0.0}
+
+        self.observer = None
+        self._stop = threading.Event()
+
+    def register_event(self, file_path):
+
+        now = time.time()
+
+        with self.lock:
+            if file_path in self.pending:
+                self.pending[file_path]["last_event"] = now
+            else:
+                self.pending[file_path] = {"first_event": now, "last_event": now}
+
+    def get_lag(self):
+
+        """ Current lag - age of the oldest file event that is not yet queryable, plus the recent history. """
+
+        now = time.time()
+
+        with self.lock:
+            oldest = min([p["first_event"] for p in self.pending.values()], default=now)
+            pending_files = len(self.pending)
+
+        files = self.stats["files_ingested"] + self.stats["files_removed"]
+        avg_lag = self.stats["total_lag"] / files if files else 0.0
+
+        return {"pending_files": pending_files, "current_lag": round(now - oldest, 2),
+                "last_batch_lag": round(self.stats["last_lag"], 2), "max_lag": round(self.stats["max_lag"], 2),
+                "avg_lag": round(avg_lag, 2)}
+
+    def _ready_batch(self):
+
+        """ Pops up to batch_size files that have been quiet for at least debounce_secs. """
+
+        now = time.time()
+        batch = []
+
+        with self.lock:
+            for fp, times in sorted(self.pending.items(), key=lambda x: x[1]["first_event"]):
+                if now - times["last_event"] >= self.debounce_secs:
+                    batch.append((fp, times["first_event"]))
+                    if len(batch) >= self.batch_size:
+                        break
+
+            for fp, _ in batch:
+                del self.pending[fp]
+
+        return batch
+
+    def source_name(self, file_path):
+
+        """ file_source of a watched file - its path relative to the common root of the watch folders, so that
+        files with the same name in different sub-folders are kept apart. """
+
+        return source_name(os.path.relpath(file_path, self.ingest_root))
+
+    def ingest_batch(self, batch):
+
+        """ Ingests one micro-batch - removes stale blocks, parses the new/changed files and embeds them. """
+
+        to_stage = []
+        removed = 0
+
+        for fp, _ in batch:
+
+            file_source = self.source_name(fp)
+
+            # modified and deleted files both start by dropping the blocks of the earlier version
+            # -- vectors already installed for those blocks are left in the vector db (see ingest_ext.py)
+            remove_document_from_library(self.library, file_source)
+
+            if os.path.isfile(fp):
+                to_stage.append((fp, file_source))
+            else:
+                removed += 1
+
+        to_parse = len(to_stage)
+        staging_path = os.path.join(self.library.tmp_path, "watch_folder_batch")
+
+        output = None
+        try:
+            stage_files(staging_path, to_stage)
+
+            if to_parse:
+                output = self.library.add_files(input_folder_path=staging_path, **self.add_files_options)
+
+                # only the blocks not yet flagged for this model are embedded - i.e., this batch
+                if self.embedding_model:
+                    EmbeddingHandler(self.library).create_new_embedding(self.vector_db, self.embedding_model,
+                                                                        batch_size=100)
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+
+        done = time.time()
+        for _, first_event in batch:
+            lag = done - first_event
+            self.stats["total_lag"] += lag
+            self.stats["max_lag"] = max(self.stats["max_lag"], lag)
+
+        self.stats["last_lag"] = done - min(first_event for _, first_event in batch)
+        self.stats["batches"] += 1
+        self.stats["files_ingested"] += to_parse
+        self.stats["files_removed"] += removed
+        if output:
+            self.stats["blocks_added"] += output["blocks_added"]
+
+        print(f"update: batch {self.stats['batches']} - ingested: {to_parse} - removed: {removed} - "
+              f"lag: {self.get_lag()}")
+
+        return output
+
+    def _retry_later(self, batch, error):
+
+        """ Puts the files of a failed batch back in pending, to be picked up again after the debounce period -
+        a file that has failed max_retries times is dropped, and counted in stats['files_failed']. """
+
+        now = time.time()
+
+        with self.lock:
+            for fp, first_event in batch:
+
+                attempts = self.failures.get(fp, 0) + 1
+
+                if attempts > self.max_retries:
+                    self.failures.pop(fp, None)
+                    self.stats["files_failed"] += 1
+                    print(f"update: giving up on {fp} after {self.max_retries} retries - {error}")
+                    continue
+
+                self.failures[fp] = attempts
+
+                # a newer event for the file may have arrived in the meantime - the earliest event is kept for the lag
+                times = self.pending.setdefault(fp, {"first_event": first_event, "last_event": now})
+                times["first_event"] = min(times["first_event"], first_event)
+
+    def _ingest_safely(self, batch):
+
+        """ Runs ingest_batch without letting an exception end the daemon - if a batch fails, its files are
+        ingested one at a time, so that one bad file does not hold back the rest of the batch. """
+
+        try:
+            self.ingest_batch(batch)
+            failed = []
+        except Exception as e:
+            self.stats["batches_failed"] += 1
+            print(f"update: batch failed - {type(e).__name__}: {e}")
+
+            if len(batch) == 1:
+                failed = [(batch[0], e)]
+            else:
+                failed = []
+                for item in batch:
+                    try:
+                        self.ingest_batch([item])
+                    except Exception as file_error:
+                        failed.append((item, file_error))
+
+        failed_paths = set(fp for (fp, _), _ in failed)
+        for fp, _ in batch:
+            if fp not in failed_paths:
+                self.failures.pop(fp, None)
+
+        for item, error in failed:
+            self._retry_later([item], f"{type(error).__name__}: {error}")
+
+    def run(self, initial_scan=True):
+
+        """ Starts the folder observer and runs the ingestion loop until stop() or Ctrl-C. """
+
+        handler = _FolderEventHandler(self)
+        self.observer = Observer()
+
+        for folder in self.watch_folders:
+            self.observer.schedule(handler, folder, recursive=True)
+
+            # pick up files that arrived while the daemon was not running
+            if initial_scan:
+                already_in_library = set(os.listdir(self.library.file_copy_path))
+                for root, _, files in os.walk(folder):
+                    for fn in files:
+                        if self.source_name(os.path.join(root, fn)) not in already_in_library:
+                            self.register_event(os.path.join(root, fn))
+
+        self.observer.start()
+        print(f"update: watching {self.watch_folders} - library: {self.library.library_name}")
+
+        try:
+            while not self._stop.is_set():
+                batch = self._ready_batch()
+                if batch:
+                    self._ingest_safely(batch)
+                else:
+                    time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            print("\nupdate: stopping watch-folder daemon")
+        finally:
+            self.observer.stop()
+            self.observer.join()
+
+        return self.stats
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == "__main__":
+
+    LLMWareConfig().set_active_db("sqlite")
+    LLMWareConfig().set_vector_db("chromadb")
+
+    #   one or more folders to keep in sync with the library
+    watch_folders = [os.path.join(os.getcwd(), "myfolder")]
+
+    daemon = FolderIngestionDaemon("watched_library", watch_folders, embedding_model_name="mini-lm-sbert",
+                                   debounce_secs=2.0, batch_size=20)
+
+    daemon.run()
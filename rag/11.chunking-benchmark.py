@@ -0,0 +1,189 @@
+
+"""     Fast Start Example #11 - Ingestion Benchmark across Chunking Configurations
+
+    The examples hard-code their chunking settings - `setup_library` uses chunk_size=400, max_chunk_size=600,
+    smart_chunking=1, while `semantic_rag` uses 400/800/2.  This script measures what those choices cost.
+
+    For each (chunk_size, max_chunk_size, smart_chunking) in a grid, it ingests the same corpus into a fresh
+    library and records:
+
+        -- wall time for add_files
+        -- peak RSS of the process during parsing
+        -- block count and average block length (characters)
+        -- downstream embedding time for the blocks (optional)
+
+    The results are written to a JSON report.  The corpus can be the llmware sample 'Agreements' folder, any
+    local folder of documents, or a synthetic corpus of text files generated below.
+
+    Note: peak RSS is sampled with psutil (`pip3 install psutil`).
+
+"""
+
+import os
+import json
+import time
+import random
+import shutil
+import itertools
+import threading
+
+import psutil
+
+from llmware.library import Library
+from llmware.retrieval import Query
+from llmware.setup import Setup
+from llmware.configs import LLMWareConfig
+
+
+def build_synthetic_corpus(output_folder, num_docs=50, paragraphs_per_doc=40, seed=42):
+
+    """ Writes a reproducible corpus of plain-text 'contracts' - handy when no sample documents are at hand. """
+
+    rng = random.Random(seed)
+
+    vocabulary = ["agreement", "party", "services", "payment", "term", "termination", "notice", "confidential",
+                  "liability", "indemnify", "governing", "law", "executive", "salary", "benefits", "breach",
+                  "warranty", "intellectual", "property", "license", "schedule", "invoice", "delivery", "days"]
+
+    if os.path.exists(output_folder):
+        shutil.rmtree(output_folder)
+    os.makedirs(output_folder)
+
+    for i in range(num_docs):
+        paragraphs = []
+        for p in range(paragraphs_per_doc):
+            sentences = []
+            for s in range(rng.randint(3, 8)):
+                words = [rng.choice(vocabulary) for _ in range(rng.randint(8, 20))]
+                sentences.append(" ".join(words).capitalize() + ".")
+            paragraphs.append(f"{p+1}. " + " ".join(sentences))
+
+        with open(os.path.join(output_folder, f"synthetic_contract_{i}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(paragraphs))
+
+    return output_folder
+
+
+class _PeakRSSSampler:
+
+    """ Samples the process RSS on a background thread - gives the peak for one measured window. """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.process = psutil.Process(os.getpid())
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            time.sleep(self.interval)
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def run_chunking_benchmark(corpus_path, chunk_sizes=(200, 400, 800), max_chunk_sizes=(600, 800, 1200),
+                           smart_chunking_options=(0, 1, 2), embedding_model_name=None, vector_db=None,
+                           report_fp=None, library_name_base="chunk_bench"):
+
+    """ Ingests the corpus once per grid point, and writes one JSON report with all of the measurements. """
+
+    if not vector_db:
+        vector_db = LLMWareConfig().get_vector_db()
+
+    if not report_fp:
+        report_fp = os.path.join(LLMWareConfig().get_llmware_path(), "chunking_benchmark_report.json")
+
+    grid = [(cs, mcs, sc) for cs, mcs, sc in itertools.product(chunk_sizes, max_chunk_sizes, smart_chunking_options)
+            if mcs >= cs]
+
+    print(f"\nupdate: chunking benchmark - {len(grid)} configurations - corpus: {corpus_path}")
+
+    results = []
+
+    for i, (chunk_size, max_chunk_size, smart_chunking) in enumerate(grid):
+
+        library_name = f"{library_name_base}_{i}"
+
+        # each configuration starts from an empty library
+        if Library().check_if_library_exists(library_name):
+            Library().delete_library(library_name, confirm_delete=True)
+
+        library = Library().create_new_library(library_name)
+
+        with _PeakRSSSampler() as rss:
+            t0 = time.time()
+            library.add_files(input_folder_path=corpus_path, chunk_size=chunk_size,
+                              max_chunk_size=max_chunk_size, smart_chunking=smart_chunking)
+            parse_time = time.time() - t0
+
+        blocks = Query(library).get_whole_library(selected_keys=["text", "content_type"])
+        text_lengths = [len(b["text"]) for b in blocks if b.get("content_type") != "image"]
+
+        embedding_time = None
+        if embedding_model_name:
+            t1 = time.time()
+            library.install_new_embedding(embedding_model_name=embedding_model_name, vector_db=vector_db,
+                                          batch_size=100)
+            embedding_time = time.time() - t1
+
+        row = {"chunk_size": chunk_size,
+               "max_chunk_size": max_chunk_size,
+               "smart_chunking": smart_chunking,
+               "wall_time": round(parse_time, 3),
+               "peak_rss_mb": round(rss.peak / (1024 * 1024), 1),
+               "blocks": len(text_lengths),
+               "avg_block_length": round(sum(text_lengths) / len(text_lengths), 1) if text_lengths else 0,
+               "embedding_model": embedding_model_name,
+               "embedding_time": round(embedding_time, 3) if embedding_time is not None else None}
+
+        results.append(row)
+
+        print(f"update: {i+1}/{len(grid)} - {chunk_size}/{max_chunk_size}/{smart_chunking} - "
+              f"time: {row['wall_time']}s - peak rss: {row['peak_rss_mb']} MB - blocks: {row['blocks']} - "
+              f"avg len: {row['avg_block_length']} - embedding time: {row['embedding_time']}")
+
+        if embedding_model_name:
+            library.delete_installed_embedding(embedding_model_name, vector_db)
+
+        Library().delete_library(library_name, confirm_delete=True)
+
+    report = {"corpus_path": corpus_path,
+              "corpus_files": len(os.listdir(corpus_path)),
+              "vector_db": vector_db if embedding_model_name else None,
+              "time_stamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "results": results}
+
+    with open(report_fp, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\nupdate: benchmark report saved at: {report_fp}")
+
+    return report
+
+
+if __name__ == "__main__":
+
+    LLMWareConfig().set_active_db("sqlite")
+    LLMWareConfig().set_vector_db("chromadb")
+
+    #   option 1 - llmware sample contracts
+    sample_files_path = Setup().load_sample_files(over_write=False)
+    corpus = os.path.join(sample_files_path, "Agreements")
+
+    #   option 2 - synthetic corpus - uncomment to use
+    # corpus = build_synthetic_corpus(os.path.join(LLMWareConfig().get_tmp_path(), "synthetic_corpus"))
+
+    #   the current example settings are included in the grid: 400/600/1 (example 2) and 400/800/2 (example 5)
+    run_chunking_benchmark(corpus, chunk_sizes=(200, 400, 800), max_chunk_sizes=(600, 800, 1200),
+                           smart_chunking_options=(0, 1, 2), embedding_model_name="mini-lm-sbert")
@@ -0,0 +1,140 @@
+
+"""     Fast Start Example #12 - Quantized Embedding Storage - Recall vs. Memory vs. Latency
+
+    Full float32 vectors are the largest part of a vector store.  The numpy vector dbs in embeddings_ext.py come
+    in three storage options, each selected simply by the vector_db name:
+
+        -- numpy_mmap           float32 vectors - exact search (the baseline)
+        -- numpy_mmap_int8      int8 codes, one scale per vector - 4x smaller scan
+        -- numpy_mmap_binary    1-bit sign codes, hamming distance - 32x smaller scan
+
+    The quantized options search the compact codes first, and then re-score a shortlist against the full
+    precision vectors that stay on disk.
+
+    This script embeds the sample 'Agreements' corpus once per option, runs the same set of queries, and
+    reports for each option:
+
+        -- recall@k against the exact float32 results
+        -- MB scanned per search, and MB on disk
+        -- average search latency (ms)
+
+    Note: to run this example, you will need the dependencies for the embedding model:
+
+        `pip3 install torch`
+        `pip3 install transformers`
+
+"""
+
+import os
+import json
+import time
+
+from llmware.library import Library
+from llmware.setup import Setup
+from llmware.models import ModelCatalog
+from llmware.embeddings import EmbeddingHandler
+from llmware.configs import LLMWareConfig
+
+from embeddings_ext import CachedEmbeddingModel, EmbeddingNumpyMemmap, EmbeddingNumpyInt8, EmbeddingNumpyBinary
+
+
+benchmark_queries = ["What is the governing law?",
+                     "What is the base salary?",
+                     "How many vacation days will the executive receive?",
+                     "What is the notice period for termination?",
+                     "Is there a non-compete provision?",
+                     "What happens on a change of control?",
+                     "What are the confidentiality obligations?",
+                     "What is the annual bonus target?",
+                     "Who are the parties to the agreement?",
+                     "When does the agreement start?",
+                     "What benefits is the executive entitled to?",
+                     "What is the severance payment?",
+                     "Can the agreement be assigned?",
+                     "How are disputes resolved?",
+                     "What stock options are granted?"]
+
+
+def run_quantization_benchmark(corpus_path, embedding_model_name="mini-lm-sbert", queries=None, top_k=10,
+                               repeats=20, report_fp=None, library_name_base="quant_bench"):
+
+    """ Builds one library per storage option, and compares the search results with the float32 baseline. """
+
+    if not queries:
+        queries = benchmark_queries
+
+    if not report_fp:
+        report_fp = os.path.join(LLMWareConfig().get_llmware_path(), "quantization_benchmark_report.json")
+
+    # the embedding cache means the corpus text is only run through the model once, for the first option
+    model = CachedEmbeddingModel(ModelCatalog().load_model(selected_model=embedding_model_name))
+    query_vectors = model.embedding(queries)
+
+    print(f"\nupdate: quantization benchmark - corpus: {corpus_path} - model: {embedding_model_name} - "
+          f"{len(queries)} queries - top_k: {top_k}")
+
+    baseline = None
+    results = []
+
+    for vector_db_class in (EmbeddingNumpyMemmap, EmbeddingNumpyInt8, EmbeddingNumpyBinary):
+
+        vector_db = vector_db_class.db_name
+        library_name = f"{library_name_base}_{vector_db}"
+
+        if Library().check_if_library_exists(library_name):
+            Library().delete_library(library_name, confirm_delete=True)
+
+        library = Library().create_new_library(library_name)
+        library.add_files(input_folder_path=corpus_path, chunk_size=400, max_chunk_size=600, smart_chunking=1)
+
+        EmbeddingHandler(library).create_new_embedding(vector_db, model, batch_size=100)
+
+        index = vector_db_class(library, model=model)
+
+        # results are compared by (file_source, block_ID), which is the same in each of the libraries
+        hits = []
+        t0 = time.time()
+        for _ in range(repeats):
+            hits = [[(block["file_source"], block["block_ID"]) for block, _ in index.search_index(qv, top_k)]
+                    for qv in query_vectors]
+        latency_ms = (time.time() - t0) * 1000 / (repeats * len(queries))
+
+        if baseline is None:
+            baseline = hits
+
+        recall = sum(len(set(h) & set(b)) / max(len(b), 1) for h, b in zip(hits, baseline)) / len(queries)
+
+        row = index.get_storage_stats()
+        row.update({"recall_at_k": round(recall, 4),
+                    "avg_search_latency_ms": round(latency_ms, 3),
+                    "rescore_shortlist": top_k * index.rescore_factor if index.quantization else None})
+
+        results.append(row)
+
+        print(f"update: {vector_db} - recall@{top_k}: {row['recall_at_k']} - scanned: {row['scanned_mb']} MB - "
+              f"disk: {row['disk_mb']} MB - latency: {row['avg_search_latency_ms']} ms")
+
+        Library().delete_library(library_name, confirm_delete=True)
+
+    report = {"corpus_path": corpus_path,
+              "embedding_model": embedding_model_name,
+              "queries": len(queries),
+              "top_k": top_k,
+              "time_stamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "results": results}
+
+    with open(report_fp, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\nupdate: benchmark report saved at: {report_fp}")
+
+    return report
+
+
+if __name__ == "__main__":
+
+    LLMWareConfig().set_active_db("sqlite")
+
+    sample_files_path = Setup().load_sample_files(over_write=False)
+
+    run_quantization_benchmark(os.path.join(sample_files_path, "Agreements"), embedding_model_name="mini-lm-sbert")
@@ -0,0 +1,149 @@
+
+"""     Fast Start Example #13 - Hybrid Retrieval (Text + Semantic) with Reciprocal Rank Fusion
+
+    Text queries (example 1) find exact terms, semantic queries (example 5) find paraphrases - hybrid_query in
+    retrieval_ext.py runs both at the same time and merges the two ranked lists with reciprocal rank fusion.
+
+    This script builds a library from the sample 'Agreements' contracts with an embedding, and then for each
+    query in a small labeled set compares:
+
+        -- text_query
+        -- semantic_query
+        -- text + semantic, one after the other (the current pattern)
+        -- hybrid_query (concurrent + fused)
+
+    reporting the average latency of each, and recall@k - a block counts as relevant if it contains the
+    labeled key phrase of the query.
+
+    Note: to run this example, you will need the dependencies for the embedding model:
+
+        `pip3 install torch`
+        `pip3 install transformers`
+
+"""
+
+import os
+import json
+import time
+
+from llmware.library import Library
+from llmware.setup import Setup
+from llmware.configs import LLMWareConfig
+
+from retrieval_ext import ExtendedQuery
+
+#   registers the 'numpy_mmap' vector dbs - any other installed vector db works as well
+import embeddings_ext
+
+
+#   (query, key phrase that marks a relevant block)
+labeled_queries = [("Which state law governs the agreement?", "governing law"),
+                   ("How much is the executive paid each year?", "base salary"),
+                   ("How much time off does the executive get?", "vacation"),
+                   ("Can the company fire the executive for misconduct?", "for cause"),
+                   ("Is the executive restricted from working for competitors?", "compet"),
+                   ("What happens if the company is acquired?", "change of control"),
+                   ("What information must be kept secret?", "confidential"),
+                   ("Is there a yearly performance bonus?", "bonus"),
+                   ("What is paid if the executive is let go?", "severance"),
+                   ("What equity awards are granted?", "stock option")]
+
+
+def _recall_at_k(results, key_phrase, relevant_count, k):
+
+    if not relevant_count:
+        return None
+
+    hits = sum(1 for r in results[:k] if key_phrase in r["text"].lower())
+
+    return hits / min(k, relevant_count)
+
+
+def run_hybrid_benchmark(library_name="hybrid_bench", embedding_model_name="mini-lm-sbert",
+                         vector_db="numpy_mmap", top_k=10, repeats=3, report_fp=None):
+
+    """ Builds the library (if needed), and runs the labeled queries through each retrieval mode. """
+
+    if not report_fp:
+        report_fp = os.path.join(LLMWareConfig().get_llmware_path(), "hybrid_benchmark_report.json")
+
+    if not Library().check_if_library_exists(library_name):
+        library = Library().create_new_library(library_name)
+        sample_files_path = Setup().load_sample_files(over_write=False)
+        library.add_files(input_folder_path=os.path.join(sample_files_path, "Agreements"))
+        library.install_new_embedding(embedding_model_name=embedding_model_name, vector_db=vector_db)
+    else:
+        library = Library().load_library(library_name)
+
+    q = ExtendedQuery(library, embedding_model_name=embedding_model_name, vector_db=vector_db, save_history=False)
+
+    # relevant blocks per key phrase - from a full pass over the library
+    all_blocks = q.get_whole_library(selected_keys=["text"])
+    relevant = {phrase: sum(1 for b in all_blocks if phrase in b["text"].lower()) for _, phrase in labeled_queries}
+
+    def text_only(query):
+        return q.text_query(query, result_count=top_k)
+
+    def semantic_only(query):
+        return q.semantic_query(query, result_count=top_k)
+
+    def sequential(query):
+        # the current pattern - both queries, one after the other, concatenated
+        return q.text_query(query, result_count=top_k) + q.semantic_query(query, result_count=top_k)
+
+    def hybrid(query):
+        return q.hybrid_query(query, result_count=top_k)
+
+    # warm-up - loads the embedding model and the index before timing
+    hybrid(labeled_queries[0][0])
+
+    report_rows = []
+
+    for mode_name, mode in (("text", text_only), ("semantic", semantic_only), ("sequential", sequential),
+                            ("hybrid", hybrid)):
+
+        latencies = []
+        recalls = []
+
+        for query, phrase in labeled_queries:
+
+            t0 = time.time()
+            for _ in range(repeats):
+                results = mode(query)
+            latencies.append((time.time() - t0) / repeats)
+
+            recall = _recall_at_k(results, phrase, relevant[phrase], top_k)
+            if recall is not None:
+                recalls.append(recall)
+
+        row = {"mode": mode_name,
+               "avg_latency_ms": round(1000 * sum(latencies) / len(latencies), 2),
+               "recall_at_k": round(sum(recalls) / len(recalls), 4) if recalls else None}
+
+        report_rows.append(row)
+
+        print(f"update: {mode_name:<10} - avg latency: {row['avg_latency_ms']} ms - recall@{top_k}: "
+              f"{row['recall_at_k']}")
+
+    report = {"library_name": library_name,
+              "embedding_model": embedding_model_name,
+              "vector_db": vector_db,
+              "top_k": top_k,
+              "queries": len(labeled_queries),
+              "relevant_blocks": relevant,
+              "time_stamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "results": report_rows}
+
+    with open(report_fp, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\nupdate: benchmark report saved at: {report_fp}")
+
+    return report
+
+
+if __name__ == "__main__":
+
+    LLMWareConfig().set_active_db("sqlite")
+
+    run_hybrid_benchmark(embedding_model_name="mini-lm-sbert", vector_db="numpy_mmap")
@@ -0,0 +1,159 @@
+
+"""     Fast Start Example #14 - SQLite FTS5 Text Search with BM25 Ranking
+
+    On sqlite, the text index of a library is an FTS5 table.  The standard text query path turns the query into
+    a list of words (OR'd - or AND'd if the query is quoted), sorts every matching block, and unpacks all of them
+    before the result count is applied.
+
+    ExtendedQuery(library, fts5_search=True) in retrieval_ext.py runs the same queries as:
+
+        -- real phrase queries - '"master services agreement"' matches the three words in order
+        -- BM25 ranking, with a weight per indexed column (e.g., to boost header_text)
+        -- bound parameters - no quoting issues with punctuation or FTS5 keywords in the query
+        -- the result count applied in SQL (LIMIT) - only the top blocks are read and unpacked
+
+    This script builds a library from the 'AgreementsLarge' samples (~80 contracts), and for each of
+    text_query, text_query_with_document_filter and text_search_by_page compares the two paths:
+
+        -- average latency (ms)
+        -- phrase precision - share of the results to a phrase query that contain the phrase
+        -- overlap of the results of the two paths for the plain (non-phrase) queries
+
+"""
+
+import os
+import re
+import json
+import time
+
+from llmware.library import Library
+from llmware.setup import Setup
+from llmware.retrieval import Query
+from llmware.configs import LLMWareConfig
+
+from retrieval_ext import ExtendedQuery
+
+
+benchmark_queries = ['"master services agreement"',
+                     '"governing law"',
+                     '"termination for convenience"',
+                     '"limitation of liability"',
+                     '"confidential information"',
+                     "termination notice",
+                     "indemnification",
+                     "payment terms invoice",
+                     "intellectual property",
+                     "force majeure"]
+
+
+def _phrase(query):
+    match = re.fullmatch(r'\s*"([^"]+)"\s*', query)
+    return " ".join(re.findall(r"\w+", match.group(1).lower())) if match else None
+
+
+def _phrase_precision(results, phrase):
+
+    if not results:
+        return None
+
+    hits = sum(1 for r in results if phrase in " ".join(re.findall(r"\w+", r["text"].lower())))
+
+    return hits / len(results)
+
+
+def run_fts5_benchmark(library_name="fts5_bench", result_count=20, repeats=5, report_fp=None):
+
+    """ Builds the library (if needed), and runs the benchmark queries through the standard and FTS5 paths. """
+
+    if not report_fp:
+        report_fp = os.path.join(LLMWareConfig().get_llmware_path(), "fts5_benchmark_report.json")
+
+    if not Library().check_if_library_exists(library_name):
+        library = Library().create_new_library(library_name)
+        sample_files_path = Setup().load_sample_files(over_write=False)
+        library.add_files(input_folder_path=os.path.join(sample_files_path, "AgreementsLarge"))
+    else:
+        library = Library().load_library(library_name)
+
+    paths = {"standard": Query(library, save_history=False),
+             "fts5_bm25": ExtendedQuery(library, fts5_search=True, save_history=False)}
+
+    doc_filter = {"doc_ID": paths["standard"].list_doc_id()[:10]}
+
+    methods = {"text_query": lambda q, query: q.text_query(query, result_count=result_count),
+               "text_query_with_document_filter":
+                   lambda q, query: q.text_query_with_document_filter(query, doc_filter, result_count=result_count),
+               "text_search_by_page": lambda q, query: q.text_search_by_page(query, page_num=1)}
+
+    print(f"\nupdate: fts5 benchmark - library: {library_name} - {len(benchmark_queries)} queries - "
+          f"result_count: {result_count}")
+
+    report_rows = []
+
+    for method_name, method in methods.items():
+
+        results_by_path = {}
+
+        for path_name, q in paths.items():
+
+            latencies = []
+            precisions = []
+            results_by_path[path_name] = {}
+
+            for query in benchmark_queries:
+
+                t0 = time.time()
+                for _ in range(repeats):
+                    results = method(q, query)
+                latencies.append((time.time() - t0) / repeats)
+
+                results_by_path[path_name][query] = results
+
+                phrase = _phrase(query)
+                if phrase:
+                    precision = _phrase_precision(results, phrase)
+                    if precision is not None:
+                        precisions.append(precision)
+
+            row = {"method": method_name,
+                   "path": path_name,
+                   "avg_latency_ms": round(1000 * sum(latencies) / len(latencies), 2),
+                   "phrase_precision": round(sum(precisions) / len(precisions), 4) if precisions else None}
+
+            report_rows.append(row)
+
+        # overlap of the two paths on the plain queries - both OR the words, but rank differently on ties
+        overlaps = []
+        for query in benchmark_queries:
+            if not _phrase(query):
+                standard_ids = set(r["_id"] for r in results_by_path["standard"][query])
+                fts5_ids = set(r["_id"] for r in results_by_path["fts5_bm25"][query])
+                if standard_ids or fts5_ids:
+                    overlaps.append(len(standard_ids & fts5_ids) / max(len(standard_ids), len(fts5_ids)))
+
+        for row in report_rows[-2:]:
+            row["plain_query_overlap"] = round(sum(overlaps) / len(overlaps), 4) if overlaps else None
+
+            print(f"update: {method_name:<32} {row['path']:<10} - avg latency: {row['avg_latency_ms']} ms - "
+                  f"phrase precision: {row['phrase_precision']} - plain query overlap: {row['plain_query_overlap']}")
+
+    report = {"library_name": library_name,
+              "result_count": result_count,
+              "queries": benchmark_queries,
+              "time_stamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "results": report_rows}
+
+    with open(report_fp, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\nupdate: benchmark report saved at: {report_fp}")
+
+    return report
+
+
+if __name__ == "__main__":
+
+    #   the fts5 path is specific to sqlite - with other text index dbs, both paths are the same
+    LLMWareConfig().set_active_db("sqlite")
+
+    run_fts5_benchmark()
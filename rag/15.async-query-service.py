@@ -0,0 +1,232 @@
+
+"""     Fast Start Example #15 - Serving Query and Prompt from an Async Web Tier
+
+    Calling the blocking Query and Prompt methods from an async handler stops the event loop for the whole
+    call - every other request waits, even though most of the time is spent in the database, the embedding
+    model or the llm.  AsyncQuery and AsyncPrompt in async_ext.py are awaitable versions of the main methods:
+
+        -- the blocking work runs on bounded thread pools - the event loop stays free
+        -- max_pending bounds the requests queued for the pools (back-pressure, instead of a thread per request)
+        -- identical requests that arrive while the first is still running share its result (coalescing)
+
+    This script has two parts:
+
+        1.  run_async_benchmark - N concurrent clients send semantic queries (with repeats, as in production
+            traffic), handled three ways:  blocking calls in the handler (the sync path), AsyncQuery, and
+            AsyncQuery with coalescing - and reports requests/sec, p50 / p95 latency, and coalesced requests.
+
+        2.  create_app - a fastapi app with a /query and an /ask (query + llm answer) endpoint, using
+            AsyncQuery and AsyncPrompt - run with `serve(..)`, which requires `pip3 install fastapi uvicorn`.
+
+    Note: to run this example, you will need the dependencies for the embedding model:
+
+        `pip3 install torch`
+        `pip3 install transformers`
+
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+from importlib import util
+
+from llmware.library import Library
+from llmware.setup import Setup
+from llmware.configs import LLMWareConfig
+
+from async_ext import AsyncQuery, AsyncPrompt
+
+#   registers the 'numpy_mmap' vector dbs - any other installed vector db works as well
+import embeddings_ext
+
+if not util.find_spec("fastapi") or not util.find_spec("uvicorn"):
+    print("\nto run the web service in this example, please install fastapi and uvicorn, e.g., "
+          "\n`pip install fastapi uvicorn`")
+
+
+benchmark_queries = ["What is the governing law?",
+                     "What is the base salary?",
+                     "How many vacation days will the executive receive?",
+                     "What is the notice period for termination?",
+                     "Is there a non-compete provision?",
+                     "What happens on a change of control?",
+                     "What are the confidentiality obligations?",
+                     "What is the annual bonus target?"]
+
+
+def _load_library(library_name, embedding_model_name, vector_db):
+
+    if not Library().check_if_library_exists(library_name):
+        library = Library().create_new_library(library_name)
+        sample_files_path = Setup().load_sample_files(over_write=False)
+        library.add_files(input_folder_path=os.path.join(sample_files_path, "Agreements"))
+        library.install_new_embedding(embedding_model_name=embedding_model_name, vector_db=vector_db)
+    else:
+        library = Library().load_library(library_name)
+
+    return library
+
+
+async def _run_clients(handler, requests, concurrency):
+
+    """ concurrency clients, each sending its share of the requests one after the other - returns the
+    latency of each request, and the wall time. """
+
+    latencies = []
+    next_request = iter(requests)
+
+    async def client():
+        for query in next_request:
+            t0 = time.time()
+            await handler(query)
+            latencies.append(time.time() - t0)
+
+    t0 = time.time()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+
+    return latencies, time.time() - t0
+
+
+def run_async_benchmark(library_name="async_bench", embedding_model_name="mini-lm-sbert", vector_db="numpy_mmap",
+                        concurrency=16, total_requests=200, max_workers=4, result_count=10, seed=7,
+                        report_fp=None):
+
+    """ Compares the sync path, AsyncQuery and AsyncQuery with coalescing under concurrent load. """
+
+    if not report_fp:
+        report_fp = os.path.join(LLMWareConfig().get_llmware_path(), "async_benchmark_report.json")
+
+    library = _load_library(library_name, embedding_model_name, vector_db)
+
+    # production-like traffic - some questions are asked far more often than others
+    random.seed(seed)
+    weights = [1.0 / (i + 1) for i in range(len(benchmark_queries))]
+    requests = random.choices(benchmark_queries, weights=weights, k=total_requests)
+
+    # one query object per worker, sharing one embedding model - the coalescing runner uses the same pool
+    async_query = AsyncQuery(library, max_workers=max_workers, coalesce=False,
+                             embedding_model_name=embedding_model_name, vector_db=vector_db)
+    coalescing_query = AsyncQuery(library, queries=async_query.queries, coalesce=True)
+
+    q = async_query.queries[0]
+
+    # warm-up - loads the index before timing
+    q.semantic_query(benchmark_queries[0], result_count=result_count)
+
+    async def sync_handler(query):
+        # the blocking call runs on the event loop - all of the other requests wait
+        return q.semantic_query(query, result_count=result_count)
+
+    modes = [("sync", sync_handler, None),
+             ("async", lambda query: async_query.semantic_query(query, result_count=result_count), async_query),
+             ("async_coalesce", lambda query: coalescing_query.semantic_query(query, result_count=result_count),
+              coalescing_query)]
+
+    print(f"\nupdate: async benchmark - {total_requests} requests - {concurrency} concurrent clients - "
+          f"{max_workers} workers")
+
+    report_rows = []
+
+    for mode_name, handler, runner in modes:
+
+        latencies, wall_time = asyncio.run(_run_clients(handler, requests, concurrency))
+        latencies = sorted(latencies)
+
+        row = {"mode": mode_name,
+               "requests_per_sec": round(len(latencies) / wall_time, 2),
+               "p50_latency_ms": round(1000 * latencies[len(latencies) // 2], 2),
+               "p95_latency_ms": round(1000 * latencies[int(len(latencies) * 0.95) - 1], 2),
+               "coalesced": runner.get_stats().get("coalesced", 0) if runner else 0}
+
+        report_rows.append(row)
+
+        print(f"update: {mode_name:<15} - {row['requests_per_sec']} req/sec - p50: {row['p50_latency_ms']} ms - "
+              f"p95: {row['p95_latency_ms']} ms - coalesced: {row['coalesced']}")
+
+    async_query.close()
+    coalescing_query.close()
+
+    report = {"library_name": library_name,
+              "embedding_model": embedding_model_name,
+              "vector_db": vector_db,
+              "total_requests": total_requests,
+              "concurrency": concurrency,
+              "max_workers": max_workers,
+              "time_stamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "results": report_rows}
+
+    with open(report_fp, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\nupdate: benchmark report saved at: {report_fp}")
+
+    return report
+
+
+def create_app(library_name="async_bench", embedding_model_name="mini-lm-sbert", vector_db="numpy_mmap",
+               llm_model_name="bling-phi-3-gguf", llm_pool_size=1, max_workers=4):
+
+    """ fastapi app - GET /query?q=..&mode=semantic|text|hybrid and GET /ask?q=.. (query + llm answer). """
+
+    from fastapi import FastAPI
+
+    library = _load_library(library_name, embedding_model_name, vector_db)
+
+    async_query = AsyncQuery(library, max_workers=max_workers, embedding_model_name=embedding_model_name,
+                             vector_db=vector_db)
+
+    async_prompt = AsyncPrompt(llm_model_name, pool_size=llm_pool_size, temperature=0.0, sample=False)
+
+    app = FastAPI()
+
+    @app.get("/query")
+    async def query_endpoint(q: str, mode: str = "semantic", result_count: int = 10):
+
+        if mode == "text":
+            results = await async_query.text_query(q, result_count=result_count)
+        elif mode == "hybrid":
+            results = await async_query.hybrid_query(q, result_count=result_count)
+        else:
+            results = await async_query.semantic_query(q, result_count=result_count)
+
+        return {"query": q, "results": [{"file_source": r["file_source"], "page_num": r["page_num"],
+                                         "text": r["text"]} for r in results]}
+
+    @app.get("/ask")
+    async def ask_endpoint(q: str, result_count: int = 5):
+
+        results = await async_query.semantic_query(q, result_count=result_count)
+        responses = await async_prompt.prompt_with_source(q, results, prompt_name="default_with_context")
+
+        return {"query": q, "answers": [r.get("llm_response", "") for r in responses],
+                "sources": sorted(set(r["file_source"] for r in results))}
+
+    @app.get("/stats")
+    async def stats_endpoint():
+        return {"query": async_query.get_stats(), "prompt": async_prompt.get_stats()}
+
+    @app.on_event("shutdown")
+    def shutdown():
+        async_query.close()
+        async_prompt.close()
+
+    return app
+
+
+def serve(host="127.0.0.1", port=8000, **app_kwargs):
+
+    import uvicorn
+
+    uvicorn.run(create_app(**app_kwargs), host=host, port=port)
+
+
+if __name__ == "__main__":
+
+    LLMWareConfig().set_active_db("sqlite")
+
+    run_async_benchmark(embedding_model_name="mini-lm-sbert", vector_db="numpy_mmap")
+
+    #   to start the web service, e.g., then open http://127.0.0.1:8000/ask?q=what is the base salary
+    #   serve(llm_model_name="bling-phi-3-gguf")
@@ -1,10 +1,22 @@
 import os
+import time
+import queue
+import shutil
+import threading
 from llmware.library import Library
 from llmware.retrieval import Query
 from llmware.setup import Setup
 from llmware.status import Status
 from llmware.models import ModelCatalog
 from llmware.configs import LLMWareConfig, MilvusConfig
+from llmware.resources import CollectionWriter
+from llmware.parsers import Parser
+from llmware.embeddings import EmbeddingHandler
+
+from embeddings_ext import CachedEmbeddingModel, AdaptiveBatchEmbeddingModel, ParallelEmbeddingModel, \
+    record_embedding_status_note, get_embedding_status_notes
+from retrieval_ext import ExtendedQuery, stage_latency_histogram
+from ingest_ext import SQLiteBulkBlockWriter, parse_one_file, move_parsed_images, incremental_add_files
 
 from importlib import util
 
@@ -29,28 +41,76 @@ def setup_library(library_name):
     print(f"\nUsing PDF files from: {input_folder}")
 
     # Add your own PDF files here instead of sample files
-    library.add_files(input_folder_path=input_folder,
-                      chunk_size=400, max_chunk_size=600, smart_chunking=1)
+    # -- re-runs on the same folder only parse new/changed files (see ingest_manifest.json in the library)
+    # -- vectors of blocks removed for changed/deleted files stay in the vector db (see ingest_ext.py)
+    output = incremental_add_files(library, input_folder, chunk_size=400, max_chunk_size=600, smart_chunking=1)
+    print(f"Manifest check - new: {len(output['new_files'])}, changed: {len(output['changed_files'])}, "
+          f"deleted: {len(output['deleted_files'])}, rejected: {len(output['rejected_files'])}")
 
     return library
 
 
-def install_vector_embeddings(library, embedding_model_name):
+def install_vector_embeddings(library, embedding_model_name, use_cache=False, adaptive_batch=False,
+                              rss_ceiling_mb=4096, embedding_workers=1):
     library_name = library.library_name
     vector_db = LLMWareConfig().get_vector_db()
 
     print(f"\nStarting embedding: Library = {library_name}, Vector DB = {vector_db}, Model = {embedding_model_name}")
 
-    library.install_new_embedding(embedding_model_name=embedding_model_name, vector_db=vector_db, batch_size=100)
+    if use_cache or adaptive_batch or embedding_workers > 1:
+        model = ModelCatalog().load_model(selected_model=embedding_model_name)
+
+        # multi-process - the forward passes run in N worker processes, and this process writes the vectors
+        # (adaptive batching measures this process only, so it is not combined with the worker pool)
+        if embedding_workers > 1:
+            model = parallel_model = ParallelEmbeddingModel(model, workers=embedding_workers)
+            adaptive_batch = False
+
+        # adaptive batching - the model batch size is probed in the first batches instead of fixed at 100
+        if adaptive_batch:
+            model = adaptive_model = AdaptiveBatchEmbeddingModel(model, rss_ceiling_mb=rss_ceiling_mb)
+
+        # same as install_new_embedding, but text already embedded with this model (in any library, or in an
+        # earlier run) is served from the on-disk embedding cache instead of the model
+        if use_cache:
+            model = CachedEmbeddingModel(model)
+
+        # outer batch = blocks pulled per vector db write - large enough to hold the biggest probed batch size,
+        # or to give every worker several sub-batches
+        outer_batch_size = 512 if adaptive_batch or embedding_workers > 1 else 100
+        EmbeddingHandler(library).create_new_embedding(vector_db, model, batch_size=outer_batch_size)
+
+        if use_cache:
+            print("Embedding cache stats:", model.cache.get_stats())
+
+        if adaptive_batch:
+            stats = adaptive_model.get_stats()
+            print("Adaptive batching:", stats)
+            record_embedding_status_note(library_name, embedding_model_name,
+                                         f"batch_size: {stats['batch_size']} - "
+                                         f"blocks/sec: {stats['blocks_per_sec']}")
+
+        if embedding_workers > 1:
+            stats = parallel_model.get_stats()
+            parallel_model.close()
+            print("Embedding workers:", stats)
+            record_embedding_status_note(library_name, embedding_model_name,
+                                         f"workers: {stats['workers']} - blocks/sec: {stats['blocks_per_sec']}")
+    else:
+        library.install_new_embedding(embedding_model_name=embedding_model_name, vector_db=vector_db, batch_size=100)
 
     update = Status().get_embedding_status(library_name, embedding_model_name)
     print("Embeddings complete - status check:", update)
+    print("Embedding notes:", get_embedding_status_notes(library_name, embedding_model_name))
 
     # 🔍 Custom Query: "tell about svm"
     sample_query = "tell about svm"
     print(f"\nRunning semantic/vector query: '{sample_query}'")
 
-    query_results = Query(library).semantic_query(sample_query, result_count=20)
+    #   collect_timing - per-stage breakdown of the call (embed, ann_search, hydration, assembly)
+    query = ExtendedQuery(library, collect_timing=True)
+    query_results = query.semantic_query(sample_query, result_count=20)
+    print("Query timing:", query.last_timing)
 
     for i, entry in enumerate(query_results):
         text = entry["text"]
@@ -67,14 +127,250 @@ def install_vector_embeddings(library, embedding_model_name):
     embedding_record = library.get_embedding_status()
     print("\nEmbedding record - after:", embedding_record)
 
+    #   process-wide latency histogram of every timed call - p50 / p95 / p99 per stage
+    latency_fp = os.path.join(LLMWareConfig().get_llmware_path(), "query_latency_histogram.json")
+    stage_latency_histogram.dump(latency_fp)
+    print("Query latency histogram saved at:", latency_fp)
+
+
+class _StageStats:
+    # per-stage counters for the streaming pipeline - busy time excludes time spent waiting on queues
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.blocks = 0
+        self.busy_time = 0.0
+        self.queue_samples = []
+
+    def report(self):
+        rate = self.blocks / self.busy_time if self.busy_time else 0.0
+        depth = self.queue_samples or [0]
+        return {"stage": self.name, "items": self.items, "blocks": self.blocks,
+                "busy_time": round(self.busy_time, 2), "blocks_per_sec": round(rate, 1),
+                "avg_input_queue": round(sum(depth) / len(depth), 1), "max_input_queue": max(depth)}
+
+
+_PIPELINE_DONE = object()
+
+
+def streaming_ingest_and_embed(library, input_folder, embedding_model_name, vector_db=None,
+                               parse_workers=2, queue_size=8, embed_batch_size=100,
+                               chunk_size=400, max_chunk_size=600, smart_chunking=1):
+    # overlapped pipeline:  parse+chunk (C parser) -> index (block db) -> embed (vector db)
+    # bounded queues between the stages apply back-pressure, so a slow stage stalls the ones before it
+    # instead of buffering the whole folder in memory
+
+    if not vector_db:
+        vector_db = LLMWareConfig().get_vector_db()
+
+    embedding_model = ModelCatalog().load_model(selected_model=embedding_model_name)
+
+    files_q = queue.Queue()
+    parsed_q = queue.Queue(maxsize=queue_size)
+    indexed_q = queue.Queue(maxsize=queue_size)
+
+    file_list = [fn for fn in sorted(os.listdir(input_folder)) if os.path.isfile(os.path.join(input_folder, fn))]
+    for fn in file_list:
+        files_q.put(fn)
+
+    parse_stats = [_StageStats(f"parse_{i}") for i in range(parse_workers)]
+    index_stats = _StageStats("index")
+    embed_stats = _StageStats("embed")
+
+    # one Parser per thread, each with its own tmp folder for the C parser output file
+    # -- built up front, as every Parser() constructor resets the shared parser tmp folder
+    parsers = []
+    for i in range(parse_workers):
+        parser = Parser(chunk_size=chunk_size, max_chunk_size=max_chunk_size, smart_chunking=smart_chunking,
+                        copy_files_to_library=False)
+        parser.parser_tmp_folder = os.path.join(library.tmp_path, f"stream_parser_{i}" + os.sep)
+        parser.parser_image_folder = parser.parser_tmp_folder
+        os.makedirs(parser.parser_tmp_folder, exist_ok=True)
+        parsers.append(parser)
+
+    # set by the first stage that fails - the other stages stop instead of waiting on a queue that is no longer
+    # being filled or drained, and the exception is raised to the caller once all of the threads have finished
+    failed = threading.Event()
+    errors = []
+
+    def put(q, item):
+        while not failed.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q):
+        while not failed.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                pass
+        return None
+
+    def run_stage(stage, *args):
+        try:
+            stage(*args)
+        except Exception as e:
+            errors.append(e)
+            failed.set()
+
+    def parse_stage(stats, parser):
+        try:
+            while not failed.is_set():
+                try:
+                    fn = files_q.get_nowait()
+                except queue.Empty:
+                    break
+
+                t0 = time.time()
+                # resets the parser output per file, and moves the file's images out of the parser image folder
+                blocks, image_folder = parse_one_file(parser, input_folder, fn)
+                stats.busy_time += time.time() - t0
+                stats.items += 1
+                stats.blocks += len(blocks)
+
+                put(parsed_q, (fn, blocks, image_folder))
+        finally:
+            put(parsed_q, _PIPELINE_DONE)
+
+    def index_stage():
+        # one writer for the whole run - the bulk writer on sqlite, and one CollectionWriter on mongo, which keeps
+        # its connection open (the postgres writer closes its connection after every record)
+        bulk_writer = None
+        try:
+            active_db = LLMWareConfig().get_active_db()
+            bulk_writer = SQLiteBulkBlockWriter(library).open() if active_db == "sqlite" else None
+            writer = CollectionWriter(library.library_name, account_name=library.account_name) \
+                if active_db == "mongo" else None
+
+            finished_parsers = 0
+            while finished_parsers < parse_workers:
+                index_stats.queue_samples.append(parsed_q.qsize())
+                item = get(parsed_q)
+                if item is None:
+                    break
+                if item is _PIPELINE_DONE:
+                    finished_parsers += 1
+                    continue
+
+                fn, blocks, image_folder = item
+                if not blocks:
+                    shutil.rmtree(image_folder, ignore_errors=True)
+                    continue
+
+                t0 = time.time()
+                doc_id = library.get_and_increment_doc_id()
+                pages = set()
+                for block_id, block in enumerate(blocks):
+                    block["doc_ID"] = doc_id
+                    block["block_ID"] = block_id
+                    pages.add(block["master_index"])
+
+                images = move_parsed_images(library, blocks, image_folder)
+
+                if bulk_writer:
+                    # committed before the embed stage is told about the blocks
+                    bulk_writer.write_blocks(blocks)
+                    bulk_writer.flush()
+                else:
+                    for block in blocks:
+                        (writer or CollectionWriter(library.library_name, account_name=library.account_name)).\
+                            write_new_parsing_record(block)
+
+                shutil.copy(os.path.join(input_folder, fn), library.file_copy_path)
+                library.set_incremental_docs_blocks_images(added_docs=1, added_blocks=len(blocks),
+                                                           added_images=images, added_pages=len(pages))
+                index_stats.busy_time += time.time() - t0
+                index_stats.items += 1
+                index_stats.blocks += len(blocks)
+
+                put(indexed_q, len(blocks))
+        finally:
+            try:
+                if bulk_writer:
+                    bulk_writer.close()
+            finally:
+                put(indexed_q, _PIPELINE_DONE)
+
+    def embed_stage():
+        # embeds whatever has been indexed but not yet embedded, as soon as a full batch is waiting
+        handler = EmbeddingHandler(library)
+        pending = 0
+        done = False
+        while not done:
+            embed_stats.queue_samples.append(indexed_q.qsize())
+            item = get(indexed_q)
+            if item is None:
+                break
+            if item is _PIPELINE_DONE:
+                done = True
+            else:
+                pending += item
+
+            if pending and (pending >= embed_batch_size or done):
+                t0 = time.time()
+                summary = handler.create_new_embedding(vector_db, embedding_model, batch_size=embed_batch_size)
+                embed_stats.busy_time += time.time() - t0
+                embed_stats.items += 1
+                embed_stats.blocks += summary["embeddings_created"] if summary else 0
+                pending = 0
+
+    t_start = time.time()
+
+    threads = [threading.Thread(target=run_stage, args=(parse_stage, parse_stats[i], parsers[i]))
+               for i in range(parse_workers)]
+    threads += [threading.Thread(target=run_stage, args=(index_stage,)),
+                threading.Thread(target=run_stage, args=(embed_stage,))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if errors:
+        raise errors[0]
+
+    elapsed = time.time() - t_start
+
+    report = [s.report() for s in parse_stats] + [index_stats.report(), embed_stats.report()]
+
+    print(f"\nStreaming pipeline complete - files: {len(file_list)} - total time: {round(elapsed, 2)}s")
+    for row in report:
+        print(f"  {row['stage']:<8} - items: {row['items']:>5} - blocks: {row['blocks']:>7} - "
+              f"busy: {row['busy_time']:>7}s - blocks/sec: {row['blocks_per_sec']:>8} - "
+              f"input queue avg/max: {row['avg_input_queue']}/{row['max_input_queue']}")
+
+    # the stage with the highest busy time is the bottleneck - the queue in front of it stays full
+    bottleneck = max(report, key=lambda r: r["busy_time"])
+    print(f"  bottleneck stage: {bottleneck['stage']}")
+
+    return {"elapsed_time": elapsed, "stages": report, "bottleneck": bottleneck["stage"]}
+
 
 if __name__ == "__main__":
     LLMWareConfig().set_active_db("sqlite")
     MilvusConfig().set_config("lite", True)
     LLMWareConfig().set_vector_db("chromadb")
 
+    #   zero-dependency alternative for small and medium libraries - memory-mapped numpy index (embeddings_ext)
+    #   or "numpy_mmap_int8" / "numpy_mmap_binary" - quantized codes, re-scored in full precision (see example 12)
+    # LLMWareConfig().set_vector_db("numpy_mmap")
+
     library = setup_library("svm_library")
 
     embedding_model = "mini-lm-sbert"  # Make sure torch + transformers are installed
 
     install_vector_embeddings(library, embedding_model)
+
+    #   opt-in - serve text already embedded with this model from the on-disk embedding cache, and probe the
+    #   model batch size instead of using a fixed batch of 100
+    # install_vector_embeddings(library, embedding_model, use_cache=True, adaptive_batch=True)
+
+    #   large libraries - spread the forward passes across worker processes (one model per worker)
+    # install_vector_embeddings(library, embedding_model, embedding_workers=4)
+
+    #   alternative - overlap parsing and embedding in one streaming pass, with per-stage throughput report
+    # streaming_ingest_and_embed(Library().create_new_library("svm_library_stream"),
+    #                            os.path.join(os.getcwd(), "myfolder"), embedding_model)
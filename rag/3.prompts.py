@@ -28,6 +28,8 @@ import time
 from llmware.prompts import Prompt
 from llmware.models import ModelCatalog
 
+from prompts_ext import ExtendedPrompt
+
 
 def hello_world_questions():
 
@@ -266,19 +268,19 @@ def fast_start_prompting  (model_name):
 
     print(f"\n > Loading Model: {model_name}...")
 
-    prompter = Prompt().load_model(model_name)
+    prompter = ExtendedPrompt().load_model(model_name)
 
     t1 = time.time()
     print(f"\n > Model {model_name} load time: {t1-t0} seconds")
- 
-    for i, entries in enumerate(test_list):
+
+    #   run all of the prompts in one batch - same outputs as calling prompter.prompt_main on each entry, but on
+    #   GGUF, ONNX and OpenVINO models, the prompts share the generation steps (see prompts_ext.py)
+    outputs = prompter.prompt_main_batch(test_list,
+                                         prompt_name="default_with_context",
+                                         temperature=0.30)
+
+    for i, (entries, output) in enumerate(zip(test_list, outputs)):
         print(f"\n{i+1}. Query: {entries['query']}")
-     
-        #   run the prompt
-        output = prompter.prompt_main(entries["query"],
-                                      context=entries["context"],
-                                      prompt_name="default_with_context",
-                                      temperature=0.30)
 
         #   'output' is a dictionary with two keys - 'llm_response' and 'usage'
         #   --'llm_response' is the output from the model
@@ -292,12 +294,41 @@ def fast_start_prompting  (model_name):
 
         print(f"LLM Usage: {output['usage']}")
 
+    print(f"\nBatch stats: {prompter.last_batch_stats}")
+
     t2 = time.time()
     print(f"\nTotal processing time: {t2-t1} seconds")
 
     return 0
 
 
+def batch_vs_sequential_throughput(model_name, max_slots=4):
+
+    """ Runs the test questions through prompt_main one at a time, and then through prompt_main_batch, and
+    compares the output tokens / sec of the two. """
+
+    test_list = hello_world_questions()
+
+    prompter = ExtendedPrompt().load_model(model_name, temperature=0.0, sample=False)
+
+    t0 = time.time()
+    sequential = [prompter.prompt_main(entries["query"], context=entries["context"],
+                                       prompt_name="default_with_context") for entries in test_list]
+    sequential_time = time.time() - t0
+    sequential_tokens = sum(output["usage"].get("output", 0) for output in sequential)
+
+    batched = prompter.prompt_main_batch(test_list, prompt_name="default_with_context", max_slots=max_slots)
+
+    same_answers = sum(1 for a, b in zip(sequential, batched) if a["llm_response"] == b["llm_response"])
+
+    print(f"\nsequential - {sequential_tokens} tokens - {round(sequential_tokens / sequential_time, 2)} tokens/sec")
+    print(f"batch      - {prompter.last_batch_stats['output_tokens']} tokens - "
+          f"{prompter.last_batch_stats['tokens_per_sec']} tokens/sec - mode: {prompter.last_batch_stats['mode']}")
+    print(f"same answers: {same_answers} of {len(test_list)}")
+
+    return 0
+
+
 if __name__ == "__main__":
 
     #   Step 1 - we will pick a model from the ModelCatalog
@@ -336,3 +367,6 @@ if __name__ == "__main__":
     #   os.environ["USER_MANAGED_OPENAI_API_KEY"] = "<insert-your-openai-key>"
 
     fast_start_prompting(model_name)
+
+    #   to compare the tokens / sec of prompt_main_batch with one prompt_main call after another
+    #   batch_vs_sequential_throughput(model_name)
@@ -20,13 +20,39 @@ import re
 from llmware.prompts import Prompt, HumanInTheLoop
 from llmware.setup import Setup
 from llmware.configs import LLMWareConfig
-from llmware.retrieval import Query
 from llmware.library import Library
+from llmware.gguf_configs import GGUFConfigs
 
+from retrieval_ext import ExtendedQuery
+from prompts_ext import ExtendedPrompt
 
-def example_4a_contract_analysis_from_library (model_name, verbose=False):
 
-    """ Example #4a:  Main general case to run a RAG workflow from a Library """
+def _merge_by_rank(result_lists):
+
+    """ One list of the results of several topics - the top result of each topic, then the second of each
+    topic .. - without duplicate blocks, so that the best hits of every topic are in the first source batch. """
+
+    merged = []
+    seen = set()
+
+    for rank in range(max((len(results) for results in result_lists), default=0)):
+        for results in result_lists:
+            if rank < len(results) and results[rank]["_id"] not in seen:
+                seen.add(results[rank]["_id"])
+                merged.append(results[rank])
+
+    return merged
+
+
+def example_4a_contract_analysis_from_library (model_name, verbose=False, shared_source=False):
+
+    """ Example #4a:  Main general case to run a RAG workflow from a Library
+
+    shared_source=True - variant with one source per contract, merged from the results of all of the topics,
+    so that every question on the contract is asked on the same context - with a GGUF model, the kv cache of
+    that context is kept between the questions (reuse_kv_prefix), and the follow-up questions only prefill the
+    question tokens.  Note that each question is then answered from the merged source, rather than from the
+    results of its own topic. """
 
     # Load the llmware sample files
     print (f"\n > Loading the llmware sample files...")
@@ -43,7 +69,7 @@ def example_4a_contract_analysis_from_library (model_name, verbose=False):
 
     print (f"\n > Loading model {model_name}...")
 
-    q = Query(contracts_lib)
+    q = ExtendedQuery(contracts_lib)
 
     # get a list of all of the unique documents in the library
 
@@ -55,12 +81,36 @@ def example_4a_contract_analysis_from_library (model_name, verbose=False):
     fn_list = q.list_doc_fn()
     print("update: filename list - ", fn_list)
 
-    prompter = Prompt().load_model(model_name)
+    #   run all of the topics against all of the documents in one query - results keyed by (doc_ID, topic)
+    #   -- equivalent to calling q.text_query_with_document_filter(topic, {"doc_ID": [doc_id]}, result_count=5,
+    #   -- exact_mode=True) for each document and each topic
+    topic_list = [question["topic"] for question in question_list]
+    results_by_doc_topic = q.text_query_by_document_and_topic(topic_list, doc_list, result_count=5, exact_mode=True)
+
+    if shared_source:
+        prompter = ExtendedPrompt(reuse_kv_prefix=True).load_model(model_name)
+
+        #   adds 'first_token_processing_time' to the usage of each response - compare the first question on each
+        #   contract with the follow-up questions
+        GGUFConfigs().set_config("get_first_token_speed", True)
+    else:
+        prompter = Prompt().load_model(model_name)
 
     for i, doc_id in enumerate(doc_list):
 
         print("\nAnalyzing contract: ", str(i+1), doc_id, fn_list[i])
 
+        if shared_source:
+
+            #   one source per contract, with the results of all of the topics
+            query_results = _merge_by_rank([results_by_doc_topic[(doc_id, topic)] for topic in topic_list])
+
+            if verbose:
+                for j, qr in enumerate(query_results):
+                    print("update: querying document - ", j, doc_id, qr)
+
+            source = prompter.add_source_query_results(query_results)
+
         print("LLM Responses")
 
         for question in question_list:
@@ -68,15 +118,16 @@ def example_4a_contract_analysis_from_library (model_name, verbose=False):
             query_topic = question["topic"]
             llm_question = question["llm_query"]
 
-            doc_filter = {"doc_ID": [doc_id]}
-            query_results = q.text_query_with_document_filter(query_topic,doc_filter,result_count=5,exact_mode=True)
+            if not shared_source:
 
-            if verbose:
-                # this will display the query results from the query above
-                for j, qr in enumerate(query_results):
-                    print("update: querying document - ", query_topic, j, doc_filter, qr)
+                query_results = results_by_doc_topic[(doc_id, query_topic)]
 
-            source = prompter.add_source_query_results(query_results)
+                if verbose:
+                    # this will display the query results from the query above
+                    for j, qr in enumerate(query_results):
+                        print("update: querying document - ", query_topic, j, doc_id, qr)
+
+                source = prompter.add_source_query_results(query_results)
 
             #   *** this is the call to the llm with the source packaged in the context automatically ***
             responses = prompter.prompt_with_source(llm_question, prompt_name="default_with_context", temperature=0.3)
@@ -85,9 +136,19 @@ def example_4a_contract_analysis_from_library (model_name, verbose=False):
             for r, response in enumerate(responses):
                 print("update: llm response -  ", llm_question, re.sub("[\n]"," ", response["llm_response"]).strip())
 
+                if shared_source:
+                    print("update: first token secs - ", response["usage"].get("first_token_processing_time"))
+
             # We're done with this contract, clear the source from the prompt
+            if not shared_source:
+                prompter.clear_source_materials()
+
+        if shared_source:
             prompter.clear_source_materials()
 
+    if shared_source and prompter.prefix_cache:
+        print("\nupdate: kv prefix reuse - ", prompter.prefix_cache.get_stats())
+
     #   Save jsonl report to jsonl to /prompt_history folder
     print("\nPrompt state saved at: ", os.path.join(LLMWareConfig.get_prompt_path(),prompter.prompt_id))
     prompter.save_state()
@@ -188,5 +249,8 @@ if __name__ == "__main__":
     #   first let's look at the main way of retrieving and analyzing from a library
     example_4a_contract_analysis_from_library(model_name)
 
+    #   variant - one merged source per contract, with the kv cache of the source reused across the questions
+    # example_4a_contract_analysis_from_library(model_name, shared_source=True)
+
     #   second - uncomment this line, and lets run the "in-line" prompt way
     # example_4b_contract_analysis_direct_from_prompt(model_name)
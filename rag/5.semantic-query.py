@@ -24,6 +24,7 @@
         -- chromadb:     `pip3 install chromadb`
         -- lancedb:      `pip3 install lancedb`
         -- faiss:        `pip3 install faiss`
+        -- numpy_mmap:   no install - memory-mapped numpy index in embeddings_ext.py, registered on import
 
 
 """
@@ -36,8 +37,13 @@ from llmware.setup import Setup
 from llmware.status import Status
 from llmware.prompts import Prompt
 from llmware.configs import LLMWareConfig, MilvusConfig
+from llmware.models import ModelCatalog
+from llmware.embeddings import EmbeddingHandler
 from importlib import util
 
+from embeddings_ext import AdaptiveBatchEmbeddingModel, record_embedding_status_note
+from retrieval_ext import ExtendedQuery
+
 if not util.find_spec("torch") or not util.find_spec("transformers"):
     print("\nto run this example, with the selected embedding model, please install transformers and torch, e.g., "
           "\n`pip install torch`"
@@ -47,7 +53,7 @@ if not (util.find_spec("chromadb") or util.find_spec("pymilvus") or util.find_sp
     print("\nto run this example, you will need to pip install the vector db drivers. see comments above.")
 
 
-def semantic_rag (library_name, embedding_model_name, llm_model_name):
+def semantic_rag (library_name, embedding_model_name, llm_model_name, adaptive_batch=False, top_k_per_document=None):
 
     """ Illustrates the use of semantic embedding vectors in a RAG workflow
         --self-contained example - will be duplicative with some of the steps taken in other examples """
@@ -75,7 +81,22 @@ def semantic_rag (library_name, embedding_model_name, llm_model_name):
     # Step 4 - Install the embeddings
     print("\nupdate: Step 4 - Generating Embeddings in {} db - with Model- {}".format(vector_db, embedding_model))
 
-    library.install_new_embedding(embedding_model_name=embedding_model_name, vector_db=vector_db, batch_size=200)
+    if not adaptive_batch:
+        library.install_new_embedding(embedding_model_name=embedding_model_name, vector_db=vector_db, batch_size=200)
+
+    else:
+        #   -- optional: the model batch size is tuned at run time (probed over the first batches, within an RSS
+        #   -- ceiling) instead of the fixed batch_size=200
+        adaptive_model = AdaptiveBatchEmbeddingModel(ModelCatalog().load_model(selected_model=embedding_model_name),
+                                                     rss_ceiling_mb=4096)
+
+        EmbeddingHandler(library).create_new_embedding(vector_db, adaptive_model, batch_size=512)
+
+        batch_stats = adaptive_model.get_stats()
+        print("update: adaptive batching - ", batch_stats)
+        record_embedding_status_note(library_name, embedding_model_name,
+                                     f"batch_size: {batch_stats['batch_size']} - "
+                                     f"blocks/sec: {batch_stats['blocks_per_sec']}")
 
     # RAG steps start here ...
 
@@ -85,12 +106,31 @@ def semantic_rag (library_name, embedding_model_name, llm_model_name):
 
     query = "what is the executive's base annual salary"
 
-    #   key step: run semantic query against the library and get all of the top results
-    results = Query(library).semantic_query(query, result_count=80, embedding_distance_threshold=1.0)
+    if not top_k_per_document:
+        #   key step: run semantic query against the library and get all of the top results
+        results = Query(library).semantic_query(query, result_count=80, embedding_distance_threshold=1.0)
+
+    else:
+        #   -- optional: top_k_per_document runs the top-k within each document in the vector search, so small
+        #   -- documents keep their hits (instead of the top 80 across the library, which may all come from a few
+        #   -- long contracts) - to search only some of the documents, add e.g., doc_filter={"doc_ID": [1, 2]}
+        results = ExtendedQuery(library).semantic_query(query, embedding_distance_threshold=1.0,
+                                                        top_k_per_document=top_k_per_document)
 
     #   if you want to look at 'results', uncomment the line below
     # for i, res in enumerate(results): print("\nupdate: ", i, res["file_source"], res["distance"], res["text"])
 
+    #   group the results by file in one pass
+    results_by_file = {}
+    for j, entries in enumerate(results):
+
+        library_fn = entries["file_source"]
+        if os.sep in library_fn:
+            # handles difference in windows file formats vs. mac / linux
+            library_fn = library_fn.split(os.sep)[-1]
+
+        results_by_file.setdefault(library_fn, []).append((j, entries))
+
     for i, contract in enumerate(os.listdir(contracts_path)):
 
         qr = []
@@ -99,17 +139,9 @@ def semantic_rag (library_name, embedding_model_name, llm_model_name):
 
             print("\nContract Name: ", i, contract)
 
-            #   we will look through the list of semantic query results, and pull the top results for each file
-            for j, entries in enumerate(results):
-
-                library_fn = entries["file_source"]
-                if os.sep in library_fn:
-                    # handles difference in windows file formats vs. mac / linux
-                    library_fn = library_fn.split(os.sep)[-1]
-
-                if library_fn == contract:
-                    print("Top Retrieval: ", j, entries["distance"], entries["text"])
-                    qr.append(entries)
+            for j, entries in results_by_file.get(contract, []):
+                print("Top Retrieval: ", j, entries["distance"], entries["text"])
+                qr.append(entries)
 
             #   we will add the query results to the prompt
             source = prompter.add_source_query_results(query_results=qr)
@@ -145,7 +177,7 @@ if __name__ == "__main__":
     #   using a different vector db -> note: milvus lite only on mac/linux (not windows)
     MilvusConfig().set_config("lite", True)
 
-    #   select one of:  'milvus' | 'chromadb' | 'lancedb' | 'faiss'
+    #   select one of:  'milvus' | 'chromadb' | 'lancedb' | 'faiss' | 'numpy_mmap'
     LLMWareConfig().set_vector_db("chromadb")
 
     vector_db = "chromadb"
@@ -164,4 +196,7 @@ if __name__ == "__main__":
 
     semantic_rag(lib_name, embedding_model, llm_model_name)
 
+    #   optional - tune the embedding batch size at run time, and retrieve the top 3 results of each contract
+    # semantic_rag(lib_name, embedding_model, llm_model_name, adaptive_batch=True, top_k_per_document=3)
+
 
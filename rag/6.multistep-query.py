@@ -9,6 +9,9 @@
     3.  Use fact-checking and post-processing to validate the accuracy of the LLM response
     4.  Write the output to JSON and CSV files for follow-up review and/or the next step in the workflow.
 
+    Optionally, the library is also embedded - contracts share a lot of boilerplate, so near-duplicate blocks are
+    found first (MinHash / LSH in embeddings_ext.py) and share one embedding and one vector.
+
     For this example, we also recommend using a more sophisticated DRAGON model in GGUF format, which enables us
     to run 6-7B parameter models locally.
 
@@ -19,11 +22,14 @@ import os
 from llmware.setup import Setup
 from llmware.library import Library
 from llmware.prompts import Prompt, HumanInTheLoop
-from llmware.retrieval import Query
 from llmware.configs import LLMWareConfig
+from llmware.models import ModelCatalog
+
+from embeddings_ext import dedup_and_embed
+from retrieval_ext import ExtendedQuery, export_pages_to_jsonl
 
 
-def msa_processing(library_name, llm_model_name):
+def msa_processing(library_name, llm_model_name, embedding_model_name=None, vector_db="numpy_mmap"):
 
     """ In this example, we will use the 'AgreementsLarge' sample files which consists of ~80 contracts.  We
     need to quickly identify the 'master service agreements' as we only want to analyze those contracts. """
@@ -36,13 +42,23 @@ def msa_processing(library_name, llm_model_name):
     msa_lib = Library().create_new_library(library_name)
     msa_lib.add_files(agreements_path)
 
+    #   optional - embed the library, with near-duplicate boilerplate blocks embedded only once
+    if embedding_model_name:
+        embedding_model = ModelCatalog().load_model(selected_model=embedding_model_name)
+        dedup_report = dedup_and_embed(msa_lib, vector_db, embedding_model, threshold=0.9)
+
+        print(f"\nupdate: dedup - blocks: {dedup_report['blocks']} - clusters: {dedup_report['clusters']} - "
+              f"embedding calls saved: {dedup_report['embedding_calls_saved']} - "
+              f"vector storage saved: {dedup_report['vector_storage_saved_mb']} MB")
+
     #   find the "master service agreements" (MSA) - we know that 'master services agreement' will always
     #   be on the first page of the agreement, so we can use that as a good proxy for automatically filtering
     #   to our target set of documents
 
     print(f"\nCompleted Parsing - now, let's look for the 'master service agreements', e.g., 'msa'")
 
-    q = Query(msa_lib)
+    #   fts5_search - on sqlite, the quoted query is matched as a phrase (the words in order), and ranked by BM25
+    q = ExtendedQuery(msa_lib, fts5_search=True)
     query = '"master services agreement"'
     results = q.text_search_by_page(query, page_num=1, results_only=False)
 
@@ -90,6 +106,14 @@ def msa_processing(library_name, llm_model_name):
 
         prompter.clear_source_materials()
 
+    #   audit export - every block in the library that mentions termination, written to jsonl a page at a time
+    #   -- iter_text_query reads the matches from the database cursor in pages, so memory stays flat, however
+    #   -- large the library (with_text=False skips the text, and q.load_text(page) adds it where needed)
+    audit_fp = os.path.join(LLMWareConfig.get_prompt_path(), f"{library_name}_termination_audit.jsonl")
+    audit_count = export_pages_to_jsonl(q.iter_text_query("termination", page_size=1000, with_text=True), audit_fp)
+
+    print(f"\nupdate: audit export - {audit_count} termination matches saved at: {audit_fp}")
+
     # Save jsonl report with full transaction history to /prompt_history folder
     print("\nupdate: Prompt state saved at: ", os.path.join(LLMWareConfig.get_prompt_path(),prompter.prompt_id))
 
@@ -113,3 +137,6 @@ if __name__ == "__main__":
     #   feel free to also try:  "dragon-yi-answer-tool" as a good substitute option
 
     m = msa_processing("example6_library", llm)
+
+    #   to also embed the library, with near-duplicate blocks sharing one vector - uncomment this line
+    #   m = msa_processing("example6_library", llm, embedding_model_name="mini-lm-sbert")
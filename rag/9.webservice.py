@@ -21,6 +21,8 @@ from llmware.parsers import WikiParser
 from importlib import util
 import json
 
+from prompts_ext import ResponseCache, cache_model_calls
+
 if not util.find_spec("yfinance"):
     print("\nTo run this example, please install yfinance: pip install yfinance")
 
@@ -41,9 +43,16 @@ text = (
 )
 
 def research_example1():
-    model = ModelCatalog().load_model("slim-extract-tool", temperature=0.0, sample=False)
-    model2 = ModelCatalog().load_model("slim-summary-tool", sample=False, temperature=0.0, max_output=200)
-    model3 = ModelCatalog().load_model("bling-stablelm-3b-tool", sample=False, temperature=0.0)
+    #   all three models run greedy (sample=False) - their function_call and inference outputs are cached on disk
+    #   in one response cache, so re-running the research on the same company runs no inference
+    response_cache = ResponseCache()
+
+    model = cache_model_calls(ModelCatalog().load_model("slim-extract-tool", temperature=0.0, sample=False),
+                              response_cache)
+    model2 = cache_model_calls(ModelCatalog().load_model("slim-summary-tool", sample=False, temperature=0.0,
+                                                         max_output=200), response_cache)
+    model3 = cache_model_calls(ModelCatalog().load_model("bling-stablelm-3b-tool", sample=False, temperature=0.0),
+                               response_cache)
 
     research_summary = {}
 
@@ -148,6 +157,8 @@ def research_example1():
         val = str(v).replace("\n", "").replace("\r", "").replace("\t", "")
         print(f"\t -- {idx} - {k.ljust(25)} - {val[:100]}")
 
+    print("\nresponse cache: ", response_cache.get_stats())
+
     return research_summary
 
 
@@ -0,0 +1,248 @@
+
+"""     Async extensions used by the examples in this folder - awaitable query and prompt methods for serving
+    from an asyncio web tier (e.g., fastapi), without blocking the event loop or starting a thread per request.
+
+    1.  AsyncQuery - awaitable query, text_query, semantic_query, hybrid_query and semantic_query_batch, on a
+        fixed pool of ExtendedQuery objects (retrieval_ext.py) - each request checks out one query object.
+    2.  AsyncPrompt - awaitable prompt_main and prompt_with_source, on a fixed pool of loaded Prompt objects -
+        each request checks out one prompter, so the sources of concurrent requests are never mixed.
+    3.  RequestCoalescer - identical requests that arrive while the first one is still running share its
+        result, instead of running again - used by both.
+
+    The blocking work (text index, embedding model, vector db, llm) runs in the executor threads, and the event
+    loop only awaits the futures.  max_pending bounds the requests that are running or queued for the executor
+    - any further requests wait in the event loop until a slot is free.
+
+"""
+
+import copy
+import json
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from llmware.prompts import Prompt
+
+from retrieval_ext import ExtendedQuery
+
+
+def _coalesce_key(method_name, args, kwargs):
+    return method_name, json.dumps([args, kwargs], sort_keys=True, default=str)
+
+
+class RequestCoalescer:
+
+    """ Runs one call per key at a time - a call with the same key as a running call waits for that call and
+    gets a copy of its result (or its exception).  Used from one event loop, so no lock is needed.
+
+    The call runs as a task of its own, which none of the callers own - a caller that is cancelled stops
+    waiting, and the call carries on for the other callers. """
+
+    def __init__(self):
+
+        # key -> [task of the running call, number of callers that joined it]
+        self.in_flight = {}
+
+        self.calls = 0
+        self.coalesced = 0
+
+    async def run(self, key, call):
+
+        """ Awaits call() - or the running call with the same key. """
+
+        self.calls += 1
+
+        running = self.in_flight.get(key)
+        if running:
+            self.coalesced += 1
+            running[1] += 1
+            return copy.deepcopy(await asyncio.shield(running[0]))
+
+        task = asyncio.ensure_future(call())
+        entry = self.in_flight[key] = [task, 0]
+        task.add_done_callback(functools.partial(self._call_done, key))
+
+        result = await asyncio.shield(task)
+
+        # the callers that joined get their own copies - so does this one, if it is not the only caller
+        return copy.deepcopy(result) if entry[1] else result
+
+    def _call_done(self, key, task):
+
+        if self.in_flight.get(key, [None])[0] is task:
+            del self.in_flight[key]
+
+        # marks the exception as retrieved, in case every caller was cancelled before the call finished
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self):
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self.in_flight)}
+
+
+class _AsyncRunner:
+
+    """ Shared plumbing - a pool of objects (one per executor thread) that are checked out one per request, the
+    bounded executor, max_pending slots and optional coalescing. """
+
+    def __init__(self, pool, max_pending, coalesce, thread_name_prefix):
+
+        self.pool = pool
+        self.max_workers = len(pool)
+        self.max_pending = max_pending
+
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=thread_name_prefix)
+        self.coalescer = RequestCoalescer() if coalesce else None
+
+        # created on first use, in the running event loop
+        self._slots = None
+        self._idle = None
+
+    async def _submit(self, method_name, args, kwargs, run):
+
+        """ Awaits run() in one of the max_pending slots - or the identical running request, if coalescing. """
+
+        async def call():
+
+            if self._slots is None:
+                self._slots = asyncio.Semaphore(self.max_pending)
+
+            async with self._slots:
+                return await run()
+
+        if not self.coalescer:
+            return await call()
+
+        return await self.coalescer.run(_coalesce_key(method_name, args, kwargs), call)
+
+    async def _run_pooled(self, method_name, args, kwargs, pooled_call):
+
+        """ Checks out an idle pool object, and runs pooled_call(obj) with it in the executor. """
+
+        async def with_pool_object():
+
+            if self._idle is None:
+                self._idle = asyncio.Queue()
+                for obj in self.pool:
+                    self._idle.put_nowait(obj)
+
+            obj = await self._idle.get()
+
+            # the object goes back to the pool when the executor thread is done with it - not when the request
+            # stops waiting, e.g., if it is cancelled while the call is still running
+            loop = asyncio.get_running_loop()
+            future = self.executor.submit(pooled_call, obj)
+            future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._idle.put_nowait, obj))
+
+            return await asyncio.wrap_future(future)
+
+        return await self._submit(method_name, args, kwargs, with_pool_object)
+
+    def get_stats(self):
+
+        stats = {"max_workers": self.max_workers, "max_pending": self.max_pending}
+        if self.coalescer:
+            stats.update(self.coalescer.get_stats())
+
+        return stats
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+class AsyncQuery(_AsyncRunner):
+
+    """ Awaitable query methods on a pool of ExtendedQuery objects - created like ExtendedQuery, e.g.,
+    `AsyncQuery(library, max_workers=4)`, with the ExtendedQuery options passed through (use_result_cache,
+    fts5_search, collect_timing ..), or over query objects already created with `AsyncQuery(library,
+    queries=[..])`.
+
+    Each request checks out one query object, as Query keeps per-call state (e.g., query_embedding,
+    last_timing) on the object.  The pool built here has one query object per executor thread, with
+    save_history=False by default (otherwise every result is kept in query.results), and one embedding
+    model, loaded once up front and shared by all of them. """
+
+    def __init__(self, library, max_workers=4, max_pending=64, coalesce=True, queries=None, **query_kwargs):
+
+        if not queries:
+            query_kwargs.setdefault("save_history", False)
+            queries = [ExtendedQuery(library, **query_kwargs) for _ in range(max_workers)]
+
+            # loaded here, before any concurrent call - Query loads the model lazily on the first semantic query
+            if queries[0].embedding_model_name:
+                embedding_model = queries[0].load_embedding_model().embedding_model
+                for query in queries[1:]:
+                    query.embedding_model = embedding_model
+
+        super().__init__(queries, max_pending, coalesce, "async_query")
+
+        self.queries = queries
+
+    async def _run(self, method_name, *args, **kwargs):
+
+        def call(query):
+            return getattr(query, method_name)(*args, **kwargs)
+
+        return await self._run_pooled(method_name, args, kwargs, call)
+
+    async def query(self, *args, **kwargs):
+        return await self._run("query", *args, **kwargs)
+
+    async def text_query(self, *args, **kwargs):
+        return await self._run("text_query", *args, **kwargs)
+
+    async def text_query_with_document_filter(self, *args, **kwargs):
+        return await self._run("text_query_with_document_filter", *args, **kwargs)
+
+    async def semantic_query(self, *args, **kwargs):
+        return await self._run("semantic_query", *args, **kwargs)
+
+    async def semantic_query_batch(self, *args, **kwargs):
+        return await self._run("semantic_query_batch", *args, **kwargs)
+
+    async def hybrid_query(self, *args, **kwargs):
+        return await self._run("hybrid_query", *args, **kwargs)
+
+
+class AsyncPrompt(_AsyncRunner):
+
+    """ Awaitable prompt methods on a pool of Prompt objects, each with its own copy of the model - pool_size
+    requests run at the same time (one per executor thread), e.g., `AsyncPrompt("bling-phi-3-gguf", pool_size=2,
+    temperature=0.0, sample=False)`, or over prompters already loaded with `AsyncPrompt(prompters=[..])`.
+
+    prompt_with_source takes the query results with the request - the prompter adds them as the source,
+    runs the prompt, and clears the source before it is returned to the pool. """
+
+    def __init__(self, model_name=None, pool_size=1, max_pending=64, coalesce=True, prompters=None, **model_kwargs):
+
+        if not prompters:
+            prompters = [Prompt().load_model(model_name, **model_kwargs) for _ in range(pool_size)]
+
+        super().__init__(prompters, max_pending, coalesce, "async_prompt")
+
+        self.prompters = prompters
+
+    async def prompt_main(self, prompt, **kwargs):
+
+        def call(prompter):
+            return prompter.prompt_main(prompt, **kwargs)
+
+        return await self._run_pooled("prompt_main", (prompt,), kwargs, call)
+
+    async def prompt_with_source(self, prompt, query_results, **kwargs):
+
+        def call(prompter):
+            prompter.clear_source_materials()
+            prompter.add_source_query_results(query_results)
+            try:
+                return prompter.prompt_with_source(prompt, **kwargs)
+            finally:
+                prompter.clear_source_materials()
+
+        return await self._run_pooled("prompt_with_source", (prompt, query_results), kwargs, call)
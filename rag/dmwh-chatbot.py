@@ -1,5 +1,6 @@
 from llmware.library import Library
-from llmware.retrieval import Query
+
+from retrieval_ext import ExtendedQuery
 
 # Step 1: Create the object
 library = Library()
@@ -7,8 +8,9 @@ library = Library()
 # Step 2: Load the existing library
 library.load_library("my_custom_library")
 
-# Step 3: Run query
-query_runner = Query(library)
+# Step 3: Run query - with the result cache, a repeated question is answered without hitting the database,
+# until the library changes (new blocks or a new embedding)
+query_runner = ExtendedQuery(library, use_result_cache=True)
 
 # Your questions
 queries = [
@@ -17,11 +19,21 @@ queries = [
     "k-nearest neighbors explanation"
 ]
 
+# Optional: set to True to run a semantic query instead (the library needs an embedding) - all of the questions
+# are embedded and searched in one batch
+use_semantic_query = False
+
 # Execute
-for q in queries:
+if use_semantic_query:
+    all_results = query_runner.semantic_query_batch(queries, result_count=3)
+else:
+    all_results = [query_runner.query(q, result_count=3) for q in queries]
+
+for q, results in zip(queries, all_results):
     print(f"\n🔍 Query: {q}")
-    results = query_runner.query(q, result_count=3)
     for i, res in enumerate(results):
         print(f"\nResult {i+1}:")
         print(f"📄 File: {res['file_source']} (Page {res['page_num']})")
         print(f"🧠 Text: {res['text']}\n")
+
+print(f"\n📊 Query cache: {query_runner.get_cache_stats()}")
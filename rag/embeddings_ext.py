@@ -0,0 +1,1363 @@
+
+"""     Embedding extensions used by the examples in this folder.
+
+    These build on the public llmware embedding interfaces - any object with `.embedding(text_list)`,
+    `.model_name` and `.embedding_dims` can be passed as the model to `EmbeddingHandler.create_new_embedding`,
+    so the classes below wrap a loaded llmware embedding model rather than changing llmware itself.
+
+    1.  EmbeddingCache - persistent on-disk cache of embedding vectors, keyed by model + text hash.
+    2.  CachedEmbeddingModel - wraps a loaded embedding model and consults the cache before the model.
+    3.  AdaptiveBatchEmbeddingModel - probes throughput and memory over the first batches, and settles on the
+        fastest model batch size that stays under an RSS ceiling.
+    4.  ParallelEmbeddingModel - runs the forward passes in a pool of worker processes, one model per worker.
+    5.  EmbeddingNumpyMemmap - zero-dependency vector db that keeps the vectors in a memory-mapped NumPy file
+        and runs an exact top-k search - registered as vector_db 'numpy_mmap' when this module is imported.
+    6.  EmbeddingNumpyInt8 / EmbeddingNumpyBinary - quantized variants ('numpy_mmap_int8', 'numpy_mmap_binary')
+        that search compact codes, and re-score a shortlist against the full-precision vectors on disk.
+    7.  MinHashDeduplicator / dedup_and_embed - near-duplicate blocks share one embedding and one vector.
+
+"""
+
+import os
+import re
+import copy
+import json
+import time
+import shutil
+import sqlite3
+import zlib
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from importlib import util
+
+import numpy as np
+
+from llmware.configs import LLMWareConfig, VectorDBRegistry
+from llmware.resources import CollectionWriter
+from llmware.embeddings import _EmbeddingUtils
+from llmware.exceptions import LLMWareException, EmbeddingModelNotFoundException
+from llmware.status import Status
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+
+    """ Persistent embedding cache for one model - the vectors live in a memory-mapped float32 array, and a
+    small SQLite index maps the text hash to its slot in the array and tracks last use for LRU eviction.
+
+    The cache is bounded by max_size_mb - once the array is full, the least recently used entries are evicted
+    and their slots are re-used. The cache is shared by all libraries that embed with the same model. """
+
+    def __init__(self, model_name, embedding_dims, cache_path=None, max_size_mb=1024, evict_fraction=0.05):
+
+        self.model_name = model_name
+        self.embedding_dims = int(embedding_dims)
+
+        if not cache_path:
+            cache_path = os.path.join(LLMWareConfig().get_llmware_path(), "embedding_cache")
+
+        model_safe_path = re.sub(r"[@\/. ]", "", model_name).lower()
+        self.cache_path = os.path.join(cache_path, model_safe_path)
+        os.makedirs(self.cache_path, exist_ok=True)
+
+        self.vector_fp = os.path.join(self.cache_path, "vectors.f32")
+        self.index_fp = os.path.join(self.cache_path, "index.db")
+
+        row_bytes = self.embedding_dims * 4
+        self.max_entries = max(1, int(max_size_mb * 1024 * 1024 // row_bytes))
+        self.evict_count = max(1, int(self.max_entries * evict_fraction))
+
+        self.conn = sqlite3.connect(self.index_fp, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, slot INTEGER, last_used REAL);")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used);")
+        self.conn.commit()
+
+        # the array grows in steps up to max_entries, so a small cache does not pre-allocate the full size
+        self.capacity = 0
+        self.vectors = None
+        if os.path.exists(self.vector_fp):
+            self.capacity = os.path.getsize(self.vector_fp) // row_bytes
+            self._open_vectors()
+
+        used_slots = [row[0] for row in self.conn.execute("SELECT slot FROM cache;")]
+        self.next_slot = max(used_slots) + 1 if used_slots else 0
+        self.free_slots = sorted(set(range(self.next_slot)) - set(used_slots), reverse=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _open_vectors(self):
+        self.vectors = np.memmap(self.vector_fp, dtype=np.float32, mode="r+",
+                                 shape=(self.capacity, self.embedding_dims))
+
+    def _ensure_capacity(self, needed):
+
+        if needed <= self.capacity:
+            return
+
+        new_capacity = min(self.max_entries, max(needed, self.capacity * 2, 1024))
+
+        if self.vectors is not None:
+            self.vectors.flush()
+            del self.vectors
+
+        with open(self.vector_fp, "ab") as f:
+            f.truncate(new_capacity * self.embedding_dims * 4)
+
+        self.capacity = new_capacity
+        self._open_vectors()
+
+    @staticmethod
+    def text_key(model_name, text, max_len=None):
+        return hashlib.sha256(f"{model_name}|{max_len}|{text}".encode("utf-8", errors="ignore")).hexdigest()
+
+    def get_many(self, keys):
+
+        """ Returns {key: vector} for the keys found in the cache, and refreshes their last-used time. """
+
+        found = {}
+
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            sql = f"SELECT key, slot FROM cache WHERE key IN ({','.join(['?'] * len(chunk))});"
+            for key, slot in self.conn.execute(sql, chunk):
+                found[key] = np.array(self.vectors[slot])
+
+        if found:
+            now = time.time()
+            self.conn.executemany("UPDATE cache SET last_used = ? WHERE key = ?;", [(now, k) for k in found])
+            self.conn.commit()
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+
+        return found
+
+    def _allocate_slot(self):
+
+        if self.free_slots:
+            return self.free_slots.pop()
+
+        if self.next_slot < self.max_entries:
+            self._ensure_capacity(self.next_slot + 1)
+            self.next_slot += 1
+            return self.next_slot - 1
+
+        # cache is full - evict a batch of the least recently used entries
+        evicted = list(self.conn.execute("SELECT key, slot FROM cache ORDER BY last_used ASC LIMIT ?;",
+                                         (self.evict_count,)))
+        self.conn.executemany("DELETE FROM cache WHERE key = ?;", [(k,) for k, _ in evicted])
+        self.evictions += len(evicted)
+        self.free_slots.extend(sorted((slot for _, slot in evicted), reverse=True))
+
+        return self.free_slots.pop()
+
+    def put_many(self, key_vectors):
+
+        """ Stores {key: vector} - existing keys are overwritten in place. """
+
+        now = time.time()
+        rows = []
+
+        for key, vector in key_vectors.items():
+
+            existing = self.conn.execute("SELECT slot FROM cache WHERE key = ?;", (key,)).fetchone()
+            slot = existing[0] if existing else self._allocate_slot()
+
+            self.vectors[slot] = np.asarray(vector, dtype=np.float32).reshape(-1)[:self.embedding_dims]
+            rows.append((key, slot, now))
+
+        self.conn.executemany("INSERT OR REPLACE INTO cache (key, slot, last_used) VALUES (?, ?, ?);", rows)
+        self.conn.commit()
+        self.vectors.flush()
+
+        return len(rows)
+
+    def get_stats(self):
+
+        lookups = self.hits + self.misses
+        entries = self.conn.execute("SELECT COUNT(*) FROM cache;").fetchone()[0]
+
+        return {"model_name": self.model_name, "entries": entries, "max_entries": self.max_entries,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+    def close(self):
+        if self.vectors is not None:
+            self.vectors.flush()
+        self.conn.close()
+
+
+class CachedEmbeddingModel:
+
+    """ Wraps a loaded llmware embedding model - embedding() is served from the EmbeddingCache where possible,
+    and only the misses are run through the model.  All other attributes pass through to the wrapped model,
+    so the wrapper can be passed anywhere an embedding model is expected, e.g.,
+
+        EmbeddingHandler(library).create_new_embedding(vector_db, CachedEmbeddingModel(model), batch_size=100)
+    """
+
+    def __init__(self, model, cache=None, max_size_mb=1024):
+
+        self.model = model
+
+        if not cache:
+            cache = EmbeddingCache(model.model_name, model.embedding_dims, max_size_mb=max_size_mb)
+
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def embedding(self, text_sample, **kwargs):
+
+        single = not isinstance(text_sample, list)
+        texts = [text_sample] if single else text_sample
+
+        max_len = getattr(self.model, "max_len", None)
+        keys = [EmbeddingCache.text_key(self.model.model_name, t, max_len) for t in texts]
+
+        found = self.cache.get_many(list(set(keys)))
+
+        # embed each distinct missing text once
+        miss_keys = []
+        miss_texts = []
+        for key, text in zip(keys, texts):
+            if key not in found and key not in miss_keys:
+                miss_keys.append(key)
+                miss_texts.append(text)
+
+        if miss_texts:
+            new_vectors = np.asarray(self.model.embedding(miss_texts, **kwargs), dtype=np.float32)
+            new_vectors = new_vectors.reshape(len(miss_texts), -1)
+            new_entries = dict(zip(miss_keys, new_vectors))
+            self.cache.put_many(new_entries)
+            found.update(new_entries)
+
+        output = np.stack([found[k] for k in keys])
+
+        logger.debug(f"update: CachedEmbeddingModel - {len(texts)} texts - {len(miss_texts)} embedded - "
+                     f"{self.cache.get_stats()}")
+
+        return output
+
+
+class AdaptiveBatchEmbeddingModel:
+
+    """ Wraps a loaded llmware embedding model and picks the model batch size at run time.
+
+    The vector db classes pull blocks in fixed outer batches (the batch_size passed to install_new_embedding /
+    create_new_embedding) - this wrapper splits each outer batch into sub-batches for the forward pass.  While
+    probing, each candidate size is run for probe_rounds sub-batches, measuring blocks/sec and the process RSS.
+    Larger candidates are skipped once a size crosses rss_ceiling_mb, and the fastest size under the ceiling is
+    kept for the rest of the job.  If RSS crosses the ceiling after settling, the size is halved. """
+
+    def __init__(self, model, candidate_sizes=(8, 16, 32, 64, 128, 256), rss_ceiling_mb=4096, probe_rounds=2):
+
+        import psutil
+
+        self.model = model
+        self.candidate_sizes = sorted(candidate_sizes)
+        self.rss_ceiling = rss_ceiling_mb * 1024 * 1024
+        self.probe_rounds = probe_rounds
+        self.process = psutil.Process(os.getpid())
+
+        # candidate size -> list of (blocks/sec, rss) measurements
+        self.probes = {}
+        self.probe_queue = [size for size in self.candidate_sizes for _ in range(probe_rounds)]
+
+        self.batch_size = None
+        self.blocks_embedded = 0
+        self.embedding_time = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _settle(self):
+
+        under_ceiling = {size: sum(r for r, _ in runs) / len(runs) for size, runs in self.probes.items()
+                         if max(rss for _, rss in runs) <= self.rss_ceiling}
+
+        if under_ceiling:
+            self.batch_size = max(under_ceiling, key=under_ceiling.get)
+        else:
+            self.batch_size = self.candidate_sizes[0]
+
+        logger.info(f"update: AdaptiveBatchEmbeddingModel - probes - {self.probes} - "
+                    f"selected batch size - {self.batch_size}")
+
+    def _next_size(self):
+
+        if self.batch_size:
+            return self.batch_size
+
+        if not self.probe_queue:
+            self._settle()
+            return self.batch_size
+
+        return self.probe_queue[0]
+
+    def _run_sub_batch(self, texts):
+
+        t0 = time.time()
+        vectors = np.asarray(self.model.embedding(texts), dtype=np.float32).reshape(len(texts), -1)
+        elapsed = max(time.time() - t0, 1e-9)
+        rss = self.process.memory_info().rss
+
+        self.blocks_embedded += len(texts)
+        self.embedding_time += elapsed
+
+        if not self.batch_size:
+            size = self.probe_queue.pop(0)
+
+            # only full sub-batches are a fair measurement of the candidate size
+            if len(texts) == size:
+                self.probes.setdefault(size, []).append((len(texts) / elapsed, rss))
+
+            if rss > self.rss_ceiling:
+                # larger batches will not use less memory - stop probing past this size
+                self.probe_queue = [s for s in self.probe_queue if s <= size]
+
+        elif rss > self.rss_ceiling and self.batch_size > self.candidate_sizes[0]:
+            self.batch_size = max(self.candidate_sizes[0], self.batch_size // 2)
+            logger.warning(f"warning: AdaptiveBatchEmbeddingModel - rss above ceiling - reducing batch size to "
+                           f"{self.batch_size}")
+
+        return vectors
+
+    def embedding(self, text_sample, **kwargs):
+
+        single = not isinstance(text_sample, list)
+        texts = [text_sample] if single else text_sample
+
+        outputs = []
+        start = 0
+        while start < len(texts):
+            size = self._next_size()
+            outputs.append(self._run_sub_batch(texts[start:start + size]))
+            start += size
+
+        return np.concatenate(outputs)
+
+    def get_stats(self):
+
+        rate = self.blocks_embedded / self.embedding_time if self.embedding_time else 0.0
+
+        return {"batch_size": self.batch_size, "blocks_embedded": self.blocks_embedded,
+                "blocks_per_sec": round(rate, 1),
+                "probes": {size: round(sum(r for r, _ in runs) / len(runs), 1) for size, runs in self.probes.items()}}
+
+
+# model held by each embedding worker process - loaded once per worker by _init_embedding_worker, or
+# inherited from the parent process on fork, in which case the weights are shared copy-on-write
+_worker_embedding_model = None
+
+
+def _init_embedding_worker(model_name, threads_per_worker):
+
+    global _worker_embedding_model
+
+    # avoid oversubscription - N workers x all-core intra-op threads is slower than N x (cores / N)
+    if threads_per_worker and util.find_spec("torch"):
+        import torch
+        torch.set_num_threads(threads_per_worker)
+
+    if _worker_embedding_model is None:
+        from llmware.models import ModelCatalog
+        _worker_embedding_model = ModelCatalog().load_model(selected_model=model_name)
+
+
+def _embed_in_worker(texts):
+
+    t0 = time.time()
+    vectors = np.asarray(_worker_embedding_model.embedding(texts), dtype=np.float32).reshape(len(texts), -1)
+
+    return os.getpid(), len(texts), time.time() - t0, vectors
+
+
+class ParallelEmbeddingModel:
+
+    """ Wraps a loaded llmware embedding model and runs the forward passes in a pool of worker processes.
+
+    Each outer batch pulled by the vector db class is split into sub-batches of sub_batch_size, which are
+    spread across the workers - the vectors come back in order to the calling process, so the vector db class
+    remains the single writer to the vector db and the text collection.
+
+    Each worker holds one model instance for the life of the pool.  Where the 'fork' start method is available
+    (Linux), the workers inherit the model already loaded in this process, and the weights are shared
+    copy-on-write - otherwise, each worker loads the model by name on start-up.  Note: the model should not have
+    been run in this process before the pool starts, as some torch thread pools do not survive a fork. """
+
+    def __init__(self, model, workers=None, sub_batch_size=32, threads_per_worker=None, share_parent_model=True):
+
+        self.model = model
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        self.sub_batch_size = sub_batch_size
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self.share_parent_model = share_parent_model
+
+        self.pool = None
+
+        # worker pid -> {"blocks": n, "seconds": s}
+        self.worker_stats = {}
+        self.wall_time = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _start_pool(self):
+
+        global _worker_embedding_model
+
+        # the executor forks its workers on demand - so the parent reference is kept until close()
+        if "fork" in multiprocessing.get_all_start_methods() and self.share_parent_model:
+            context = multiprocessing.get_context("fork")
+            _worker_embedding_model = self.model
+        else:
+            context = multiprocessing.get_context("spawn")
+
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                        initializer=_init_embedding_worker,
+                                        initargs=(self.model.model_name, self.threads_per_worker))
+
+    def embedding(self, text_sample, **kwargs):
+
+        single = not isinstance(text_sample, list)
+        texts = [text_sample] if single else text_sample
+
+        if not self.pool:
+            self._start_pool()
+
+        t0 = time.time()
+
+        sub_batches = [texts[i:i + self.sub_batch_size] for i in range(0, len(texts), self.sub_batch_size)]
+
+        outputs = []
+        for pid, count, seconds, vectors in self.pool.map(_embed_in_worker, sub_batches):
+            stats = self.worker_stats.setdefault(pid, {"blocks": 0, "seconds": 0.0})
+            stats["blocks"] += count
+            stats["seconds"] += seconds
+            outputs.append(vectors)
+
+        self.wall_time += time.time() - t0
+
+        return np.concatenate(outputs)
+
+    def get_stats(self):
+
+        """ Throughput per worker, and the overall rate seen by the writer. """
+
+        blocks = sum(s["blocks"] for s in self.worker_stats.values())
+
+        per_worker = {pid: {"blocks": s["blocks"],
+                            "blocks_per_sec": round(s["blocks"] / s["seconds"], 1) if s["seconds"] else 0.0}
+                      for pid, s in self.worker_stats.items()}
+
+        return {"workers": self.workers, "threads_per_worker": self.threads_per_worker, "blocks": blocks,
+                "blocks_per_sec": round(blocks / self.wall_time, 1) if self.wall_time else 0.0,
+                "per_worker": per_worker}
+
+    def close(self):
+
+        global _worker_embedding_model
+
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+
+        _worker_embedding_model = None
+
+
+def _embedding_notes_fp(account_name):
+    return os.path.join(LLMWareConfig().get_llmware_path(), f"embedding_status_notes_{account_name}.json")
+
+
+def record_embedding_status_note(library_name, embedding_model_name, note, account_name="llmware"):
+
+    """ Records a job-level note next to the embedding status of a library + model, e.g., the batch size
+    settled on, or the last checkpoint - the llmware status schema is fixed, so the notes are kept in a json
+    file of their own in the llmware path (see get_embedding_status_notes).  A note replaces an earlier note
+    with the same label, e.g., 'checkpoint: ...'. """
+
+    notes_fp = _embedding_notes_fp(account_name)
+    key = f"{library_name}_{embedding_model_name}"
+
+    notes = {}
+    if os.path.exists(notes_fp):
+        with open(notes_fp, "r", encoding="utf-8") as f:
+            notes = json.load(f)
+
+    label = note.split(":")[0] + ":"
+    entry = [n for n in notes.get(key, []) if not n.startswith(label)] + [note]
+    notes[key] = entry
+
+    # write-then-rename so that a reader never sees a half-written file
+    tmp_fp = f"{notes_fp}.{os.getpid()}.tmp"
+    with open(tmp_fp, "w", encoding="utf-8") as f:
+        json.dump(notes, f, indent=1)
+    os.replace(tmp_fp, notes_fp)
+
+    return entry
+
+
+def get_embedding_status_notes(library_name, embedding_model_name, account_name="llmware"):
+
+    """ Notes recorded with record_embedding_status_note for a library + model - list of str. """
+
+    notes_fp = _embedding_notes_fp(account_name)
+
+    if not os.path.exists(notes_fp):
+        return []
+
+    with open(notes_fp, "r", encoding="utf-8") as f:
+        return json.load(f).get(f"{library_name}_{embedding_model_name}", [])
+
+
+class EmbeddingNumpyMemmap:
+
+    """ Local vector db for small and medium libraries - no server, no extra dependency.
+
+    The vectors are appended to a float32 file that is memory-mapped for search, with the squared norm and a
+    few metadata fields (doc_ID, page_num, file_source, content_type) of each vector kept alongside.  The
+    search is exact: the distances are computed with vectorized dot products over fixed-size chunks of the
+    file, and the top-k of each chunk is selected with argpartition, so memory use does not grow with the
+    library.  Distances are squared L2, the same as the faiss IndexFlatL2, so distance thresholds carry over.
+
+    Like faiss, the row of each vector is saved as the embedding flag value of its block in the text
+    collection, and the matching blocks are looked up from the row.
+
+    Once registered (see register_numpy_vector_db below), it is used like any other vector db, e.g.,
+    `library.install_new_embedding(embedding_model_name=..., vector_db="numpy_mmap")` and then
+    `Query(library).semantic_query(...)` - unchanged.  Call search_index directly to pass a metadata filter.
+
+    The quantized variants (EmbeddingNumpyInt8, EmbeddingNumpyBinary) scan compact codes instead of the
+    float32 file, and re-score only a shortlist against the full-precision vectors. """
+
+    db_name = "numpy_mmap"
+    quantization = None
+    filter_keys = ("doc_ID", "page_num", "file_source", "content_type")
+
+    def __init__(self, library, model=None, model_name=None, embedding_dims=None, search_chunk_rows=65536,
+                 rescore_factor=10, checkpoint_secs=30.0):
+
+        self.library = library
+        self.library_name = library.library_name
+        self.account_name = library.account_name
+
+        if not model and not model_name:
+            raise EmbeddingModelNotFoundException("no-model-or-model-name-provided")
+
+        self.model = model
+        self.model_name = model_name
+        self.embedding_dims = embedding_dims
+
+        if self.model:
+            self.model_name = self.model.model_name
+            self.embedding_dims = self.model.embedding_dims
+
+        self.utils = _EmbeddingUtils(library_name=self.library_name,
+                                     model_name=self.model_name,
+                                     account_name=self.account_name,
+                                     db_name=self.db_name,
+                                     embedding_dims=self.embedding_dims)
+
+        self.collection_key = self.utils.create_db_specific_key()
+
+        model_safe_path = re.sub(r"[@\/. ]", "", self.model_name).lower()
+        self.index_path = os.path.join(self.library.embedding_path, model_safe_path, f"embedding_{self.db_name}")
+        self.vector_fp = os.path.join(self.index_path, "vectors.f32")
+        self.codes_fp = os.path.join(self.index_path, f"codes.{self.quantization}")
+        self.meta_fp = os.path.join(self.index_path, "meta.npz")
+        self.manifest_fp = os.path.join(self.index_path, "manifest.json")
+
+        self.search_chunk_rows = search_chunk_rows
+
+        # quantized search - number of candidates re-scored in full precision = sample_count * rescore_factor
+        self.rescore_factor = rescore_factor
+
+        # embedding jobs commit their progress at most this often - see create_new_embedding
+        self.checkpoint_secs = checkpoint_secs
+
+        # time spent looking up the blocks of search results - lets a caller split search time into the index
+        # scan and the block hydration (see the stage timing in retrieval_ext.py)
+        self.hydration_secs = 0.0
+
+        self.count = 0
+        self.capacity = 0
+        self.vectors = None
+        self.codes = None
+        self.meta = None
+        self.labels = {"file_source": [], "content_type": []}
+
+    def _code_shape(self, rows):
+
+        """ Shape + dtype of the codes file - None for the full-precision index. """
+
+        return None
+
+    def _encode(self, vectors):
+
+        """ Returns (codes, scales) for a batch of vectors - overridden by the quantized variants. """
+
+        return None, None
+
+    def _open_files(self, mode):
+
+        self.vectors = np.memmap(self.vector_fp, dtype=np.float32, mode=mode,
+                                 shape=(self.capacity, self.embedding_dims))
+
+        code_shape = self._code_shape(self.capacity)
+        if code_shape:
+            self.codes = np.memmap(self.codes_fp, dtype=code_shape[1], mode=mode, shape=code_shape[0])
+
+    def _load(self, mode="r"):
+
+        if self.meta is not None:
+            return
+
+        self.meta = {"norms": np.zeros(0, dtype=np.float32), "scales": np.zeros(0, dtype=np.float32),
+                     "doc_ID": np.zeros(0, dtype=np.int64), "page_num": np.zeros(0, dtype=np.int64),
+                     "file_source": np.zeros(0, dtype=np.int32), "content_type": np.zeros(0, dtype=np.int32)}
+
+        if not os.path.exists(self.manifest_fp):
+            return
+
+        with open(self.manifest_fp, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        if self.embedding_dims and int(manifest["embedding_dims"]) != int(self.embedding_dims):
+            raise LLMWareException(message=f"Exception: {self.db_name} index at {self.index_path} has embedding "
+                                           f"dims {manifest['embedding_dims']} - model has {self.embedding_dims}.")
+
+        self.embedding_dims = int(manifest["embedding_dims"])
+        self.count = manifest["count"]
+        self.capacity = manifest["capacity"]
+        self.labels = manifest["labels"]
+
+        with np.load(self.meta_fp) as meta:
+            self.meta.update({key: meta[key] for key in meta.files})
+
+        if self.capacity:
+            self._open_files(mode)
+
+    def _ensure_capacity(self, needed):
+
+        if needed > self.capacity:
+            self._grow_files(needed)
+
+        # the metadata arrays are held at the capacity of the file while embedding, and saved trimmed to count
+        for key, values in self.meta.items():
+            if len(values) < self.capacity:
+                grown = np.zeros(self.capacity, dtype=values.dtype)
+                grown[:len(values)] = values
+                self.meta[key] = grown
+
+    def _grow_files(self, needed):
+
+        new_capacity = max(needed, self.capacity * 2, 4096)
+
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.vectors = None
+
+        if self.codes is not None:
+            self.codes.flush()
+            self.codes = None
+
+        os.makedirs(self.index_path, exist_ok=True)
+
+        with open(self.vector_fp, "ab") as f:
+            f.truncate(new_capacity * self.embedding_dims * 4)
+
+        code_shape = self._code_shape(new_capacity)
+        if code_shape:
+            with open(self.codes_fp, "ab") as f:
+                f.truncate(int(np.prod(code_shape[0])) * np.dtype(code_shape[1]).itemsize)
+
+        self.capacity = new_capacity
+        self._open_files("r+")
+
+    def _label_code(self, field, value):
+
+        labels = self.labels[field]
+        value = str(value)
+        if value not in labels:
+            labels.append(value)
+        return labels.index(value)
+
+    def _save(self):
+
+        self.vectors.flush()
+        if self.codes is not None:
+            self.codes.flush()
+
+        # manifest is written last - a crash before this point leaves the previous manifest in place
+        np.savez(self.meta_fp + ".tmp.npz", **{key: values[:self.count] for key, values in self.meta.items()})
+        os.replace(self.meta_fp + ".tmp.npz", self.meta_fp)
+
+        manifest = {"embedding_dims": self.embedding_dims, "count": self.count, "capacity": self.capacity,
+                    "quantization": self.quantization, "labels": self.labels}
+
+        with open(self.manifest_fp + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(self.manifest_fp + ".tmp", self.manifest_fp)
+
+    def _checkpoint(self, uncommitted, status):
+
+        """ Commits the vectors appended since the last checkpoint - the index files are saved first, and only
+        then are the blocks flagged as embedded, so a restarted job re-embeds exactly the blocks that were not
+        committed.  The checkpoint is recorded as an embedding status note. """
+
+        self._save()
+
+        committed = 0
+        for block_ids, start in uncommitted:
+            self.utils.update_text_index(block_ids, start)
+            committed += len(block_ids)
+
+        status.increment_embedding_status(self.library_name, self.model_name, committed)
+
+        record_embedding_status_note(self.library_name, self.model_name,
+                                     f"checkpoint: {self.count} vectors committed - last block: "
+                                     f"{uncommitted[-1][0][-1]}", account_name=self.account_name)
+
+        return committed
+
+    def create_new_embedding(self, doc_ids=None, batch_size=500):
+
+        """ Embeds the blocks not yet flagged for this model, and appends the vectors to the memmap file.
+
+        Progress is committed at most every checkpoint_secs - if the job is interrupted, the next run resumes
+        after the last committed block. """
+
+        self._load(mode="r+")
+
+        # rows past the last committed count are from an interrupted run - they are overwritten
+        if self.count:
+            logger.info(f"update: embedding_handler - {self.db_name} - resuming - {self.count} vectors committed")
+
+        all_blocks_cursor, num_of_blocks = self.utils.get_blocks_cursor(doc_ids=doc_ids)
+
+        status = Status(self.account_name)
+        status.new_embedding_status(self.library_name, self.model_name, num_of_blocks)
+
+        if self.count:
+            record_embedding_status_note(self.library_name, self.model_name,
+                                         f"resumed: {self.count} vectors already committed",
+                                         account_name=self.account_name)
+
+        embeddings_created = 0
+        finished = False
+
+        uncommitted = []
+        last_checkpoint = time.time()
+
+        while not finished:
+
+            block_ids, sentences, metadata = [], [], []
+
+            for i in range(batch_size):
+
+                block = all_blocks_cursor.pull_one()
+
+                if not block:
+                    finished = True
+                    break
+
+                text_search = block["text_search"].strip()
+
+                if not text_search or len(text_search) < 1:
+                    continue
+
+                block_ids.append(str(block["_id"]))
+                sentences.append(text_search)
+                # page number of the block - llmware blocks carry it as master_index
+                metadata.append((int(block.get("doc_ID") or 0), int(block["master_index"] or 0),
+                                 self._label_code("file_source", block.get("file_source", "")),
+                                 self._label_code("content_type", block.get("content_type", ""))))
+
+            if len(sentences) > 0:
+
+                vectors = np.asarray(self.model.embedding(sentences), dtype=np.float32)
+
+                start = self.count
+                end = start + len(vectors)
+                self._ensure_capacity(end)
+                self.vectors[start:end] = vectors
+
+                codes, scales = self._encode(vectors)
+                if codes is not None:
+                    self.codes[start:end] = codes
+                    self.meta["scales"][start:end] = scales
+
+                doc_id, page_num, file_source, content_type = (np.array(col) for col in zip(*metadata))
+
+                self.meta["norms"][start:end] = np.einsum("ij,ij->i", vectors, vectors)
+                self.meta["doc_ID"][start:end] = doc_id
+                self.meta["page_num"][start:end] = page_num
+                self.meta["file_source"][start:end] = file_source
+                self.meta["content_type"][start:end] = content_type
+
+                self.count += len(vectors)
+                uncommitted.append((block_ids, start))
+
+                embeddings_created += len(sentences)
+
+                logger.info(f"update: embedding_handler - {self.db_name} - Embeddings Created: "
+                            f"{embeddings_created} of {num_of_blocks}")
+
+            if uncommitted and (finished or time.time() - last_checkpoint >= self.checkpoint_secs):
+                self._checkpoint(uncommitted, status)
+                uncommitted = []
+                last_checkpoint = time.time()
+
+        embedding_summary = self.utils.generate_embedding_summary(embeddings_created)
+
+        logger.info(f"update: EmbeddingHandler - {self.db_name} - embedding_summary - {embedding_summary}")
+
+        return embedding_summary
+
+    def _filter_mask(self, filter_dict, start, end):
+
+        """ Boolean mask over rows [start, end) - each filter value is a single value or a list of values. """
+
+        mask = np.ones(end - start, dtype=bool)
+
+        for key, value in filter_dict.items():
+
+            if key not in self.filter_keys:
+                raise LLMWareException(message=f"Exception: {self.db_name} filter key not supported - {key} - "
+                                               f"supported keys: {self.filter_keys}")
+
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+
+            if key in self.labels:
+                codes = [self.labels[key].index(str(v)) for v in values if str(v) in self.labels[key]]
+                mask &= np.isin(self.meta[key][start:end], codes)
+            else:
+                mask &= np.isin(self.meta[key][start:end], [int(v) for v in values])
+
+        return mask
+
+    def _prepare_queries(self, queries):
+
+        """ Query form used by _chunk_distances - the quantized variants encode the queries once per search. """
+
+        return queries
+
+    def _chunk_distances(self, prepared_queries, queries, query_norms, start, end):
+
+        """ Distances (queries x rows) for rows [start, end) - exact squared L2 here, approximate in the
+        quantized variants. """
+
+        return (self.meta["norms"][None, start:end] - 2.0 * (queries @ self.vectors[start:end].T) +
+                query_norms[:, None])
+
+    def search_index(self, query_embedding_vector, sample_count=10, filter_dict=None):
+
+        """ Top-k search - returns a list of (block, distance), nearest first.  The optional filter_dict
+        (e.g., {"doc_ID": [1, 4]}) is applied in the scan, before the top-k is selected. """
+
+        return self.search_index_batch([query_embedding_vector], sample_count=sample_count,
+                                       filter_dict=filter_dict)[0]
+
+    def search_index_batch(self, query_embedding_vectors, sample_count=10, filter_dict=None):
+
+        """ Top-k search for several queries in one scan - each chunk of the file is read once and scored
+        against all of the queries with one matrix product.  Returns one list of (block, distance) per query. """
+
+        # blocks are looked up once per row, even if the row is in the results of several queries
+        blocks_by_row = {}
+
+        return [self._rows_to_blocks(rows, distances, blocks_by_row)
+                for rows, distances in self._search_rows_batch(query_embedding_vectors, sample_count, filter_dict)]
+
+    def search_index_rows(self, query_embedding_vector, sample_count=10, filter_dict=None):
+
+        """ search_index without the block lookup - returns (rows, distances), nearest first.  The blocks of
+        any slice of the rows are looked up with hydrate_rows, e.g., one page of results at a time. """
+
+        rows, distances = self._search_rows_batch([query_embedding_vector], sample_count, filter_dict)[0]
+
+        order = np.argsort(distances, kind="stable")
+
+        return rows[order], np.maximum(distances[order], 0.0)
+
+    def hydrate_rows(self, rows, distances):
+
+        """ Looks up the blocks of rows from search_index_rows - returns a list of (block, distance). """
+
+        return self._rows_to_blocks(rows, distances)
+
+    def _search_rows_batch(self, query_embedding_vectors, sample_count, filter_dict):
+
+        """ The index scan of search_index_batch - returns (rows, distances) per query, unsorted. """
+
+        self._load()
+
+        queries = np.asarray(query_embedding_vectors, dtype=np.float32).reshape(len(query_embedding_vectors), -1)
+
+        if not self.count or sample_count < 1:
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in range(len(queries))]
+
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        prepared_queries = self._prepare_queries(queries)
+
+        shortlist_count = sample_count * self.rescore_factor if self.quantization else sample_count
+
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_distances = np.zeros((len(queries), 0), dtype=np.float32)
+
+        for start in range(0, self.count, self.search_chunk_rows):
+
+            end = min(start + self.search_chunk_rows, self.count)
+
+            distances = self._chunk_distances(prepared_queries, queries, query_norms, start, end)
+            rows = np.arange(start, end)
+
+            if filter_dict:
+                mask = self._filter_mask(filter_dict, start, end)
+                distances, rows = distances[:, mask], rows[mask]
+
+            # keep the best shortlist_count candidates per query seen so far
+            distances = np.concatenate([best_distances, distances], axis=1)
+            rows = np.concatenate([best_rows, np.broadcast_to(rows, (len(queries), len(rows)))], axis=1)
+
+            if distances.shape[1] > shortlist_count:
+                top = np.argpartition(distances, shortlist_count - 1, axis=1)[:, :shortlist_count]
+                distances = np.take_along_axis(distances, top, axis=1)
+                rows = np.take_along_axis(rows, top, axis=1)
+
+            best_distances, best_rows = distances, rows
+
+        output = []
+
+        for query, query_norm, rows, distances in zip(queries, query_norms, best_rows, best_distances):
+
+            # quantized - re-score the shortlist against the full-precision vectors, read from disk by row
+            if self.quantization and len(rows):
+                rows = np.sort(rows)
+                distances = self.meta["norms"][rows] - 2.0 * (self.vectors[rows] @ query) + query_norm
+
+                if len(rows) > sample_count:
+                    top = np.argpartition(distances, sample_count - 1)[:sample_count]
+                    distances, rows = distances[top], rows[top]
+
+            output.append((rows, distances))
+
+        return output
+
+    def _rows_to_blocks(self, rows, distances, blocks_by_row=None):
+
+        """ Looks up the blocks for each row, nearest first - returns a list of (block, distance). """
+
+        t0 = time.time()
+
+        if blocks_by_row is None:
+            blocks_by_row = {}
+
+        block_list = []
+        for i in np.argsort(distances, kind="stable"):
+
+            row = int(rows[i])
+            if row not in blocks_by_row:
+                blocks_by_row[row] = self.utils.lookup_embedding_flag(self.collection_key, row)
+
+            for block in blocks_by_row[row]:
+                block_list.append((copy.deepcopy(block), max(float(distances[i]), 0.0)))
+
+        self.hydration_secs += time.time() - t0
+
+        return block_list
+
+    @staticmethod
+    def _group_top_k(groups, distances, rows, k):
+
+        """ Keeps the k nearest rows in each group - sort by (group, distance), then rank within each group. """
+
+        if not len(rows):
+            return groups, distances, rows
+
+        order = np.lexsort((distances, groups))
+        groups, distances, rows = groups[order], distances[order], rows[order]
+
+        starts = np.r_[0, np.flatnonzero(groups[1:] != groups[:-1]) + 1]
+        rank = np.arange(len(groups)) - np.repeat(starts, np.diff(np.r_[starts, len(groups)]))
+
+        keep = rank < k
+
+        return groups[keep], distances[keep], rows[keep]
+
+    def search_index_grouped(self, query_embedding_vector, per_group=3, group_key="doc_ID", filter_dict=None):
+
+        """ Top-k per group - returns the per_group nearest blocks of every document (group_key='doc_ID'),
+        or of every page, file or content type, as a list of (block, distance), nearest first.  Small
+        documents keep their best hits, as the top-k is taken within each group rather than across the
+        library.  The optional filter_dict is applied in the scan, as in search_index. """
+
+        self._load()
+
+        if group_key not in self.filter_keys:
+            raise LLMWareException(message=f"Exception: {self.db_name} group key not supported - {group_key} - "
+                                           f"supported keys: {self.filter_keys}")
+
+        if not self.count or per_group < 1:
+            return []
+
+        queries = np.asarray(query_embedding_vector, dtype=np.float32).reshape(1, -1)
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        prepared_queries = self._prepare_queries(queries)
+
+        shortlist_count = per_group * self.rescore_factor if self.quantization else per_group
+
+        best_groups = np.zeros(0, dtype=self.meta[group_key].dtype)
+        best_distances = np.zeros(0, dtype=np.float32)
+        best_rows = np.zeros(0, dtype=np.int64)
+
+        for start in range(0, self.count, self.search_chunk_rows):
+
+            end = min(start + self.search_chunk_rows, self.count)
+
+            distances = self._chunk_distances(prepared_queries, queries, query_norms, start, end)[0]
+            rows = np.arange(start, end)
+            groups = self.meta[group_key][start:end]
+
+            if filter_dict:
+                mask = self._filter_mask(filter_dict, start, end)
+                distances, rows, groups = distances[mask], rows[mask], groups[mask]
+
+            best_groups, best_distances, best_rows = self._group_top_k(np.concatenate([best_groups, groups]),
+                                                                       np.concatenate([best_distances, distances]),
+                                                                       np.concatenate([best_rows, rows]),
+                                                                       shortlist_count)
+
+        # quantized - re-score the per-group shortlists in full precision, and keep per_group of each
+        if self.quantization and len(best_rows):
+            best_distances = (self.meta["norms"][best_rows] - 2.0 * (self.vectors[best_rows] @ queries[0]) +
+                              query_norms[0])
+            best_groups, best_distances, best_rows = self._group_top_k(best_groups, best_distances, best_rows,
+                                                                       per_group)
+
+        # a row shared by duplicate blocks (see dedup_and_embed) expands to several blocks, possibly in other
+        # documents - the per_group limit is applied again on the blocks, by the group of each block
+        block_key = "master_index" if group_key == "page_num" else group_key
+
+        block_list = []
+        per_block_group = {}
+
+        for block, distance in self._rows_to_blocks(best_rows, best_distances):
+
+            group = block.get(block_key)
+            if per_block_group.get(group, 0) < per_group:
+                per_block_group[group] = per_block_group.get(group, 0) + 1
+                block_list.append((block, distance))
+
+        return block_list
+
+    def get_storage_stats(self):
+
+        """ Bytes scanned per search (codes or float32 vectors, plus norms) vs. bytes kept on disk. """
+
+        self._load()
+
+        vector_bytes = self.count * self.embedding_dims * 4
+        code_shape = self._code_shape(self.count)
+        code_bytes = int(np.prod(code_shape[0])) * np.dtype(code_shape[1]).itemsize if code_shape else 0
+        scanned_bytes = (code_bytes if code_shape else vector_bytes) + self.count * 8
+
+        return {"vector_db": self.db_name, "vectors": self.count, "embedding_dims": self.embedding_dims,
+                "scanned_mb": round(scanned_bytes / (1024 * 1024), 3),
+                "disk_mb": round((vector_bytes + code_bytes + self.count * 8) / (1024 * 1024), 3)}
+
+    def delete_index(self):
+
+        """ Deletes the memmap files and unsets the embedding flags in the text collection. """
+
+        self.vectors = None
+        self.codes = None
+
+        if os.path.exists(self.index_path):
+            shutil.rmtree(self.index_path)
+
+            self.utils.unset_text_index()
+
+        return 1
+
+
+class EmbeddingNumpyInt8(EmbeddingNumpyMemmap):
+
+    """ numpy_mmap with int8 codes - one scale per vector (max |x| / 127), 4x smaller scan than float32. """
+
+    db_name = "numpy_mmap_int8"
+    quantization = "int8"
+
+    def _code_shape(self, rows):
+        return (rows, self.embedding_dims), np.int8
+
+    def _encode(self, vectors):
+
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+
+        return codes, scales.astype(np.float32)
+
+    def _chunk_distances(self, prepared_queries, queries, query_norms, start, end):
+
+        # x ~ scale * code - so x.q ~ scale * (code.q)
+        dots = (queries @ self.codes[start:end].astype(np.float32).T) * self.meta["scales"][None, start:end]
+        return self.meta["norms"][None, start:end] - 2.0 * dots + query_norms[:, None]
+
+
+# number of set bits for each byte value - used to count hamming distance on packed sign bits
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class EmbeddingNumpyBinary(EmbeddingNumpyMemmap):
+
+    """ numpy_mmap with 1-bit sign codes - 32x smaller scan than float32, ranked by hamming distance, so a
+    larger rescore_factor is used by default. """
+
+    db_name = "numpy_mmap_binary"
+    quantization = "binary"
+
+    def __init__(self, library, model=None, model_name=None, embedding_dims=None, search_chunk_rows=65536,
+                 rescore_factor=40, checkpoint_secs=30.0):
+
+        super().__init__(library, model=model, model_name=model_name, embedding_dims=embedding_dims,
+                         search_chunk_rows=search_chunk_rows, rescore_factor=rescore_factor,
+                         checkpoint_secs=checkpoint_secs)
+
+    def _code_shape(self, rows):
+        return (rows, (self.embedding_dims + 7) // 8), np.uint8
+
+    def _encode(self, vectors):
+        return np.packbits(vectors > 0, axis=1), np.ones(len(vectors), dtype=np.float32)
+
+    def _prepare_queries(self, queries):
+        return np.packbits(queries > 0, axis=1)
+
+    def _chunk_distances(self, prepared_queries, queries, query_norms, start, end):
+        codes = self.codes[start:end]
+        return np.stack([_POPCOUNT_TABLE[np.bitwise_xor(codes, packed)].sum(axis=1, dtype=np.int32)
+                         for packed in prepared_queries])
+
+
+class MinHashDeduplicator:
+
+    """ Finds near-duplicate text blocks with MinHash signatures and LSH banding - pure numpy.
+
+    Each text is reduced to a set of word shingles, and num_perm hashed permutations give its signature.  The
+    signature is cut into bands - texts that agree on every row of at least one band become candidates, and a
+    candidate pair is kept if the estimated Jaccard similarity is at least the threshold.  The pairs are then
+    merged into clusters (union-find), and the first text of each cluster is its representative. """
+
+    _prime = (1 << 31) - 1
+
+    def __init__(self, threshold=0.9, num_perm=64, bands=16, shingle_size=5, seed=7):
+
+        if num_perm % bands:
+            raise LLMWareException(message=f"Exception: MinHashDeduplicator - num_perm ({num_perm}) must be a "
+                                           f"multiple of bands ({bands}).")
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.shingle_size = shingle_size
+
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, self._prime, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, self._prime, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+
+        words = re.findall(r"\w+", text.lower())
+        k = self.shingle_size
+
+        if len(words) > k:
+            shingles = {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+        else:
+            shingles = {" ".join(words)}
+
+        hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles], dtype=np.uint64) % self._prime
+
+        # (a * h + b) mod p for every permutation x shingle, then the min per permutation
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % self._prime).min(axis=1)
+
+    def find_clusters(self, texts):
+
+        """ Returns a list with the index of the representative for each text (itself, if not a duplicate). """
+
+        signatures = np.stack([self.signature(t) for t in texts]) if texts else np.zeros((0, self.num_perm))
+
+        parent = list(range(len(texts)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for band in range(self.bands):
+
+            cols = slice(band * self.rows_per_band, (band + 1) * self.rows_per_band)
+            buckets = {}
+
+            for i, band_key in enumerate(signatures[:, cols]):
+                buckets.setdefault(band_key.tobytes(), []).append(i)
+
+            for members in buckets.values():
+                first = members[0]
+                for other in members[1:]:
+                    root_first, root_other = find(first), find(other)
+                    if root_first == root_other:
+                        continue
+                    if np.mean(signatures[first] == signatures[other]) >= self.threshold:
+                        # the lower index is kept as the root - i.e., the first text in the cluster
+                        parent[max(root_first, root_other)] = min(root_first, root_other)
+
+        return [find(i) for i in range(len(texts))]
+
+
+def _embedding_flag_value(block, collection_key):
+
+    # mongo saves the flag as a field named by the key - sqlite / postgres save the value in special_field1
+    if collection_key in block:
+        return block[collection_key]
+    return block.get("special_field1")
+
+
+def dedup_and_embed(library, vector_db, model, threshold=0.9, num_perm=64, bands=16, shingle_size=5,
+                    batch_size=100):
+
+    """ Embeds the new blocks of a library, with near-duplicate blocks sharing one embedding and one vector.
+
+    Runs between add_files and the embedding step: the new (not yet embedded) blocks are clustered with
+    MinHashDeduplicator, and only one representative per cluster is embedded.  Each duplicate block then
+    points to the vector of its representative, while keeping its own doc_ID, page_num and file_source - so a
+    semantic query that hits the vector returns every copy of the text, each with its own document metadata.
+
+    This relies on the vector db resolving a vector to its blocks through the embedding flag value in the
+    text collection - i.e., the numpy_mmap vector dbs and faiss.  Note: the metadata filter in the numpy
+    vector dbs sees the metadata of the representative only.
+
+    The duplicate -> representative map is saved in the library before the duplicates are flagged, so an
+    interrupted run is completed by the next call. """
+
+    if VectorDBRegistry().get_vector_db_list()[vector_db]["class"] not in ("EmbeddingNumpyMemmap",
+                                                                           "EmbeddingNumpyInt8",
+                                                                           "EmbeddingNumpyBinary",
+                                                                           "EmbeddingFAISS"):
+        raise LLMWareException(message=f"Exception: dedup_and_embed - vector db '{vector_db}' stores one vector "
+                                       f"per block - use numpy_mmap, numpy_mmap_int8, numpy_mmap_binary or faiss.")
+
+    from llmware.embeddings import EmbeddingHandler
+
+    utils = _EmbeddingUtils(library_name=library.library_name, model_name=model.model_name,
+                            account_name=library.account_name, db_name=vector_db,
+                            embedding_dims=model.embedding_dims)
+    collection_key = utils.create_db_specific_key()
+
+    map_fp = os.path.join(library.embedding_path, f"dedup_map_{collection_key}.json")
+
+    pending = {}
+    if os.path.exists(map_fp):
+        with open(map_fp, "r", encoding="utf-8") as f:
+            pending = json.load(f)
+
+    # 1 - cluster the new blocks
+    t0 = time.time()
+    cursor, num_of_blocks = utils.get_blocks_cursor()
+
+    block_ids, texts = [], []
+    block = cursor.pull_one()
+    while block:
+        text = block["text_search"].strip()
+        if text:
+            block_ids.append(str(block["_id"]))
+            texts.append(text)
+        block = cursor.pull_one()
+
+    representatives = MinHashDeduplicator(threshold=threshold, num_perm=num_perm, bands=bands,
+                                          shingle_size=shingle_size).find_clusters(texts)
+
+    for i, rep in enumerate(representatives):
+        if rep != i:
+            pending[block_ids[i]] = block_ids[rep]
+
+    dedup_time = time.time() - t0
+
+    # 2 - save the map, then flag the duplicates with a placeholder so the embedding job skips them
+    with open(map_fp + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(pending, f)
+    os.replace(map_fp + ".tmp", map_fp)
+
+    # a new writer for each flag - the sqlite and postgres writers close their connection after every write
+    for dup_id in pending:
+        CollectionWriter(library.library_name, account_name=library.account_name).\
+            add_new_embedding_flag(dup_id, collection_key, -1)
+
+    # 3 - embed the representatives (and all other unique blocks)
+    embedding_summary = EmbeddingHandler(library).create_new_embedding(vector_db, model, batch_size=batch_size)
+
+    # 4 - point each duplicate to the vector of its representative
+    unresolved = {}
+    for dup_id, rep_id in pending.items():
+
+        rep_block = utils.lookup_text_index(rep_id)
+        rep_block = rep_block[0] if rep_block else None
+        row = _embedding_flag_value(rep_block, collection_key) if rep_block else None
+
+        if row is None or str(row) in ("", "-1"):
+            unresolved[dup_id] = rep_id
+            continue
+
+        CollectionWriter(library.library_name, account_name=library.account_name).\
+            add_new_embedding_flag(dup_id, collection_key, row)
+
+    if unresolved:
+        with open(map_fp, "w", encoding="utf-8") as f:
+            json.dump(unresolved, f)
+    elif os.path.exists(map_fp):
+        os.remove(map_fp)
+
+    duplicates = len(pending) - len(unresolved)
+
+    report = {"blocks": len(texts),
+              "clusters": len(set(representatives)),
+              "duplicate_blocks": duplicates,
+              "embedding_calls_saved": duplicates,
+              "vector_storage_saved_mb": round(duplicates * model.embedding_dims * 4 / (1024 * 1024), 3),
+              "dedup_time": round(dedup_time, 3),
+              "unresolved": len(unresolved),
+              "embedding_summary": embedding_summary}
+
+    logger.info(f"update: dedup_and_embed - {report}")
+
+    return report
+
+
+def register_numpy_vector_db():
+
+    """ Registers the numpy vector dbs with llmware, so the names can be passed as vector_db anywhere -
+    'numpy_mmap' (float32), 'numpy_mmap_int8' and 'numpy_mmap_binary'. """
+
+    supported = LLMWareConfig().get_supported_vector_db()
+
+    for vector_db_class in (EmbeddingNumpyMemmap, EmbeddingNumpyInt8, EmbeddingNumpyBinary):
+
+        VectorDBRegistry().add_vector_db(vector_db_class.db_name, vector_db_class.__name__, module=__name__)
+
+        if vector_db_class.db_name not in supported:
+            supported.append(vector_db_class.db_name)
+
+    return supported
+
+
+register_numpy_vector_db()
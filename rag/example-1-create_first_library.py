@@ -1,7 +1,15 @@
 import os
+import time
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 from llmware.library import Library
 from llmware.retrieval import Query
 from llmware.configs import LLMWareConfig
+from llmware.parsers import Parser
+from llmware.resources import CollectionWriter
+
+from ingest_ext import SQLiteBulkBlockWriter, parse_one_file, move_parsed_images, incremental_add_files
 
 def parsing_documents_into_library(library_name, custom_folder_path):
 
@@ -35,6 +43,266 @@ def parsing_documents_into_library(library_name, custom_folder_path):
     return parsing_output
 
 
+#   each worker process keeps one Parser for its lifetime - set up once by the pool initializer
+_worker_parser = None
+
+
+def _init_parse_worker(parser_options):
+
+    """ Pool initializer - builds the per-process Parser with its own tmp work folder, so that the
+    parsers in different processes never overwrite each other's intermediate output files. """
+
+    global _worker_parser
+
+    # every Parser() resets the shared 'parser_tmp' folder, so workers starting together can collide
+    for attempt in range(5):
+        try:
+            _worker_parser = Parser(**parser_options)
+            break
+        except (FileExistsError, FileNotFoundError):
+            time.sleep(0.1 * (attempt + 1))
+    else:
+        _worker_parser = Parser(**parser_options)
+
+    worker_tmp = os.path.join(LLMWareConfig.get_tmp_path(), f"parser_worker_{os.getpid()}" + os.sep)
+    os.makedirs(worker_tmp, exist_ok=True)
+
+    _worker_parser.parser_tmp_folder = worker_tmp
+    _worker_parser.parser_image_folder = worker_tmp
+
+
+def _parse_one_file(folder_path, file_name):
+
+    """ Runs in a worker process - parses and chunks one file in memory, without writing to the library db.
+    Returns the blocks, and the folder holding the images extracted from this file. """
+
+    blocks, image_folder = parse_one_file(_worker_parser, folder_path, file_name)
+
+    return file_name, blocks, image_folder
+
+
+def parallel_parsing_documents_into_library(library_name, custom_folder_path, workers=None,
+                                            chunk_size=400, max_chunk_size=600, smart_chunking=1, bulk_load=True):
+
+    """ Parallel alternative to library.add_files - the files in the folder are split across a process pool,
+    which parses and chunks them at the same time, while the main process is the single writer that assigns
+    doc/block ids and inserts the blocks into the library.  With bulk_load (sqlite only), the single writer
+    uses SQLiteBulkBlockWriter instead of one db round-trip per block. """
+
+    if not workers:
+        workers = os.cpu_count() or 1
+
+    print(f"\n📚 Parallel Parsing Files into Library: {library_name} - workers: {workers}")
+
+    library = Library().create_new_library(library_name)
+
+    # skip files that were already copied into the library on an earlier run
+    already_in_library = set(os.listdir(library.file_copy_path))
+    file_list = [fn for fn in sorted(os.listdir(custom_folder_path))
+                 if os.path.isfile(os.path.join(custom_folder_path, fn)) and fn not in already_in_library]
+
+    print(f"📂 Parsing {len(file_list)} files from: {custom_folder_path}")
+
+    parser_options = {"chunk_size": chunk_size, "max_chunk_size": max_chunk_size,
+                      "smart_chunking": smart_chunking, "copy_files_to_library": False}
+
+    added_docs = 0
+    added_blocks = 0
+    added_pages = 0
+    added_tables = 0
+    added_images = 0
+    rejected_files = []
+
+    bulk_writer = None
+    if bulk_load and LLMWareConfig().get_active_db() == "sqlite":
+        bulk_writer = SQLiteBulkBlockWriter(library).open()
+
+    t0 = time.time()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_parse_worker,
+                                 initargs=(parser_options,)) as pool:
+
+            jobs = {pool.submit(_parse_one_file, custom_folder_path, fn): fn for fn in file_list}
+
+            # single writer - blocks are merged into the library as each document completes
+            for job in as_completed(jobs):
+
+                try:
+                    file_name, blocks, image_folder = job.result()
+                except Exception as e:
+                    print(f"  ⚠️ {jobs[job]} - parsing failed: {e}")
+                    rejected_files.append(jobs[job])
+                    continue
+
+                if not blocks:
+                    shutil.rmtree(image_folder, ignore_errors=True)
+                    rejected_files.append(file_name)
+                    continue
+
+                doc_id = library.get_and_increment_doc_id()
+                pages = set()
+
+                for block_id, block in enumerate(blocks):
+                    block["doc_ID"] = doc_id
+                    block["block_ID"] = block_id
+
+                images = move_parsed_images(library, blocks, image_folder)
+
+                for block in blocks:
+                    if not bulk_writer:
+                        CollectionWriter(library.library_name, account_name=library.account_name).\
+                            write_new_parsing_record(block)
+
+                    pages.add(block["master_index"])
+                    if block["content_type"] == "table":
+                        added_tables += 1
+
+                if bulk_writer:
+                    bulk_writer.write_blocks(blocks)
+                    # the copy in file_copy_path marks the file as done on the next run - so the blocks are
+                    # committed first
+                    bulk_writer.flush()
+
+                shutil.copy(os.path.join(custom_folder_path, file_name), library.file_copy_path)
+
+                added_docs += 1
+                added_blocks += len(blocks)
+                added_pages += len(pages)
+                added_images += images
+
+                print(f"  ✅ {file_name} - doc_ID: {doc_id} - blocks: {len(blocks)} - pages: {len(pages)}")
+
+    finally:
+        # the counters cover every document committed so far, even if the run stops part-way
+        try:
+            if bulk_writer:
+                bulk_writer.close()
+        finally:
+            library.set_incremental_docs_blocks_images(added_docs=added_docs, added_blocks=added_blocks,
+                                                       added_images=added_images, added_pages=added_pages,
+                                                       added_tables=added_tables)
+
+    CollectionWriter(library.library_name, account_name=library.account_name).build_text_index()
+
+    elapsed = time.time() - t0
+
+    parsing_output = {"docs_added": added_docs, "blocks_added": added_blocks, "pages_added": added_pages,
+                      "tables_added": added_tables, "images_added": added_images,
+                      "rejected_files": rejected_files,
+                      "workers": workers, "elapsed_time": elapsed}
+
+    print(f"✅ Parallel parsing complete: {parsing_output}")
+
+    return parsing_output
+
+
+def benchmark_parallel_parsing(custom_folder_path, max_workers=None, library_name_base="parse_benchmark"):
+
+    """ Parses the same folder with 1..N workers into a fresh library each time and reports pages/sec. """
+
+    if not max_workers:
+        max_workers = os.cpu_count() or 1
+
+    report = []
+
+    for workers in range(1, max_workers + 1):
+
+        library_name = f"{library_name_base}_{workers}"
+
+        # start each run from an empty library
+        if Library().check_if_library_exists(library_name):
+            Library().delete_library(library_name, confirm_delete=True)
+
+        output = parallel_parsing_documents_into_library(library_name, custom_folder_path, workers=workers)
+
+        pages_per_sec = output["pages_added"] / output["elapsed_time"] if output["elapsed_time"] else 0.0
+
+        report.append({"workers": workers, "pages": output["pages_added"], "blocks": output["blocks_added"],
+                       "elapsed_time": round(output["elapsed_time"], 2),
+                       "pages_per_sec": round(pages_per_sec, 2)})
+
+        Library().delete_library(library_name, confirm_delete=True)
+
+    print("\n⏱️ Parsing benchmark")
+    for row in report:
+        print(f"  workers: {row['workers']:>3} - pages: {row['pages']} - blocks: {row['blocks']} - "
+              f"time: {row['elapsed_time']}s - pages/sec: {row['pages_per_sec']}")
+
+    return report
+
+
+def benchmark_block_writes(num_docs=200, blocks_per_doc=100, library_name_base="write_benchmark"):
+
+    """ Compares blocks/sec of the per-document write path (CollectionWriter, one round-trip per block) with
+    SQLiteBulkBlockWriter, on the same synthetic blocks. """
+
+    def synthetic_blocks(doc_id):
+        text = "This agreement is entered into by and between the parties for the provision of services. " * 4
+        return [{"block_ID": i, "doc_ID": doc_id, "content_type": "text", "file_type": "pdf",
+                 "master_index": i // 10 + 1, "master_index2": 0, "coords_x": 0, "coords_y": 0,
+                 "coords_cx": 0, "coords_cy": 0, "author_or_speaker": "", "added_to_collection": "",
+                 "file_source": f"doc_{doc_id}.pdf", "table": "", "modified_date": "", "created_date": "",
+                 "creator_tool": "", "external_files": "", "text": text, "header_text": "", "text_search": text,
+                 "user_tags": "", "special_field1": "", "special_field2": "", "special_field3": "",
+                 "graph_status": "false", "dialog": "false", "embedding_flags": ""}
+                for i in range(blocks_per_doc)]
+
+    report = {}
+
+    for mode in ["per_document", "bulk"]:
+
+        library_name = f"{library_name_base}_{mode}"
+        if Library().check_if_library_exists(library_name):
+            Library().delete_library(library_name, confirm_delete=True)
+        library = Library().create_new_library(library_name)
+
+        t0 = time.time()
+
+        if mode == "bulk":
+            with SQLiteBulkBlockWriter(library) as writer:
+                for doc_id in range(num_docs):
+                    writer.write_blocks(synthetic_blocks(doc_id))
+        else:
+            for doc_id in range(num_docs):
+                for block in synthetic_blocks(doc_id):
+                    CollectionWriter(library.library_name, account_name=library.account_name).\
+                        write_new_parsing_record(block)
+
+        elapsed = time.time() - t0
+        total_blocks = num_docs * blocks_per_doc
+
+        report[mode] = {"blocks": total_blocks, "elapsed_time": round(elapsed, 2),
+                        "blocks_per_sec": round(total_blocks / elapsed, 1) if elapsed else 0.0}
+
+        print(f"⏱️ {mode:<12} - blocks: {total_blocks} - time: {report[mode]['elapsed_time']}s - "
+              f"blocks/sec: {report[mode]['blocks_per_sec']}")
+
+        Library().delete_library(library_name, confirm_delete=True)
+
+    return report
+
+
+def incremental_parsing_documents_into_library(library_name, custom_folder_path, **add_files_options):
+
+    """ Re-ingests a folder against the library manifest (ingest_ext) - only new or changed files are parsed,
+    and the blocks of changed or deleted files are removed first.  Note: vectors already installed for
+    removed blocks are not deleted from the vector db. """
+
+    print(f"\n📚 Incremental Parsing Files into Library: {library_name}")
+
+    library = Library().create_new_library(library_name)
+
+    parsing_output = incremental_add_files(library, custom_folder_path, **add_files_options)
+
+    print(f"📂 new: {len(parsing_output['new_files'])} - changed: {len(parsing_output['changed_files'])} - "
+          f"deleted: {len(parsing_output['deleted_files'])} - unchanged: {parsing_output['unchanged_files']}")
+
+    print(f"✅ Incremental parsing complete: {parsing_output}")
+
+    return parsing_output
+
+
 if __name__ == "__main__":
     # Optional: Switch to sqlite if you're not using MongoDB
     LLMWareConfig().set_active_db("sqlite")
@@ -47,3 +315,11 @@ if __name__ == "__main__":
     library_name = "my_custom_library"
 
     parsing_documents_into_library(library_name, my_custom_path)
+
+    #   for large folders - parse across all cores, or compare pages/sec for 1..N workers
+    # parallel_parsing_documents_into_library(library_name, my_custom_path)
+    # benchmark_parallel_parsing(my_custom_path)
+    # benchmark_block_writes()
+
+    #   for re-runs on the same folder - only parse new/changed files and drop deleted ones
+    # incremental_parsing_documents_into_library(library_name, my_custom_path)
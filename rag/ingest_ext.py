@@ -0,0 +1,338 @@
+"""     Ingestion helpers used by the examples in this folder (example-1, 2.embedding-lib, 10.watch-folder-daemon).
+
+    Re-ingesting a folder into an existing library, without re-parsing the files that did not change:
+
+    1.  Manifest - per-library ingest_manifest.json, keyed by the path of each file relative to the ingest root,
+        with its size, mtime and sha256 (the hash is only recomputed when size or mtime have moved).
+    2.  file_source - every file is staged for add_files under a name derived from its relative path
+        (source_name), so that files with the same name in different sub-folders never share blocks.
+    3.  remove_document_from_library - deletes the blocks and the uploaded copy of one file_source.
+    4.  incremental_add_files - diff of the folder against the manifest: new and changed files are parsed,
+        the blocks of changed and deleted files are removed first, and rejected files are left out of the
+        manifest so that they are retried on the next run.
+    5.  parse_one_file / move_parsed_images - parsing with a long-lived Parser outside of add_files, with the
+        images of each file renamed by doc_ID and moved into the library image folder.
+    6.  SQLiteBulkBlockWriter - bulk-load mode for the SQLite block table, for writers that assign the doc and
+        block ids themselves.
+
+    Note: vectors that were already installed for removed blocks are not deleted from the vector db - llmware
+    has no delete-by-id across the vector dbs - they no longer resolve to a block of the document.  To purge
+    them, delete the embedding and run install_new_embedding again.
+
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+
+from llmware.retrieval import Query
+from llmware.configs import LLMWareTableSchema
+from llmware.resources import CollectionWriter, CollectionRetrieval, SQLiteWriter
+
+
+MANIFEST_FILE = "ingest_manifest.json"
+
+
+def file_fingerprint(file_path, previous=None):
+
+    """ Size + mtime + sha256 of a file - the hash is only recomputed when size or mtime have moved. """
+
+    stat = os.stat(file_path)
+
+    if previous and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+        return previous
+
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha.hexdigest()}
+
+
+def source_name(rel_path):
+
+    """ file_source used for a file in the library - its path relative to the ingest root, flattened into one
+    file name (e.g., 'contracts/2024/a.pdf' -> 'contracts__2024__a.pdf'), as add_files stores the name only. """
+
+    return "__".join(os.path.normpath(rel_path).split(os.sep))
+
+
+def load_ingest_manifest(library):
+
+    """ Per-library manifest of ingested files - {relative path: {"size", "mtime", "sha256", "file_source"}} """
+
+    manifest_fp = os.path.join(library.library_main_path, MANIFEST_FILE)
+
+    if not os.path.exists(manifest_fp):
+        return {}
+
+    with open(manifest_fp, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_ingest_manifest(library, manifest):
+
+    manifest_fp = os.path.join(library.library_main_path, MANIFEST_FILE)
+
+    # write-then-rename so an interrupted run never leaves a half-written manifest behind
+    tmp_fp = manifest_fp + ".tmp"
+    with open(tmp_fp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_fp, manifest_fp)
+
+
+def scan_ingest_folder(input_folder, manifest=None, recursive=False):
+
+    """ Fingerprints the files under input_folder - {relative path: {"size", "mtime", "sha256", "file_source",
+    "path"}} - re-using the hashes in the manifest for files whose size and mtime have not moved. """
+
+    manifest = manifest or {}
+    current = {}
+
+    for root, dirs, files in os.walk(input_folder):
+
+        if not recursive:
+            dirs.clear()
+
+        for fn in sorted(files):
+            fp = os.path.join(root, fn)
+            rel_path = os.path.relpath(fp, input_folder)
+            current[rel_path] = dict(file_fingerprint(fp, manifest.get(rel_path)),
+                                     file_source=source_name(rel_path), path=fp)
+
+    return current
+
+
+def remove_document_from_library(library, file_source):
+
+    """ Deletes all blocks of one file_source and its uploaded copy - returns the number of blocks removed.
+    Vectors already installed for the blocks are left in the vector db (see the note at the top). """
+
+    removed_blocks = 0
+
+    # file_source may be stored with or without the folder path depending upon the parser
+    for stored_source in CollectionRetrieval(library.library_name,
+                                             account_name=library.account_name).get_distinct_list("file_source"):
+
+        if stored_source.split(os.sep)[-1] != file_source:
+            continue
+
+        removed_blocks += len(Query(library).document_lookup(file_source=stored_source))
+        CollectionWriter(library.library_name, account_name=library.account_name).\
+            delete_record_by_key("file_source", stored_source)
+
+    uploaded_copy = os.path.join(library.file_copy_path, file_source)
+    if os.path.exists(uploaded_copy):
+        os.remove(uploaded_copy)
+
+    if removed_blocks:
+        library.set_incremental_docs_blocks_images(added_docs=-1, added_blocks=-removed_blocks)
+
+    return removed_blocks
+
+
+def stage_files(staging_path, files):
+
+    """ Copies [(path, file_source)] into an empty staging folder, under their file_source names. """
+
+    if os.path.exists(staging_path):
+        shutil.rmtree(staging_path)
+    os.makedirs(staging_path)
+
+    for fp, file_source in files:
+        shutil.copy2(fp, os.path.join(staging_path, file_source))
+
+    return staging_path
+
+
+def incremental_add_files(library, input_folder, recursive=False, **add_files_options):
+
+    """ Re-ingests a folder against the library manifest - only new or changed files are parsed with add_files,
+    and the blocks of changed or deleted files are removed first. """
+
+    manifest = load_ingest_manifest(library)
+    current = scan_ingest_folder(input_folder, manifest, recursive=recursive)
+
+    new_files = [rp for rp in current if rp not in manifest]
+    changed_files = [rp for rp in current if rp in manifest and current[rp]["sha256"] != manifest[rp]["sha256"]]
+    deleted_files = [rp for rp in manifest if rp not in current]
+
+    removed_blocks = 0
+    for rp in changed_files + deleted_files:
+        entry = manifest[rp]
+        removed_blocks += remove_document_from_library(library, entry.get("file_source", source_name(rp)))
+
+    output = {"new_files": new_files, "changed_files": changed_files, "deleted_files": deleted_files,
+              "unchanged_files": len(current) - len(new_files) - len(changed_files),
+              "blocks_removed": removed_blocks, "rejected_files": []}
+
+    to_parse = new_files + changed_files
+
+    if to_parse:
+
+        # stage only the files that need parsing, so add_files never walks the unchanged part of the folder
+        staging_path = stage_files(os.path.join(library.tmp_path, "incremental_ingest"),
+                                   [(current[rp]["path"], current[rp]["file_source"]) for rp in to_parse])
+
+        parsing_output = library.add_files(input_folder_path=staging_path, **add_files_options)
+        shutil.rmtree(staging_path)
+
+        if parsing_output:
+            rejected = parsing_output.get("rejected_files") or []
+            output.update(parsing_output)
+        else:
+            # no parsing report - treat every staged file as not ingested
+            rejected = [current[rp]["file_source"] for rp in to_parse]
+
+        # rejected files stay out of the manifest, so that they are picked up again on the next run
+        rejected = set(rejected) if isinstance(rejected, list) else set()
+        output["rejected_files"] = [rp for rp in to_parse if current[rp]["file_source"] in rejected]
+        for rp in output["rejected_files"]:
+            del current[rp]
+
+    # unchanged entries keep their fingerprint, so the next run only needs a stat() per file
+    for entry in current.values():
+        del entry["path"]
+    save_ingest_manifest(library, current)
+
+    return output
+
+
+def parse_one_file(parser, folder_path, file_name):
+
+    """ Parses one file with a long-lived Parser - returns the blocks, and a folder of its own holding the images
+    extracted from the file (see move_parsed_images). """
+
+    # parse_one appends to parser_output - start each file with an empty list, as the parser is re-used
+    parser.parser_output = []
+
+    blocks = parser.parse_one(folder_path, file_name, save_history=False)
+
+    # parse_one always runs the C parser with the same doc number, so the image names repeat from one file
+    # to the next - move this file's images out before the parser is used for another file
+    image_folder = os.path.join(parser.parser_tmp_folder, f"images_{time.time_ns()}")
+    os.makedirs(image_folder, exist_ok=True)
+
+    for block in blocks:
+        if block.get("external_files"):
+            src = os.path.join(parser.parser_image_folder, block["external_files"])
+            if os.path.exists(src):
+                shutil.move(src, os.path.join(image_folder, block["external_files"]))
+
+    return blocks, image_folder
+
+
+def move_parsed_images(library, blocks, image_folder):
+
+    """ Moves the images of one parsed file into the library image folder - each image is renamed with the
+    doc_ID of its block, so that images from different files never overwrite each other. Returns the
+    number of images added. """
+
+    added_images = 0
+
+    for block in blocks:
+        img_name = block.get("external_files")
+        if img_name:
+            src = os.path.join(image_folder, img_name)
+            if os.path.exists(src):
+                new_name = f"{block['doc_ID']}_{img_name}"
+                shutil.move(src, os.path.join(library.image_path, new_name))
+                block["external_files"] = new_name
+                added_images += 1
+
+    shutil.rmtree(image_folder, ignore_errors=True)
+
+    return added_images
+
+
+class SQLiteBulkBlockWriter:
+
+    """ Bulk-load mode for the SQLite block table - used in place of CollectionWriter.write_new_parsing_record,
+    which opens, commits and closes a connection for every single block.
+
+    Rows are buffered and written with executemany in one transaction per batch, on the llmware SQLiteWriter
+    connection, switched to WAL journaling with synchronous=NORMAL.  The block table in llmware is an FTS5
+    virtual table, so the 'index' is the FTS5 segment structure - automerge is switched off while loading, and
+    the index is merged once at the end with the FTS5 'optimize' command.  The automerge setting is stored in
+    the table, so close() always restores it, even if the final flush fails. """
+
+    # parser output uses 'table' and 'text' for the table_block and text_block columns
+    record_key_map = {"table_block": "table", "text_block": "text"}
+
+    def __init__(self, library, batch_size=5000):
+
+        self.library_name = library.library_name
+        self.account_name = library.account_name
+        self.table_name = library.library_name
+        self.batch_size = batch_size
+        self.buffer = []
+        self.blocks_written = 0
+        self.writer = None
+        self.conn = None
+
+        # insert columns from the llmware block schema - _id is assigned by the db
+        self.insert_keys = [k for k in LLMWareTableSchema.get_block_schema() if k not in ("_id", "PRIMARY KEY")]
+        self.record_keys = [self.record_key_map.get(k, k) for k in self.insert_keys]
+        self.flag_index = self.insert_keys.index("embedding_flags")
+
+        self.insert_sql = f"INSERT INTO {self.table_name} ({', '.join(self.insert_keys)}) " \
+                          f"VALUES ({', '.join(['?'] * len(self.insert_keys))});"
+
+    def open(self):
+
+        self.writer = SQLiteWriter(self.library_name, account_name=self.account_name)
+        self.conn = self.writer.conn
+        self.conn.execute("PRAGMA busy_timeout=30000;")
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("PRAGMA synchronous=NORMAL;")
+
+        # defer FTS5 segment merging until the load is complete
+        self.conn.execute(f"INSERT INTO {self.table_name}({self.table_name}, rank) VALUES('automerge', 0);")
+        self.conn.commit()
+
+        return self
+
+    def __enter__(self):
+        return self.open()
+
+    def write_blocks(self, blocks):
+
+        for block in blocks:
+            row = [block.get(k, "") for k in self.record_keys]
+            # new blocks start with no embedding flag
+            row[self.flag_index] = ""
+            self.buffer.append(row)
+
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+
+        """ Writes the buffered rows in a single transaction - no transaction is held open between flushes, so
+        the library card (doc id counter) can still be updated by other connections in between. """
+
+        if self.buffer:
+            with self.conn:
+                self.conn.executemany(self.insert_sql, self.buffer)
+            self.blocks_written += len(self.buffer)
+            self.buffer = []
+
+    def close(self):
+
+        try:
+            self.flush()
+            # rebuild the FTS5 index once into a single merged segment
+            self.conn.execute(f"INSERT INTO {self.table_name}({self.table_name}) VALUES('optimize');")
+            self.conn.commit()
+        finally:
+            # restore the default merge policy - otherwise the table keeps automerge=0 for good
+            self.conn.rollback()
+            self.conn.execute(f"INSERT INTO {self.table_name}({self.table_name}, rank) VALUES('automerge', 4);")
+            self.conn.commit()
+            self.conn.close()
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,845 @@
+
+"""     Prompt extensions used by the examples in this folder.
+
+    ExtendedPrompt is a drop-in subclass of the llmware Prompt class - it is created and loaded the same way,
+    e.g., `ExtendedPrompt().load_model("bling-answer-tool", temperature=0.0, sample=False)`, and all of the Prompt
+    methods work as before.  The additions are opt-in:
+
+    1.  prompt_main_batch - runs a list of query / context pairs through the loaded model in one batched
+        generation, instead of one prompt_main call after another, and returns the outputs (and usage) in the
+        order of the list:
+
+            -- GGUF - continuous batching on a multi-sequence llama.cpp context:  the prompts share each decode
+               step (prefill chunks and one new token per running sequence), and a sequence that finishes frees
+               its slot for the next prompt in the list
+            -- OpenVINO - the list of prompts is passed to the openvino_genai pipeline in one generate call
+            -- ONNX - the prompts are padded into one onnxruntime_genai generator with batch_size > 1
+
+        Any other model (or a function-calling model, or a model over an api endpoint) runs the same list
+        through prompt_main, one at a time.
+
+    2.  reuse_kv_prefix=True (GGUF) - keeps the kv cache of the model between calls, and only prefills the
+        tokens after the longest prefix shared with the previous prompt.  Several questions asked in a row on
+        the same source share the whole context (it comes before the question in the prompt templates), so
+        only the question is prefilled for the follow-up questions.
+    3.  ResponseCache - persistent (sqlite file) cache of deterministic responses, keyed by a hash of the model,
+        the prompt template, the prompt, the context and the generation parameters, and bounded in size with
+        least-recently-used eviction.  Used by ExtendedPrompt(response_cache=..) for prompt_main (and so
+        prompt_with_source and prompt_main_batch), and by cache_model_calls(model) for model inference and
+        function_call.  Only greedy calls (sample=False, or temperature 0.0) are cached - re-running a pipeline
+        over unchanged inputs then runs no inference.
+
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+
+from llmware.prompts import Prompt
+from llmware.models import GGUFGenerativeModel, ONNXGenerativeModel, OVGenerativeModel
+from llmware.gguf_configs import GGUFConfigs, _LlamaContext, _LlamaBatch
+from llmware.util import Utilities
+from llmware.configs import LLMWareConfig
+
+logger = logging.getLogger(__name__)
+
+
+def _clean_output(text_str):
+
+    """ Same post-processing as the model inference methods - stop at the end-of-text markers, and start after
+    the bot wrapper. """
+
+    eot = text_str.find("<|endoftext|>")
+    if eot > -1:
+        text_str = text_str[:eot]
+
+    eots = text_str.find("</s>")
+    if eots > -1:
+        text_str = text_str[:eots]
+
+    bot = text_str.find("<bot>:")
+    if bot > -1:
+        text_str = text_str[bot + len("<bot>:"):]
+
+    boss = text_str.find("<s>")
+    if boss > -1:
+        text_str = text_str[boss + len("<s>"):]
+
+    return text_str
+
+
+def _usage(input_tokens, output_tokens, processing_time, first_token_processing_time=None):
+
+    usage = {"input": input_tokens, "output": output_tokens, "total": input_tokens + output_tokens,
+             "metric": "tokens", "processing_time": processing_time}
+
+    if first_token_processing_time is not None:
+        usage.update({"first_token_processing_time": first_token_processing_time})
+
+    return usage
+
+
+def gguf_generate_batch(model, text_prompts, max_slots=4):
+
+    """ Continuous batching over one GGUFGenerativeModel - returns a list of {"llm_response", "usage"} dicts, in
+    the order of text_prompts.
+
+    Runs on its own llama.cpp context with max_slots sequences (the model weights are shared with the loaded
+    model, only the kv cache is new), so the state of the loaded model is not touched.  Each decode step packs
+    one new token for every running sequence, and fills the rest of the batch with prefill chunks of the
+    prompts that are starting - a sequence that stops frees its slot (and its kv cells) for the next prompt.
+
+    Sampling is greedy, as in the single-prompt generation loop, so each output matches model.inference. """
+
+    lib = model._lib
+
+    if model._sampler is None:
+        model._sampler = model._init_sampler()
+
+    context_window = model._n_ctx
+    max_output_len = model.max_output_len
+
+    prompt_tokens = []
+    for prompt in text_prompts:
+
+        tokens = model.tokenize(prompt.encode("utf-8"), special=True) if prompt != "" else [model.token_bos()]
+
+        if len(tokens) > context_window:
+            logger.warning("GGUFGenerativeModel - input is too long for model context window - truncating")
+            tokens = tokens[0:context_window - 10]
+
+        prompt_tokens.append(tokens)
+
+    n_slots = max(1, min(max_slots, len(text_prompts)))
+
+    # each sequence needs room for its prompt and its output - and at most the model context window
+    slot_ctx = min(context_window, max(len(t) for t in prompt_tokens) + max_output_len + 1)
+
+    params = type(model.context_params).from_buffer_copy(model.context_params)
+    params.n_ctx = n_slots * slot_ctx
+    params.n_seq_max = n_slots
+
+    ctx = _LlamaContext(lib, model=model._model, params=params)
+    batch = _LlamaBatch(lib, n_tokens=params.n_batch, embd=0, n_seq_max=n_slots)
+    n_batch = params.n_batch
+
+    get_first_token_speed = GGUFConfigs().get_config("get_first_token_speed")
+
+    waiting = deque(range(len(text_prompts)))
+    free_slots = list(range(n_slots - 1, -1, -1))
+    running = {}
+    outputs = [None] * len(text_prompts)
+
+    while waiting or running:
+
+        while waiting and free_slots:
+            i = waiting.popleft()
+            running[free_slots.pop()] = {"index": i, "pos": 0, "feed": list(prompt_tokens[i]), "completion": [],
+                                         "t0": time.time(), "first_token_time": -1.0}
+
+        # decoding sequences (one token each) first, then prefill chunks in the space left in the batch
+        order = sorted(running.items(), key=lambda item: len(item[1]["feed"]))
+
+        n_tokens = 0
+        sample_at = {}
+
+        for seq_id, seq in order:
+
+            take = seq["feed"][:n_batch - n_tokens]
+            if not take:
+                break
+
+            for k, token in enumerate(take):
+                batch.batch.token[n_tokens] = token
+                batch.batch.pos[n_tokens] = seq["pos"] + k
+                batch.batch.seq_id[n_tokens][0] = seq_id
+                batch.batch.n_seq_id[n_tokens] = 1
+                batch.batch.logits[n_tokens] = False
+                n_tokens += 1
+
+            seq["pos"] += len(take)
+            seq["feed"] = seq["feed"][len(take):]
+
+            # logits only for the last token of a sequence that is fully fed
+            if not seq["feed"]:
+                batch.batch.logits[n_tokens - 1] = True
+                sample_at[seq_id] = n_tokens - 1
+
+        batch.batch.n_tokens = n_tokens
+
+        return_code = lib.llama_decode(ctx.ctx, batch.batch)
+
+        if return_code != 0:
+            raise RuntimeError(f"error: llama_decode call returned {return_code} - in most cases, this "
+                               f"is due to exceeding the maximum context window.")
+
+        for seq_id, batch_idx in sample_at.items():
+
+            seq = running[seq_id]
+            token = lib.llama_sampler_sample(model._sampler, ctx.ctx, batch_idx)
+
+            if get_first_token_speed and seq["first_token_time"] < 0:
+                seq["first_token_time"] = time.time() - seq["t0"]
+
+            # same stopping rules as the single-prompt generation loop
+            stop = token == model._token_eos
+
+            if not stop:
+                seq["completion"].append(token)
+                input_len = len(prompt_tokens[seq["index"]])
+                stop = (len(seq["completion"]) >= max_output_len or
+                        input_len + len(seq["completion"]) >= context_window or
+                        seq["pos"] + 1 >= slot_ctx)
+
+            if not stop:
+                seq["feed"] = [token]
+                continue
+
+            lib.llama_kv_cache_seq_rm(ctx.ctx, seq_id, -1, -1)
+            del running[seq_id]
+            free_slots.append(seq_id)
+
+            text_str = model.detokenize(seq["completion"]).decode("utf-8", errors="ignore")
+            input_len = len(prompt_tokens[seq["index"]])
+
+            outputs[seq["index"]] = {"llm_response": _clean_output(text_str),
+                                     "usage": _usage(input_len, len(seq["completion"]), time.time() - seq["t0"],
+                                                     seq["first_token_time"] if get_first_token_speed else None)}
+
+    return outputs
+
+
+def ov_generate_batch(model, text_prompts, max_slots=8):
+
+    """ Passes the prompts to the openvino_genai pipeline in lists of max_slots - one generate call each. """
+
+    outputs = []
+
+    for start in range(0, len(text_prompts), max_slots):
+
+        chunk = text_prompts[start:start + max_slots]
+
+        t0 = time.time()
+        texts = list(model._generate_ov_genai(chunk).texts)
+        processing_time = time.time() - t0
+
+        for prompt, text in zip(chunk, texts):
+
+            text_str = _clean_output(text)
+
+            if model.get_token_counts:
+                input_tokens, output_tokens = model.ov_token_counter(prompt), model.ov_token_counter(text_str)
+            else:
+                input_tokens, output_tokens = 0, 0
+
+            outputs.append({"llm_response": text_str, "usage": _usage(input_tokens, output_tokens, processing_time)})
+
+    return outputs
+
+
+def onnx_generate_batch(model, text_prompts, max_slots=8):
+
+    """ Pads the prompts into one onnxruntime_genai generator per max_slots prompts (batch_size > 1), and
+    decodes the output of each row after the generator is done. """
+
+    from llmware.models import og
+
+    outputs = []
+
+    for start in range(0, len(text_prompts), max_slots):
+
+        chunk = text_prompts[start:start + max_slots]
+
+        t0 = time.time()
+
+        params = og.GeneratorParams(model.model)
+        params.set_search_options(max_length=max(2048, min(model.max_total_len, 8192)), batch_size=len(chunk))
+
+        input_tokens = model.tokenizer.encode_batch(chunk)
+        padded_len = len(input_tokens[0])
+
+        generator = og.Generator(model.model, params)
+        generator.append_tokens(input_tokens)
+
+        steps = 0
+        while not generator.is_done() and steps <= model.max_output:
+            generator.generate_next_token()
+            steps += 1
+
+        rows = [list(generator.get_sequence(i))[padded_len:] for i in range(len(chunk))]
+
+        # direct deletion of generator recommended in onnxruntime_genai examples
+        del generator
+
+        processing_time = time.time() - t0
+
+        for prompt, row in zip(chunk, rows):
+
+            # the padding and end-of-sequence tokens are dropped in the decode
+            text_str = _clean_output(model.tokenizer.decode(row))
+
+            outputs.append({"llm_response": text_str,
+                            "usage": _usage(len(model.tokenizer.encode(prompt)),
+                                            min(len(row), len(model.tokenizer.encode(text_str))), processing_time)})
+
+    return outputs
+
+
+class GGUFPrefixCache:
+
+    """ Keeps the kv cache of a loaded GGUFGenerativeModel between generation calls, and reuses its longest
+    prefix shared with the next prompt - the model generates exactly as before, as the kv cells of a token
+    only depend on the tokens before it.
+
+    Installs itself as the generate method of the model object (the class method is not changed), so every
+    path that runs the model generation loop - inference and function_call - goes through it.  A shared
+    prefix shorter than min_prefix_tokens is not reused. """
+
+    def __init__(self, model, min_prefix_tokens=16):
+
+        self.model = model
+        self.min_prefix_tokens = min_prefix_tokens
+
+        self.calls = 0
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
+
+        model.generate = self.generate
+
+    def generate(self, tokens, reset=True):
+
+        model = self.model
+        tokens = list(tokens)
+
+        # tokens in the kv cache - at least one token of the new prompt is evaluated, to get its logits
+        cached = model.input_ids[:min(model.n_tokens, len(tokens) - 1)]
+        mismatch = np.flatnonzero(cached != np.asarray(tokens[:len(cached)], dtype=cached.dtype))
+        prefix_len = int(mismatch[0]) if len(mismatch) else len(cached)
+
+        if prefix_len < self.min_prefix_tokens:
+            prefix_len = 0
+
+        self.calls += 1
+        self.reused_tokens += prefix_len
+        self.prefilled_tokens += len(tokens) - prefix_len
+
+        # the generation loop removes the kv cells after n_tokens before the first decode
+        model.n_tokens = prefix_len
+
+        return GGUFGenerativeModel.generate(model, tokens[prefix_len:], reset=False)
+
+    def clear(self):
+        self.model.reset()
+
+    def detach(self):
+        del self.model.generate
+
+    def get_stats(self):
+
+        total = self.reused_tokens + self.prefilled_tokens
+
+        return {"calls": self.calls, "reused_tokens": self.reused_tokens, "prefilled_tokens": self.prefilled_tokens,
+                "reuse_ratio": round(self.reused_tokens / total, 4) if total else 0.0}
+
+
+def _json_default(value):
+    # numpy scalars in logits / usage
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+class ResponseCache:
+
+    """ Persistent cache of llm responses - one sqlite file (by default, response_cache.db in the llmware path),
+    shared by the processes that use it, and bounded by max_mb of stored responses - the least recently used
+    responses are evicted first.  Thread-safe.
+
+    The key is a sha256 hash of the parts passed to make_key - the callers pass everything that the output
+    depends on, so a change to any of them is a miss (and the old entry ages out). """
+
+    def __init__(self, db_path=None, max_mb=256):
+
+        if not db_path:
+            db_path = os.path.join(LLMWareConfig().get_llmware_path(), "response_cache.db")
+
+        self.db_path = db_path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, "
+                          "size INTEGER, last_used REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.conn.commit()
+
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(**parts):
+        key_str = json.dumps(parts, sort_keys=True, default=_json_default)
+        return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+
+        """ Returns the cached response (a new copy), or None. """
+
+        with self._lock:
+
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+
+        return json.loads(row[0])
+
+    def put(self, key, response):
+
+        response_str = json.dumps(response, default=_json_default)
+        size = len(response_str.encode("utf-8"))
+
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old:
+                self.total_bytes -= old[0]
+
+            self.conn.execute("INSERT OR REPLACE INTO responses (key, response, size, last_used) VALUES (?, ?, ?, ?)",
+                              (key, response_str, size, time.time()))
+            self.total_bytes += size
+
+            while self.total_bytes > self.max_bytes:
+
+                oldest = self.conn.execute("SELECT key, size FROM responses ORDER BY last_used LIMIT 64").fetchall()
+
+                for old_key, old_size in oldest:
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                    self.total_bytes -= old_size
+                    self.evictions += 1
+                    if self.total_bytes <= self.max_bytes:
+                        break
+
+            self.conn.commit()
+
+    def clear(self):
+
+        with self._lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+            self.total_bytes = 0
+
+    def get_stats(self):
+
+        with self._lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+        return {"entries": entries, "size_mb": round(self.total_bytes / (1024 * 1024), 3),
+                "max_mb": round(self.max_bytes / (1024 * 1024), 3), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+    def close(self):
+        self.conn.close()
+
+
+def _is_deterministic(model, temperature):
+
+    """ Greedy decoding (sample=False) does not depend on the temperature - models without a sample option
+    are deterministic only at temperature 0.0. """
+
+    return not getattr(model, "sample", True) or temperature == 0.0
+
+
+def _model_key_parts(model):
+
+    """ The model settings that change its output - the output limits are named differently by model class. """
+
+    return {"model_name": model.model_name, "model_class": model.__class__.__name__,
+            "sample": getattr(model, "sample", None),
+            "max_output_len": getattr(model, "max_output_len", None),
+            "max_output": getattr(model, "max_output", None),
+            "target_requested_output_tokens": getattr(model, "target_requested_output_tokens", None),
+            "prompt_wrapper": getattr(model, "prompt_wrapper", None),
+            "trailing_space": getattr(model, "trailing_space", None)}
+
+
+def _cache_hit_usage(usage, t0):
+    usage = dict(usage or {})
+    usage.update({"processing_time": time.time() - t0, "cache_hit": True})
+    return usage
+
+
+def cache_model_calls(model, cache=None):
+
+    """ Routes the inference and function_call methods of a loaded model through a ResponseCache (a new default
+    ResponseCache if none is passed) - installed on the model object, as the class methods are not changed.
+    Returns the model, e.g., `model = cache_model_calls(ModelCatalog().load_model("slim-extract-tool",
+    sample=False, temperature=0.0))`.
+
+    The key uses the values the model resolves for the call - arguments that are not passed are taken from the
+    model state (e.g., add_context, primary_keys), as in the model methods. """
+
+    cache = cache or ResponseCache()
+
+    inference_fn = model.inference
+    function_call_fn = model.function_call
+
+    def inference(prompt, add_context=None, add_prompt_engineering=None, inference_dict=None, **kwargs):
+
+        t0 = time.time()
+
+        context = add_context or model.add_context
+        prompt_name = add_prompt_engineering or model.add_prompt_engineering or \
+            ("default_with_context" if context else "default_no_context")
+
+        temperature = (inference_dict or {}).get("temperature", model.temperature)
+
+        if not _is_deterministic(model, temperature):
+            return inference_fn(prompt, add_context=add_context, add_prompt_engineering=add_prompt_engineering,
+                                inference_dict=inference_dict, **kwargs)
+
+        key = cache.make_key(method="inference", prompt=prompt, context=context, prompt_name=prompt_name,
+                             temperature=temperature, inference_dict=inference_dict,
+                             get_logits=kwargs.get("get_logits", getattr(model, "get_logits", False)),
+                             **_model_key_parts(model))
+
+        response = cache.get(key)
+
+        if response is None:
+            response = inference_fn(prompt, add_context=add_context, add_prompt_engineering=add_prompt_engineering,
+                                    inference_dict=inference_dict, **kwargs)
+            if response.get("llm_response") != "/***ERROR***/":
+                cache.put(key, response)
+            return response
+
+        response["usage"] = _cache_hit_usage(response.get("usage"), t0)
+
+        model.prompt = prompt
+        model.add_context = context
+        model.add_prompt_engineering = prompt_name
+        model.llm_response = response["llm_response"]
+        model.usage = response["usage"]
+
+        return response
+
+    def function_call(context, function=None, params=None, **kwargs):
+
+        t0 = time.time()
+
+        temperature = kwargs.get("temperature", -99)
+        if temperature == -99:
+            temperature = model.temperature
+
+        if not getattr(model, "fc_supported", False) or not _is_deterministic(model, temperature):
+            return function_call_fn(context, function=function, params=params, **kwargs)
+
+        model_function = model.function[0] if isinstance(model.function, list) and model.function \
+            else model.function
+
+        key = cache.make_key(method="function_call", context=context, function=function or model_function,
+                             params=params or model.primary_keys, temperature=temperature,
+                             kwargs=kwargs, **_model_key_parts(model))
+
+        response = cache.get(key)
+
+        if response is None:
+            response = function_call_fn(context, function=function, params=params, **kwargs)
+            if response:
+                cache.put(key, response)
+            return response
+
+        response["usage"] = _cache_hit_usage(response.get("usage"), t0)
+
+        model.context = context
+        model.llm_response = response.get("llm_response")
+        model.usage = response["usage"]
+
+        return response
+
+    model.inference = inference
+    model.function_call = function_call
+    model.response_cache = cache
+
+    return model
+
+
+class ExtendedPrompt(Prompt):
+
+    """ Prompt with prompt_main_batch - see the module docstring.  After each batch, last_batch_stats holds the
+    item count, the generation mode, the total output tokens and the output tokens / sec of the batch.
+
+    KV prefix reuse - pass reuse_kv_prefix=True to keep the kv cache of a GGUF model between prompts (see
+    GGUFPrefixCache).  prefix_cache.get_stats() shows the prompt tokens reused and prefilled so far.
+
+    Response cache - pass response_cache=True (default ResponseCache) or a ResponseCache object, to return the
+    cached output of a deterministic prompt_main call with the same model, prompt template, prompt, context and
+    parameters - with a new time stamp and the ids of the call, and "cache_hit" in the usage. """
+
+    def __init__(self, *args, reuse_kv_prefix=False, min_prefix_tokens=16, response_cache=None, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        self.last_batch_stats = {}
+
+        if response_cache is True:
+            response_cache = ResponseCache()
+
+        self.response_cache = response_cache
+
+        self.reuse_kv_prefix = reuse_kv_prefix
+        self.min_prefix_tokens = min_prefix_tokens
+        self.prefix_cache = None
+
+    def load_model(self, *args, **kwargs):
+
+        super().load_model(*args, **kwargs)
+
+        self.prefix_cache = None
+        if self.reuse_kv_prefix and isinstance(self.llm_model, GGUFGenerativeModel):
+            self.prefix_cache = GGUFPrefixCache(self.llm_model, min_prefix_tokens=self.min_prefix_tokens)
+
+        return self
+
+    def _resolve_prompt_name(self, prompt_name, context):
+
+        """ Same prompt name as prompt_main - from the model state, if not passed. """
+
+        if prompt_name:
+            return prompt_name
+
+        if self.llm_model.add_prompt_engineering:
+            return self.llm_model.add_prompt_engineering
+
+        return "default_with_context" if context else "default_no_context"
+
+    def _response_key(self, query, context, prompt_name, inference_dict, max_output, temperature):
+
+        """ Cache key of a prompt_main call - None if the call is not deterministic. """
+
+        if not self.response_cache:
+            return None
+
+        temperature = temperature or self.temperature
+        if not _is_deterministic(self.llm_model, temperature):
+            return None
+
+        return self.response_cache.make_key(method="prompt_main", prompt=query, context=context,
+                                            prompt_name=self._resolve_prompt_name(prompt_name, context),
+                                            inference_dict=inference_dict, temperature=temperature,
+                                            llm_max_output_len=max_output or self.llm_max_output_len,
+                                            fc_supported=getattr(self.llm_model, "fc_supported", False),
+                                            **_model_key_parts(self.llm_model))
+
+    def _cached_output(self, key, t0, calling_app_id, prompt_id, batch_id):
+
+        output_dict = self.response_cache.get(key)
+        if output_dict is None:
+            return None
+
+        output_dict.update({"usage": _cache_hit_usage(output_dict.get("usage"), t0),
+                            "time_stamp": Utilities().get_current_time_now("%a %b %d %H:%M:%S %Y"),
+                            "calling_app_ID": calling_app_id, "account_name": self.account_name,
+                            "prompt_id": prompt_id, "batch_id": batch_id})
+
+        return output_dict
+
+    def prompt_main(self, prompt, prompt_name=None, context=None, call_back_attempts=1, calling_app_id="",
+                    prompt_id=0, batch_id=0, trx_dict=None, selected_model=None, register_trx=False,
+                    inference_dict=None, max_output=None, temperature=None):
+
+        """ prompt_main - with a response cache lookup first, if a response_cache is set. """
+
+        t0 = time.time()
+
+        key = None
+        if not selected_model:
+            key = self._response_key(prompt, context, prompt_name, inference_dict, max_output, temperature)
+
+        if key:
+            output_dict = self._cached_output(key, t0, calling_app_id, prompt_id, batch_id)
+            if output_dict:
+                if register_trx:
+                    self.register_llm_inference(output_dict, prompt_id, trx_dict)
+                return output_dict
+
+        output_dict = super().prompt_main(prompt, prompt_name=prompt_name, context=context,
+                                          call_back_attempts=call_back_attempts, calling_app_id=calling_app_id,
+                                          prompt_id=prompt_id, batch_id=batch_id, trx_dict=trx_dict,
+                                          selected_model=selected_model, register_trx=register_trx,
+                                          inference_dict=inference_dict, max_output=max_output,
+                                          temperature=temperature)
+
+        # error outputs (no usage) are not cached
+        if key and output_dict.get("usage"):
+            self.response_cache.put(key, output_dict)
+
+        return output_dict
+
+    def _batch_generate_fn(self):
+
+        """ Returns the batched generation function for the loaded model, or None to run prompt_main. """
+
+        model = self.llm_model
+
+        if getattr(model, "fc_supported", False) or getattr(model, "api_endpoint", None):
+            return None
+
+        if isinstance(model, GGUFGenerativeModel):
+            return gguf_generate_batch
+
+        if isinstance(model, OVGenerativeModel):
+            return ov_generate_batch
+
+        if isinstance(model, ONNXGenerativeModel):
+            from llmware.configs import ONNXConfig
+            # the legacy onnxruntime_genai api has no batched append_tokens
+            if not ONNXConfig().get_legacy_flag():
+                return onnx_generate_batch
+
+        return None
+
+    def _text_prompt(self, query, context, prompt_name, inference_dict):
+
+        """ Builds the final prompt text exactly as the model inference method does. """
+
+        model = self.llm_model
+        model.add_context = context
+        model.add_prompt_engineering = prompt_name
+
+        return model.prompt_engineer(query, context, inference_dict=inference_dict) + model.trailing_space
+
+    def _output_dict(self, llm_response, usage, query, context, prompt_name, calling_app_id, prompt_id, batch_id):
+
+        """ Same output dict as prompt_main. """
+
+        llm_response = str(llm_response).replace("<s>", "").replace("</s>", "")
+
+        output_dict = {"llm_response": llm_response, "prompt": query,
+                       "evidence": context,
+                       "instruction": prompt_name, "model": self.llm_model.model_name,
+                       "usage": usage,
+                       "time_stamp": Utilities().get_current_time_now("%a %b %d %H:%M:%S %Y"),
+                       "calling_app_ID": calling_app_id,
+                       "rating": "",
+                       "account_name": self.account_name,
+                       "prompt_id": prompt_id,
+                       "batch_id": batch_id}
+
+        output_dict.update({"evidence_metadata": [{"evidence_start_char": 0,
+                                                   "evidence_stop_char": len(context) if context else 0,
+                                                   "page_num": "NA",
+                                                   "source_name": "NA",
+                                                   "doc_id": "NA",
+                                                   "block_id": "NA"}]})
+
+        return output_dict
+
+    def prompt_main_batch(self, items, prompt_name=None, max_slots=4, calling_app_id="", prompt_id=0, batch_id=0,
+                          trx_dict=None, register_trx=False, inference_dict=None, max_output=None, temperature=None):
+
+        """ Runs prompt_main over a list of items - each a dict with "query" and (optional) "context" keys, e.g.,
+        the entries of a test list, or a (query, context) tuple - in one batched generation on GGUF, OpenVINO and
+        ONNX models.  Returns a list of prompt_main output dicts, in the order of the items.
+
+        max_slots is the number of prompts generated at the same time - on GGUF, each slot adds a kv cache of
+        up to the model context window, so keep it small on machines with little memory. """
+
+        pairs = [(item["query"], item.get("context")) if isinstance(item, dict) else tuple(item) for item in items]
+
+        if not pairs:
+            return []
+
+        t0 = time.time()
+
+        generate_batch = self._batch_generate_fn()
+
+        if not generate_batch:
+
+            outputs = [self.prompt_main(query, prompt_name=prompt_name, context=context,
+                                        calling_app_id=calling_app_id, prompt_id=prompt_id, batch_id=batch_id,
+                                        trx_dict=trx_dict, register_trx=register_trx, inference_dict=inference_dict,
+                                        max_output=max_output, temperature=temperature)
+                       for query, context in pairs]
+
+            mode = "sequential"
+
+        else:
+
+            if temperature:
+                self.temperature = temperature
+
+            self.llm_model.temperature = self.temperature
+
+            if max_output:
+                self.llm_max_output_len = max_output
+
+            self.llm_model.target_requested_output_tokens = self.llm_max_output_len
+
+            # resolved in order, as in prompt_main - a call without a prompt name uses the previous one
+            names = []
+            for _, context in pairs:
+                names.append(self._resolve_prompt_name(prompt_name, context))
+                self.llm_model.add_prompt_engineering = names[-1]
+
+            keys = [self._response_key(query, context, name, inference_dict, max_output, temperature)
+                    for (query, context), name in zip(pairs, names)]
+
+            outputs = [self._cached_output(key, t0, calling_app_id, prompt_id, batch_id) if key else None
+                       for key in keys]
+
+            misses = [i for i, output in enumerate(outputs) if output is None]
+
+            text_prompts = [self._text_prompt(pairs[i][0], pairs[i][1], names[i], inference_dict) for i in misses]
+
+            if text_prompts:
+                self.llm_model.preview()
+                generated = generate_batch(self.llm_model, text_prompts, max_slots=max_slots)
+            else:
+                generated = []
+
+            for i, gen in zip(misses, generated):
+
+                query, context = pairs[i]
+                output_dict = self._output_dict(gen["llm_response"], gen["usage"], query, context, names[i],
+                                                calling_app_id, prompt_id, batch_id)
+
+                if keys[i]:
+                    self.response_cache.put(keys[i], output_dict)
+
+                outputs[i] = output_dict
+
+            if register_trx:
+                for output_dict in outputs:
+                    self.register_llm_inference(output_dict, prompt_id, trx_dict)
+
+            mode = self.llm_model.__class__.__name__
+
+        processing_time = time.time() - t0
+        # generated tokens only - cached outputs are not generated again
+        output_tokens = sum(output["usage"].get("output", 0) for output in outputs
+                            if not output["usage"].get("cache_hit"))
+
+        self.last_batch_stats = {"items": len(outputs), "mode": mode, "max_slots": max_slots,
+                                 "cache_hits": sum(1 for output in outputs if output["usage"].get("cache_hit")),
+                                 "output_tokens": output_tokens,
+                                 "processing_time": round(processing_time, 3),
+                                 "tokens_per_sec": round(output_tokens / processing_time, 2) if processing_time else 0}
+
+        return outputs
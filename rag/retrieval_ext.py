@@ -0,0 +1,1077 @@
+"""     Retrieval extensions used by the examples in this folder.
+
+    ExtendedQuery is a drop-in subclass of the llmware Query class - it is created the same way, e.g.,
+    `ExtendedQuery(library)`, and all of the Query methods work as before.  The additions are opt-in:
+
+    1.  Result cache - in-process LRU / TTL cache of query results, keyed by library, query method, query and
+        filters, and invalidated automatically when the block count or embedding record of the library changes.
+    2.  semantic_query_batch - embeds a list of queries in one forward pass, and searches the vector db with one
+        matrix search when the vector db supports it (the numpy vector dbs in embeddings_ext.py).
+    3.  hybrid_query - runs the text and semantic queries concurrently, and merges them with reciprocal rank
+        fusion.
+    4.  semantic_query(..., doc_filter=.., top_k_per_document=..) - document filter applied inside the vector
+        search, and a grouped mode that returns the top k results of each document.
+    5.  text_query_by_document_and_topic - a list of topics x a list of documents in one set-based query,
+        with the top results of each (doc_ID, topic) pair.
+    6.  fts5_search=True (sqlite) - text queries run as BM25-ranked FTS5 queries with real phrase matching,
+        column weights, bound parameters, and the result count applied in the SQL (LIMIT).
+    7.  Stage timing - collect_timing=True attaches a per-stage latency breakdown (embed, ann_search, hydration,
+        text_search, assembly) to each call, and feeds a process-wide histogram that can be dumped to JSON.
+    8.  iter_text_query / iter_semantic_query - generators that yield the results in pages, with the block
+        text loaded lazily (load_text), so that all of the matches of a library can be exported
+        (export_pages_to_jsonl) in constant memory.
+
+"""
+
+import re
+import copy
+import json
+import time
+import logging
+import bisect
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from llmware.retrieval import Query
+from llmware.resources import SQLiteRetrieval
+from llmware.configs import LLMWareConfig
+from llmware.exceptions import EmbeddingModelNotFoundException, UnsupportedEmbeddingDatabaseException
+
+logger = logging.getLogger(__name__)
+
+
+class QueryResultCache:
+
+    """ LRU cache of query results with a time-to-live - thread-safe, and shared by default between all of the
+    ExtendedQuery objects in the process, so that repeated questions from different chat sessions hit.
+
+    Each entry is stored with the library version at the time of the query - a lookup with a different
+    library version drops the entry (counted as an invalidation), so results never outlive a change to the
+    library, even within the ttl. """
+
+    def __init__(self, max_entries=1024, ttl_secs=300):
+
+        self.max_entries = max_entries
+        self.ttl_secs = ttl_secs
+
+        # key -> (library version, time stored, results)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, version):
+
+        """ Returns (True, results) on a hit, and (False, None) otherwise. """
+
+        with self.lock:
+
+            entry = self.entries.get(key)
+
+            if entry:
+                entry_version, stored, results = entry
+
+                if entry_version != version:
+                    del self.entries[key]
+                    self.invalidations += 1
+                elif self.ttl_secs and time.time() - stored > self.ttl_secs:
+                    del self.entries[key]
+                    self.expirations += 1
+                else:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, copy.deepcopy(results)
+
+            self.misses += 1
+
+        return False, None
+
+    def put(self, key, version, results):
+
+        with self.lock:
+
+            self.entries[key] = (version, time.time(), copy.deepcopy(results))
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self, library_name=None, account_name=None):
+
+        """ Drops all entries, or only the entries of one library. """
+
+        with self.lock:
+            if not library_name:
+                self.entries.clear()
+            else:
+                for key in [k for k in self.entries if k[0] == account_name and k[1] == library_name]:
+                    del self.entries[key]
+
+    def get_stats(self):
+
+        lookups = self.hits + self.misses
+
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions, "expirations": self.expirations, "invalidations": self.invalidations}
+
+
+# shared by all ExtendedQuery objects created with use_result_cache=True
+_shared_result_cache = QueryResultCache()
+
+
+class StageLatencyHistogram:
+
+    """ Latency histogram per (query method, stage) - log-spaced buckets from 0.1 ms to ~100 s, so that the
+    percentiles can be read without keeping every sample.  Thread-safe, and shared by default between all of
+    the ExtendedQuery objects in the process (stage_latency_histogram).
+
+    dump() returns count, mean, p50 / p95 / p99 (upper bound of the bucket) and max of each stage, and the
+    bucket counts - and writes them to a JSON file if a path is passed. """
+
+    # 0.1 ms, 0.14 ms, 0.2 ms, ... doubling every two buckets, up to ~105 s
+    bucket_bounds_ms = tuple(round(0.1 * 2 ** (i / 2), 4) for i in range(41))
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+
+        # (method name, stage) -> {"count", "total_ms", "max_ms", "buckets"}
+        self.stats = {}
+
+    def record(self, method_name, stage, secs):
+
+        ms = secs * 1000
+        bucket = bisect.bisect_left(self.bucket_bounds_ms, ms)
+
+        with self.lock:
+
+            entry = self.stats.get((method_name, stage))
+            if not entry:
+                entry = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "buckets": [0] * (len(self.bucket_bounds_ms) + 1)}
+                self.stats[(method_name, stage)] = entry
+
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["buckets"][bucket] += 1
+
+    def _percentile(self, entry, fraction):
+
+        target = fraction * entry["count"]
+        seen = 0
+
+        for i, count in enumerate(entry["buckets"]):
+            seen += count
+            if count and seen >= target:
+                return entry["max_ms"] if i >= len(self.bucket_bounds_ms) else min(self.bucket_bounds_ms[i],
+                                                                                  entry["max_ms"])
+
+        return entry["max_ms"]
+
+    def dump(self, fp=None):
+
+        """ Returns {method name: {stage: stats}} - and writes it as JSON to fp, if passed. """
+
+        output = {}
+
+        with self.lock:
+
+            for (method_name, stage), entry in sorted(self.stats.items()):
+
+                output.setdefault(method_name, {})[stage] = {
+                    "count": entry["count"],
+                    "mean_ms": round(entry["total_ms"] / entry["count"], 3),
+                    "p50_ms": round(self._percentile(entry, 0.50), 3),
+                    "p95_ms": round(self._percentile(entry, 0.95), 3),
+                    "p99_ms": round(self._percentile(entry, 0.99), 3),
+                    "max_ms": round(entry["max_ms"], 3),
+                    "buckets": {(f"<={bound}" if i < len(self.bucket_bounds_ms) else f">{self.bucket_bounds_ms[-1]}"):
+                                count for i, (bound, count) in enumerate(zip(self.bucket_bounds_ms + (None,),
+                                                                             entry["buckets"])) if count}}
+
+        if fp:
+            with open(fp, "w", encoding="utf-8") as f:
+                json.dump(output, f, indent=2)
+
+        return output
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+
+# shared by all ExtendedQuery objects created with collect_timing=True
+stage_latency_histogram = StageLatencyHistogram()
+
+
+def fts5_match_expression(query):
+
+    """ Compiles a text query into an FTS5 match expression - each quoted part of the query is a phrase that
+    must match in order, e.g., '"master services agreement"', and the other words are OR'd together.  With both,
+    the phrases are required and at least one of the other words must match.
+
+    Every token is passed as an FTS5 string, so punctuation and words such as AND / NOT / NEAR in the query
+    are not read as FTS5 syntax.  Returns an empty string if the query has no tokens. """
+
+    phrases = ['"' + " ".join(re.findall(r"\w+", phrase)) + '"' for phrase in re.findall(r'"([^"]*)"', query)
+               if re.search(r"\w", phrase)]
+
+    words = ['"' + token + '"' for token in re.findall(r"\w+", re.sub(r'"[^"]*"', " ", query))]
+
+    parts = phrases
+    if len(words) == 1:
+        parts = phrases + words
+    elif words:
+        parts = phrases + ["(" + " OR ".join(words) + ")"]
+
+    return " AND ".join(parts)
+
+
+def export_pages_to_jsonl(pages, output_fp):
+
+    """ Writes the results of a page generator (iter_text_query / iter_semantic_query) to a jsonl file, one
+    result per line, one page at a time - returns the number of results written. """
+
+    count = 0
+
+    with open(output_fp, "w", encoding="utf-8") as f:
+        for page in pages:
+            for result in page:
+                f.write(json.dumps(result, default=str) + "\n")
+            count += len(page)
+
+    return count
+
+
+class ExtendedQuery(Query):
+
+    """ Query with opt-in extensions - see the module docstring.
+
+    Result cache - pass use_result_cache=True to use the process-wide cache, or result_cache=QueryResultCache(..)
+    for a dedicated one.  The cached methods are query, text_query, text_query_with_document_filter,
+    text_search_by_page, semantic_query, semantic_query_with_document_filter and
+    text_query_by_document_and_topic.  Note: a cache hit does not add
+    another entry to the query history (save_history).
+
+    FTS5 search - pass fts5_search=True to run text_query, text_query_with_document_filter, text_search_by_page
+    and text_query_by_document_and_topic as BM25-ranked FTS5 queries on sqlite (see fts5_match_expression for
+    the query syntax).  fts5_column_weights sets the BM25 weight of each indexed column that is searched, e.g.,
+    {"text_search": 1.0, "header_text": 2.0}.  With other text index dbs, the option has no effect.
+
+    Stage timing - pass collect_timing=True to time each call by stage.  After each call, last_timing holds
+    {"method", "total_ms", "stages": {stage: ms}}, where 'other' is the time outside of the named stages (e.g.,
+    the text index query on the standard text path) - with results_only=False, it is also in the result dict
+    under 'timing'.  Each stage is recorded in stage_latency_histogram (or the latency_histogram passed).  The
+    ann_search / hydration split is available with the numpy vector dbs in embeddings_ext.py - with other vector
+    dbs, the block lookup is part of ann_search. """
+
+    def __init__(self, library, *args, use_result_cache=False, result_cache=None, fts5_search=False,
+                 fts5_column_weights=None, collect_timing=False, latency_histogram=None, **kwargs):
+
+        super().__init__(library, *args, **kwargs)
+
+        self.collect_timing = collect_timing
+        self.latency_histogram = latency_histogram or stage_latency_histogram
+        self.last_timing = {}
+
+        self.fts5_search = fts5_search
+        self.fts5_column_weights = fts5_column_weights or {"text_search": 1.0}
+
+        self.result_cache = result_cache
+        if use_result_cache and not result_cache:
+            self.result_cache = _shared_result_cache
+
+        # set while a top-level method runs - calls from one Query method to another are not cached or timed
+        # twice (per thread, as hybrid_query runs the text and semantic queries concurrently on the same object)
+        self._call_state = threading.local()
+
+    def library_version(self):
+
+        """ Changes whenever blocks are added or removed, or an embedding is installed, updated or deleted. """
+
+        library_card = self.library.get_library_card() or {}
+
+        embedding_version = tuple((emb.get("embedding_model"), emb.get("embedding_db"), emb.get("embedding_status"),
+                                   emb.get("embedded_blocks"), emb.get("time_stamp"))
+                                  for emb in (library_card.get("embedding") or []))
+
+        return library_card.get("documents"), library_card.get("blocks"), embedding_version
+
+    def _cached_call(self, method_name, method, args, kwargs):
+        return self._timed_call(method_name, method, args, kwargs, cached=True)
+
+    def _timed_call(self, method_name, method, args, kwargs, cached=False):
+
+        """ Runs a top-level query method - through the result cache (if cached, and a cache is set), and with
+        stage timing (if collect_timing).  Calls made from inside the method run directly. """
+
+        if getattr(self._call_state, "in_call", False):
+            return method(*args, **kwargs)
+
+        self._call_state.in_call = True
+        self._call_state.stages = OrderedDict() if self.collect_timing else None
+        t0 = time.time()
+
+        try:
+            if not (cached and self.result_cache):
+                results = method(*args, **kwargs)
+
+            else:
+                key = (self.account_name, self.library_name, method_name,
+                       json.dumps([args, kwargs], sort_keys=True, default=str),
+                       self.embedding_model_name, self.embedding_db, tuple(self.query_result_return_keys))
+
+                with self._stage("cache_lookup"):
+                    version = self.library_version()
+                    found, results = self.result_cache.get(key, version)
+
+                if not found:
+                    results = method(*args, **kwargs)
+                    self.result_cache.put(key, version, results)
+
+        finally:
+            self._call_state.in_call = False
+
+        if self.collect_timing:
+            timing = self._finish_timing(method_name, time.time() - t0)
+            if isinstance(results, dict) and "results" in results:
+                results["timing"] = timing
+
+        return results
+
+    @contextmanager
+    def _stage(self, stage):
+
+        """ Adds the time spent in the block to the stage, if the current call is timed. """
+
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self._add_stage_time(stage, time.time() - t0)
+
+    def _add_stage_time(self, stage, secs):
+
+        stages = getattr(self._call_state, "stages", None)
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + secs
+
+    def _finish_timing(self, method_name, total_secs):
+
+        stages = self._call_state.stages or {}
+        self._call_state.stages = None
+
+        stages["other"] = max(total_secs - sum(stages.values()), 0.0)
+
+        for stage, secs in stages.items():
+            self.latency_histogram.record(method_name, stage, secs)
+        self.latency_histogram.record(method_name, "total", total_secs)
+
+        self.last_timing = {"method": method_name, "total_ms": round(total_secs * 1000, 3),
+                            "stages": {stage: round(secs * 1000, 3) for stage, secs in stages.items()}}
+
+        return self.last_timing
+
+    def _timed_vector_search(self, vector_db, search, *args, **kwargs):
+
+        """ Runs a vector db search, split into ann_search and hydration if the vector db tracks its block
+        lookup time (hydration_secs). """
+
+        hydration_before = getattr(vector_db, "hydration_secs", None)
+        t0 = time.time()
+
+        results = search(*args, **kwargs)
+
+        elapsed = time.time() - t0
+
+        if hydration_before is None:
+            self._add_stage_time("ann_search", elapsed)
+        else:
+            hydration = vector_db.hydration_secs - hydration_before
+            self._add_stage_time("hydration", hydration)
+            self._add_stage_time("ann_search", max(elapsed - hydration, 0.0))
+
+        return results
+
+    def _cursor_to_qr(self, *args, **kwargs):
+        with self._stage("assembly"):
+            return super()._cursor_to_qr(*args, **kwargs)
+
+    def get_cache_stats(self):
+        return self.result_cache.get_stats() if self.result_cache else {}
+
+    def query(self, *args, **kwargs):
+        return self._cached_call("query", super().query, args, kwargs)
+
+    def text_query(self, *args, **kwargs):
+        return self._cached_call("text_query", self._text_query, args, kwargs)
+
+    def text_query_with_document_filter(self, *args, **kwargs):
+        return self._cached_call("text_query_with_document_filter", self._text_query_with_document_filter,
+                                 args, kwargs)
+
+    def text_search_by_page(self, *args, **kwargs):
+        return self._cached_call("text_search_by_page", self._text_search_by_page, args, kwargs)
+
+    def semantic_query(self, *args, **kwargs):
+        return self._cached_call("semantic_query", self._semantic_query, args, kwargs)
+
+    def semantic_query_with_document_filter(self, *args, **kwargs):
+        return self._cached_call("semantic_query_with_document_filter",
+                                 super().semantic_query_with_document_filter, args, kwargs)
+
+    def text_query_by_document_and_topic(self, *args, **kwargs):
+        return self._cached_call("text_query_by_document_and_topic", self._text_query_by_document_and_topic,
+                                 args, kwargs)
+
+    def semantic_query_batch(self, queries, result_count=20, embedding_distance_threshold=None, results_only=True):
+
+        """ Runs semantic_query for a list of queries - returns one result list per query, in order.
+
+        The queries are embedded in a single call to the embedding model.  If the vector db has a
+        search_index_batch method, all of the queries are searched in one scan of the index - otherwise, each
+        query vector is searched on its own.  With the result cache, the batch is cached as a whole. """
+
+        return self._cached_call("semantic_query_batch", self._semantic_query_batch,
+                                 (list(queries), result_count, embedding_distance_threshold, results_only), {})
+
+    def _semantic_query_batch(self, queries, result_count=20, embedding_distance_threshold=None, results_only=True):
+
+        if not embedding_distance_threshold:
+            embedding_distance_threshold = self.semantic_distance_threshold
+
+        queries = list(queries)
+        if not queries:
+            return []
+
+        with self._stage("embed"):
+
+            self.load_embedding_model()
+
+            if not self.embedding_model:
+                raise EmbeddingModelNotFoundException(self.library_name)
+
+            if not self.embedding_db:
+                raise UnsupportedEmbeddingDatabaseException(self.embedding_db)
+
+            query_vectors = np.asarray(self.embedding_model.embedding(queries),
+                                       dtype=np.float32).reshape(len(queries), -1)
+
+        vector_db = self.embeddings._load_embedding_db(self.embedding_db, model=self.embedding_model)
+
+        if hasattr(vector_db, "search_index_batch"):
+            batch_results = self._timed_vector_search(vector_db, vector_db.search_index_batch, query_vectors,
+                                                      sample_count=result_count)
+        else:
+            batch_results = [self._timed_vector_search(vector_db, vector_db.search_index, query_vector,
+                                                       sample_count=result_count)
+                             for query_vector in query_vectors]
+
+        output = []
+
+        for query, semantic_block_results in zip(queries, batch_results):
+
+            qr_raw = []
+            for block, distance in semantic_block_results:
+                if distance < embedding_distance_threshold:
+                    block["distance"] = distance
+                    block["semantic"] = "semantic"
+                    block["score"] = 0.0
+                    qr_raw.append(block)
+
+            results_dict = self._cursor_to_qr(query, qr_raw, result_count=result_count)
+
+            output.append(results_dict["results"] if results_only else results_dict)
+
+        return output
+
+    def hybrid_query(self, query, result_count=20, candidate_count=None, rrf_k=60, text_weight=1.0,
+                     semantic_weight=1.0, results_only=True):
+
+        """ Text + semantic retrieval in one call - the two searches run concurrently (both release the GIL
+        while waiting on the database or the embedding model), so the latency is close to the slower of the
+        two rather than the sum.
+
+        The two ranked lists are merged with reciprocal rank fusion - each block scores
+        weight / (rrf_k + rank) for every list it appears in.  Each result carries 'rrf_score', and its
+        'text_rank' / 'semantic_rank' (None if not in that list).  If the library has no embedding, this is
+        the same as a text query.
+
+        With collect_timing, the text and semantic queries are timed as their own calls (in the histogram, and
+        with their own stages), and the hybrid_query timing has the 'search' and 'fusion' stages. """
+
+        return self._timed_call("hybrid_query", self._hybrid_query,
+                                (query, result_count, candidate_count, rrf_k, text_weight, semantic_weight,
+                                 results_only), {})
+
+    def _hybrid_query(self, query, result_count=20, candidate_count=None, rrf_k=60, text_weight=1.0,
+                      semantic_weight=1.0, results_only=True):
+
+        candidate_count = candidate_count or result_count * 2
+
+        self.load_embedding_model()
+        use_semantic = self.search_mode == "semantic" and self.embedding_model and self.embedding_db
+
+        with self._stage("search"), ThreadPoolExecutor(max_workers=2) as executor:
+
+            text_future = executor.submit(self.text_query, query, result_count=candidate_count)
+            semantic_future = None
+            if use_semantic:
+                semantic_future = executor.submit(self.semantic_query, query, result_count=candidate_count)
+
+            text_results = text_future.result()
+            semantic_results = semantic_future.result() if semantic_future else []
+
+        with self._stage("fusion"):
+            return self._fuse(query, text_results, semantic_results, result_count, rrf_k, text_weight,
+                              semantic_weight, results_only)
+
+    @staticmethod
+    def _fuse(query, text_results, semantic_results, result_count, rrf_k, text_weight, semantic_weight,
+              results_only):
+
+        fused = {}
+
+        for list_name, weight, results in (("text_rank", text_weight, text_results),
+                                           ("semantic_rank", semantic_weight, semantic_results)):
+
+            for rank, result in enumerate(results):
+
+                key = str(result.get("_id"))
+
+                if key not in fused:
+                    fused[key] = dict(result, rrf_score=0.0, text_rank=None, semantic_rank=None)
+
+                fused[key]["rrf_score"] += weight / (rrf_k + rank + 1)
+                fused[key][list_name] = rank + 1
+
+        ranked = sorted(fused.values(), key=lambda x: x["rrf_score"], reverse=True)[:result_count]
+
+        if results_only:
+            return ranked
+
+        return {"query": query, "results": ranked,
+                "doc_ID": sorted(set(r["doc_ID"] for r in ranked if "doc_ID" in r)),
+                "file_source": sorted(set(r["file_source"] for r in ranked if "file_source" in r))}
+
+    def _text_query_by_document_and_topic(self, topics, doc_ids, result_count=5, exact_mode=False):
+
+        """ Text query of each topic within each document - returns a dict keyed by (doc_ID, topic), with the
+        top result_count results of that topic in that document (an empty list if none).
+
+        Replaces the loop of text_query_with_document_filter calls, one per document per topic.  On sqlite,
+        all of the topics and documents run as one statement - the topics are joined against the FTS5 index,
+        and a ROW_NUMBER() window over (topic, doc_ID) keeps the top results of each pair.  On other text
+        index dbs, each topic runs once with all of the documents in the filter, and is grouped by document. """
+
+        topics = list(topics)
+        doc_ids = list(doc_ids)
+
+        output = {(doc_id, topic): [] for doc_id in doc_ids for topic in topics}
+
+        if not topics or not doc_ids:
+            return output
+
+        prepared = [self.exact_query_prep(topic) if exact_mode else topic for topic in topics]
+
+        if LLMWareConfig().get_active_db() != "sqlite":
+
+            for topic, query in zip(topics, prepared):
+
+                results = self.text_query_with_document_filter(query, {"doc_ID": doc_ids}, exhaust_full_cursor=True)
+
+                for result in results:
+                    group = output.get((result["doc_ID"], topic))
+                    if group is not None and len(group) < result_count:
+                        group.append(result)
+
+            return output
+
+        retriever = SQLiteRetrieval(self.library_name, account_name=self.account_name)
+        table = self.library_name
+
+        # topics with no searchable tokens keep an empty result list
+        match_list = []
+        for i, query in enumerate(prepared):
+            match = self._fts5_column_filter(query) if self._use_fts5() else retriever._prep_query(query)
+            if match.strip():
+                match_list += [i, match]
+
+        if not match_list:
+            retriever.conn.close()
+            return output
+
+        topic_values = ", ".join(["(?, ?)"] * (len(match_list) // 2))
+        doc_values = ", ".join(["?"] * len(doc_ids))
+
+        sql_query = (f"WITH topics(topic_idx, match_str) AS (VALUES {topic_values}) "
+                     f"SELECT * FROM ("
+                     f"SELECT t.topic_idx AS topic_idx, {table}.doc_ID AS group_doc_id, {table}.rank AS score, "
+                     f"{table}.rowid AS row_id, {table}.*, "
+                     f"ROW_NUMBER() OVER (PARTITION BY t.topic_idx, {table}.doc_ID ORDER BY {table}.rank) AS rn "
+                     f"FROM topics AS t JOIN {table} ON {table}.text_search MATCH t.match_str "
+                     f"WHERE {table}.doc_ID IN ({doc_values})) "
+                     f"WHERE rn <= ? ORDER BY topic_idx, group_doc_id, score;")
+
+        params = match_list + doc_ids + [result_count]
+
+        try:
+            with self._stage("text_search"):
+                rows = list(retriever.conn.cursor().execute(sql_query, params))
+        finally:
+            retriever.conn.close()
+
+        # each row is: topic_idx, doc_ID, score, rowid, block columns .., rn
+        grouped = {}
+        for row in rows:
+            grouped.setdefault((row[0], row[1]), []).append(row[2:-1])
+
+        for (topic_idx, doc_id), group_rows in grouped.items():
+
+            raw = retriever.unpack_search_result(group_rows)
+            results = self._cursor_to_qr(prepared[topic_idx], raw, result_count=result_count)["results"]
+
+            output[(doc_id, topics[topic_idx])] = results
+
+        return output
+
+    def _use_fts5(self):
+        return self.fts5_search and LLMWareConfig().get_active_db() == "sqlite"
+
+    def _fts5_column_filter(self, query):
+
+        """ Match expression restricted to the weighted columns, e.g., '{text_search} : ("base" OR "salary")' """
+
+        match = fts5_match_expression(query)
+        if not match:
+            return ""
+
+        columns = " ".join(column for column, weight in self.fts5_column_weights.items() if weight)
+
+        return f"{{{columns}}} : ({match})"
+
+    def _text_match_sql(self, retriever, query):
+
+        """ (score expression, match condition, match parameter) of a text query - bm25 with the column weights
+        on the fts5 path, and the fts5 rank with the standard query preparation otherwise. """
+
+        table = self.library_name
+
+        if not self._use_fts5():
+            return "rank", "text_search MATCH ?", retriever._prep_query(query)
+
+        columns = [column for column in retriever.schema if column not in ("_id", "PRIMARY KEY")]
+        weights = ", ".join(str(float(self.fts5_column_weights.get(column, 0.0))) for column in columns)
+
+        return f"bm25({table}, {weights})", f"{table} MATCH ?", self._fts5_column_filter(query)
+
+    def _fts5_search(self, query, key=None, value_range=None, limit=None):
+
+        """ BM25-ranked FTS5 query, with an optional filter of key in value_range - returns the blocks in
+        the same form as the sqlite text index queries, with 'score' the bm25 score (lower is better). """
+
+        if not self._fts5_column_filter(query):
+            return []
+
+        retriever = SQLiteRetrieval(self.library_name, account_name=self.account_name)
+        table = self.library_name
+
+        score, condition, match = self._text_match_sql(retriever, query)
+
+        sql_query = f"SELECT {score} AS score, rowid, * FROM {table} WHERE {condition}"
+        params = [match]
+
+        if key:
+            sql_query += f" AND {key} IN ({', '.join(['?'] * len(value_range))})"
+            params += list(value_range)
+
+        sql_query += " ORDER BY score"
+
+        if limit:
+            sql_query += " LIMIT ?"
+            params.append(limit)
+
+        try:
+            with self._stage("text_search"):
+                output = retriever.unpack_search_result(retriever.conn.cursor().execute(sql_query + ";", params))
+        finally:
+            retriever.conn.close()
+
+        return output
+
+    def _text_query(self, query, exact_mode=False, result_count=20, exhaust_full_cursor=False, results_only=True):
+
+        if not self._use_fts5():
+            return super().text_query(query, exact_mode=exact_mode, result_count=result_count,
+                                      exhaust_full_cursor=exhaust_full_cursor, results_only=results_only)
+
+        if exact_mode:
+            query = self.exact_query_prep(query)
+
+        cursor = self._fts5_search(query, limit=None if exhaust_full_cursor else result_count)
+
+        results_dict = self._cursor_to_qr(query, cursor, result_count=result_count,
+                                          exhaust_full_cursor=exhaust_full_cursor)
+
+        return results_dict["results"] if results_only else results_dict
+
+    def _text_query_with_document_filter(self, query, doc_filter, result_count=20, exhaust_full_cursor=False,
+                                         results_only=True, exact_mode=False):
+
+        if not self._use_fts5():
+            return super().text_query_with_document_filter(query, doc_filter, result_count=result_count,
+                                                           exhaust_full_cursor=exhaust_full_cursor,
+                                                           results_only=results_only, exact_mode=exact_mode)
+
+        if exact_mode:
+            query = self.exact_query_prep(query)
+
+        key, value_range = self._doc_filter_key(doc_filter)
+
+        cursor = self._fts5_search(query, key=key, value_range=value_range,
+                                   limit=None if exhaust_full_cursor else result_count)
+
+        results_dict = self._cursor_to_qr(query, cursor, result_count=result_count,
+                                          exhaust_full_cursor=exhaust_full_cursor)
+
+        return results_dict["results"] if results_only else results_dict
+
+    @staticmethod
+    def _doc_filter_key(doc_filter):
+
+        """ (key, values) of a document filter - {"doc_ID": [..]} or {"file_source": [..]} - or (None, []). """
+
+        if "doc_ID" in doc_filter:
+            return "doc_ID", doc_filter["doc_ID"]
+
+        if "file_source" in doc_filter:
+            return "file_source", doc_filter["file_source"]
+
+        logger.warning("warning: ExtendedQuery - expected to receive document filter with keys of 'doc_ID' or "
+                       "'file_source' - as a safe fall-back - will run the requested query without a filter.")
+
+        return None, []
+
+    def _text_search_by_page(self, query, page_num=1, results_only=True):
+
+        if not self._use_fts5():
+            return super().text_search_by_page(query, page_num=page_num, results_only=results_only)
+
+        if not isinstance(page_num, list):
+            page_num = [page_num]
+
+        # same default result count (20) as Query.text_search_by_page
+        cursor = self._fts5_search(query, key="master_index", value_range=page_num, limit=20)
+
+        results_dict = self._cursor_to_qr(query, cursor)
+
+        return results_dict["results"] if results_only else results_dict
+
+    # text columns of the sqlite block table -> result key, and not read by iter_text_query(with_text=False)
+    _text_columns = {"text_block": "text", "table_block": "table", "text_search": "text_search"}
+
+    def iter_text_query(self, query, page_size=1000, with_text=False, doc_filter=None, exact_mode=False,
+                        ordered=True):
+
+        """ Generator over all of the matches of a text query, in pages (lists) of up to page_size results, best
+        first - in the same form as the text_query results.
+
+        With with_text=False (the default), the text columns are not read - the results have no 'text' (or
+        'matches'), and load_text(page) adds them for the pages that need them.  On sqlite, the rows are read
+        from the database cursor one page at a time, so memory stays flat however many blocks match - with
+        ordered=False, the matches are read in index order, without the sort by score.  With other text index
+        dbs, the query runs in full, and is then split into pages.  Note: the pages are not added to the query
+        history (save_history). """
+
+        if exact_mode:
+            query = self.exact_query_prep(query)
+
+        key, value_range = self._doc_filter_key(doc_filter) if doc_filter else (None, [])
+
+        if LLMWareConfig().get_active_db() != "sqlite":
+
+            if key:
+                results = super().text_query_with_document_filter(query, {key: value_range},
+                                                                  exhaust_full_cursor=True)
+            else:
+                results = super().text_query(query, exhaust_full_cursor=True)
+
+            for start in range(0, len(results), page_size):
+                yield results[start:start + page_size]
+
+            return
+
+        retriever = SQLiteRetrieval(self.library_name, account_name=self.account_name)
+        table = self.library_name
+
+        score, condition, match = self._text_match_sql(retriever, query)
+        if not match.strip():
+            retriever.conn.close()
+            return
+
+        columns = [column for column in retriever.schema if column not in ("_id", "PRIMARY KEY")]
+        if not with_text:
+            columns = [column for column in columns if column not in self._text_columns]
+
+        sql_query = f"SELECT {score} AS score, rowid, {', '.join(columns)} FROM {table} WHERE {condition}"
+        params = [match]
+
+        if key:
+            sql_query += f" AND {key} IN ({', '.join(['?'] * len(value_range))})"
+            params += list(value_range)
+
+        if ordered:
+            sql_query += " ORDER BY score"
+
+        output_keys = ["score", "_id"] + [self._text_columns.get(column, column) for column in columns]
+
+        try:
+            cursor = retriever.conn.cursor().execute(sql_query + ";", params)
+
+            while True:
+                rows = cursor.fetchmany(page_size)
+                if not rows:
+                    break
+
+                yield self._page_results(query, [dict(zip(output_keys, row)) for row in rows])
+
+        finally:
+            retriever.conn.close()
+
+    def iter_semantic_query(self, query, result_count=1000, page_size=100, embedding_distance_threshold=None,
+                            doc_filter=None):
+
+        """ Generator over the top result_count matches of a semantic query, in pages of up to page_size results,
+        nearest first - in the same form as the semantic_query results.
+
+        With the numpy vector dbs in embeddings_ext.py, the index scan returns only row numbers and distances,
+        and the blocks are looked up one page at a time, as the pages are read.  With other vector dbs, the
+        query runs in full, and is then split into pages. """
+
+        if not embedding_distance_threshold:
+            embedding_distance_threshold = self.semantic_distance_threshold
+
+        filter_dict = {key: value for key, value in (doc_filter or {}).items() if key in ("doc_ID", "file_source")}
+
+        self.load_embedding_model()
+
+        if not self.embedding_model:
+            raise EmbeddingModelNotFoundException(self.library_name)
+
+        if not self.embedding_db:
+            raise UnsupportedEmbeddingDatabaseException(self.embedding_db)
+
+        query_vector = np.asarray(self.embedding_model.embedding(query), dtype=np.float32).reshape(-1)
+
+        vector_db = self.embeddings._load_embedding_db(self.embedding_db, model=self.embedding_model)
+
+        if not hasattr(vector_db, "search_index_rows"):
+
+            results = self._semantic_query(query, result_count=result_count,
+                                           embedding_distance_threshold=embedding_distance_threshold,
+                                           doc_filter=filter_dict or None)
+
+            for start in range(0, len(results), page_size):
+                yield results[start:start + page_size]
+
+            return
+
+        rows, distances = vector_db.search_index_rows(query_vector, sample_count=result_count,
+                                                      filter_dict=filter_dict)
+
+        keep = distances < embedding_distance_threshold
+        rows, distances = rows[keep], distances[keep]
+
+        for start in range(0, len(rows), page_size):
+
+            raw = []
+            for block, distance in vector_db.hydrate_rows(rows[start:start + page_size],
+                                                          distances[start:start + page_size]):
+                block["distance"] = distance
+                block["semantic"] = "semantic"
+                block["score"] = 0.0
+                raw.append(block)
+
+            yield self._page_results(query, raw)
+
+    def _page_results(self, query, raw_results):
+
+        """ Packages a page of raw results like _cursor_to_qr - without the query history, and without the
+        keys that were not read (e.g., 'text'). """
+
+        page = []
+
+        for raw in raw_results:
+
+            raw["_id"] = str(raw["_id"])
+            raw["page_num"] = raw.get("master_index")
+
+            for key in ("score", "similarity", "distance"):
+                raw.setdefault(key, 0.0)
+
+            if "text" in raw:
+                raw["matches"] = self.locate_query_match(query, raw["text"])
+
+            output = {"query": query}
+            output.update({key: raw[key] for key in self.query_result_return_keys if key in raw})
+            output.update({"account_name": self.account_name, "library_name": self.library_name})
+
+            page.append(output)
+
+        return page
+
+    def load_text(self, results):
+
+        """ Adds 'text' (and 'matches') to results from iter_text_query(with_text=False) - one lookup for the
+        whole list.  Results that already have text are left as they are. """
+
+        missing = [result for result in results if "text" not in result]
+
+        # only the sqlite path of iter_text_query leaves out the text
+        if not missing or LLMWareConfig().get_active_db() != "sqlite":
+            return results
+
+        retriever = SQLiteRetrieval(self.library_name, account_name=self.account_name)
+
+        try:
+            sql_query = (f"SELECT rowid, text_block FROM {self.library_name} "
+                         f"WHERE rowid IN ({', '.join(['?'] * len(missing))});")
+            text_by_id = {str(row_id): text for row_id, text in
+                          retriever.conn.cursor().execute(sql_query, [int(result["_id"]) for result in missing])}
+        finally:
+            retriever.conn.close()
+
+        for result in missing:
+            result["text"] = text_by_id.get(result["_id"], "")
+            result["matches"] = self.locate_query_match(result["query"], result["text"])
+
+        return results
+
+    def _semantic_query(self, query, result_count=20, embedding_distance_threshold=None, custom_filter=None,
+                        results_only=True, doc_filter=None, top_k_per_document=None):
+
+        """ semantic_query with two extra options:
+
+            doc_filter - e.g., {"doc_ID": [2, 5]} or {"file_source": ["a.pdf"]} - applied inside the vector
+            search, so the result_count results all come from the selected documents.
+
+            top_k_per_document - returns the top k results of each document (within doc_filter, if passed),
+            instead of the top result_count results across the library - so small documents keep their hits.
+
+        The numpy vector dbs in embeddings_ext.py run both in the index scan.  With other vector dbs, the
+        results are over-fetched from the vector db and then filtered / grouped. """
+
+        if not doc_filter and not top_k_per_document and not self.collect_timing:
+            return super().semantic_query(query, result_count=result_count,
+                                          embedding_distance_threshold=embedding_distance_threshold,
+                                          custom_filter=custom_filter, results_only=results_only)
+
+        if not embedding_distance_threshold:
+            embedding_distance_threshold = self.semantic_distance_threshold
+
+        filter_dict = {key: value for key, value in (doc_filter or {}).items() if key in ("doc_ID", "file_source")}
+
+        with self._stage("embed"):
+
+            self.load_embedding_model()
+
+            if not self.embedding_model:
+                raise EmbeddingModelNotFoundException(self.library_name)
+
+            if not self.embedding_db:
+                raise UnsupportedEmbeddingDatabaseException(self.embedding_db)
+
+            self.query_embedding = self.embedding_model.embedding(query)
+            query_vector = np.asarray(self.query_embedding, dtype=np.float32).reshape(-1)
+
+        vector_db = self.embeddings._load_embedding_db(self.embedding_db, model=self.embedding_model)
+
+        if not filter_dict and not top_k_per_document:
+            # timed plain semantic query - same search as Query.semantic_query
+            block_results = self._timed_vector_search(vector_db, vector_db.search_index, query_vector,
+                                                      sample_count=result_count)
+
+        elif hasattr(vector_db, "search_index_grouped"):
+
+            if top_k_per_document:
+                block_results = self._timed_vector_search(vector_db, vector_db.search_index_grouped, query_vector,
+                                                          per_group=top_k_per_document, group_key="doc_ID",
+                                                          filter_dict=filter_dict)
+            else:
+                block_results = self._timed_vector_search(vector_db, vector_db.search_index, query_vector,
+                                                          sample_count=result_count, filter_dict=filter_dict)
+        else:
+            block_results = self._timed_vector_search(vector_db, self._overfetch_semantic, vector_db, query_vector,
+                                                      filter_dict, result_count, top_k_per_document)
+
+        qr_raw = []
+        for block, distance in block_results:
+            if distance < embedding_distance_threshold:
+                block["distance"] = distance
+                block["semantic"] = "semantic"
+                block["score"] = 0.0
+                qr_raw.append(block)
+
+        if custom_filter:
+            qr_raw = self.apply_custom_filter(qr_raw, custom_filter)
+
+        # grouped mode - all of the per-document results are kept
+        output_count = len(qr_raw) if top_k_per_document else result_count
+        results_dict = self._cursor_to_qr(query, qr_raw, result_count=output_count)
+
+        return results_dict["results"] if results_only else results_dict
+
+    def _overfetch_semantic(self, vector_db, query_vector, filter_dict, result_count, top_k_per_document,
+                            max_rounds=4):
+
+        """ Fallback for vector dbs without a filtered scan - doubles the sample count until the filter and
+        per-document limits are met, or the vector db has no more results. """
+
+        library_card = self.library.get_library_card() or {}
+        documents = max(1, int(library_card.get("documents") or 1))
+
+        if top_k_per_document:
+            target = top_k_per_document * (len(filter_dict.get("doc_ID", [])) or documents)
+        else:
+            target = result_count
+
+        sample_count = target * 4
+        selected = []
+
+        for _ in range(max_rounds):
+
+            block_results = vector_db.search_index(query_vector, sample_count=sample_count)
+
+            selected = []
+            per_document = {}
+
+            for block, distance in block_results:
+
+                if filter_dict and not all(block.get(key) in (values if isinstance(values, list) else [values])
+                                           for key, values in filter_dict.items()):
+                    continue
+
+                if top_k_per_document:
+                    count = per_document.get(block.get("doc_ID"), 0)
+                    if count >= top_k_per_document:
+                        continue
+                    per_document[block.get("doc_ID")] = count + 1
+
+                selected.append((block, distance))
+
+            if len(selected) >= target or len(block_results) < sample_count:
+                break
+
+            sample_count *= 2
+
+        return selected if top_k_per_document else selected[:result_count]